@@ -1,6 +1,14 @@
 from .app import Mona
 from .rules import Rule
-from .runners import run_process, run_shell, run_thread
+from .runners import run_in_process, run_process, run_shell, run_thread
 from .sessions import Session
 
-__all__ = ['Rule', 'run_process', 'run_shell', 'run_thread', 'Session', 'Mona']
+__all__ = [
+    'Rule',
+    'run_process',
+    'run_shell',
+    'run_thread',
+    'run_in_process',
+    'Session',
+    'Mona',
+]
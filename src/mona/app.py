@@ -22,8 +22,11 @@ from typing import (
 
 import toml
 
+from .errors import MonaError
 from .files import File, HashedFile
-from .plugins import Cache, FileManager, Parallel, TmpdirManager
+from .hashing import DEFAULT_HASH_ALGORITHM, using_hash_algorithm
+from .plugins import Cache, FileManager, Parallel, Slurm, TmpdirManager
+from .pyhash import set_ast_cache
 from .remotes import Remote
 from .rules import Rule
 from .sessions import Session
@@ -49,6 +52,9 @@ class Mona:
     TMPDIR = 'tmpdir'
     FILES = 'files'
     CACHE = 'cache.db'
+    INDEX = 'index.db'
+    PYHASH = 'pyhash.db'
+    SLURM = 'slurm'
     LAST_ENTRY = 'LAST_ENTRY'
 
     def __init__(self, monadir: Pathable = None) -> None:
@@ -83,8 +89,23 @@ class Mona:
         args = [factory(arg_str) for factory, arg_str in zip(factories, arg_strings)]
         return rule(*args)
 
+    @property
+    def hash_algorithm(self) -> str:
+        """Hash algorithm recorded in the repository.
+
+        Repositories created before the algorithm was recorded use SHA-1.
+        """
+        if not self._configfile.exists():
+            return DEFAULT_HASH_ALGORITHM
+        with self._configfile.open() as f:
+            return cast(str, toml.load(f).get('hash_algorithm', DEFAULT_HASH_ALGORITHM))
+
     def create_session(self, warn: bool = False, **kwargs: Any) -> Session:
-        sess = Session(warn=warn)
+        sess = Session(
+            warn=warn,
+            hash_algorithm=self.hash_algorithm,
+            composite_threshold=self._config.get('composite_threshold'),
+        )
         self(sess, **kwargs)
         return sess
 
@@ -107,24 +128,51 @@ class Mona:
         ncores: int = None,
         write: str = 'eager',
         full_restore: bool = False,
+        cache: bool = True,
+        slurm: bool = False,
+        adaptive: bool = False,
+        pin_cores: bool = False,
     ) -> None:
+        set_ast_cache(self._monadir / Mona.PYHASH)
         self._plugins = {
-            'parallel': Parallel(ncores),
+            'parallel': Parallel(
+                ncores,
+                resources=self._config.get('resources'),
+                adaptive=adaptive,
+                pin_cores=pin_cores or self._config.get('pin_cores', False),
+            ),
             'tmpdir': TmpdirManager(self._monadir / Mona.TMPDIR),
-            'files': FileManager(self._monadir / Mona.FILES),
-            'cache': Cache.from_path(
-                self._monadir / Mona.CACHE, write=write, full_restore=full_restore
+            'files': FileManager(
+                self._monadir / Mona.FILES, index=self._monadir / Mona.INDEX
             ),
         }
+        if cache:
+            self._plugins['cache'] = Cache.from_path(
+                self._monadir / Mona.CACHE,
+                write=write,
+                full_restore=full_restore,
+                verify=self._config.get('verify_restored', 1.0),
+                spec_version=self._config.get('spec_version', 1),
+            )
+        if slurm:
+            self._plugins['slurm'] = Slurm(
+                self._monadir / Mona.SLURM, **self._config.get('slurm', {})
+            )
         for plugin in self._plugins.values():
             plugin(sess)
 
-    def ensure_initialized(self) -> None:
+    def ensure_initialized(self, hash_algorithm: str = None) -> None:
         if self._monadir.is_dir():
             log.info(f'Already initialized in {self._monadir}.')
+            if hash_algorithm and hash_algorithm != self.hash_algorithm:
+                raise MonaError(f'Repository already uses {self.hash_algorithm} hashes')
             return
         log.info(f'Initializing an empty repository in {self._monadir}.')
         self._monadir.mkdir()
+        with self.update_config() as config:
+            config['hash_algorithm'] = hash_algorithm or self._config.get(
+                'hash_algorithm', DEFAULT_HASH_ALGORITHM
+            )
         try:
             cache_home = Path(self._config['cache'])
         except KeyError:
@@ -138,6 +186,19 @@ class Mona:
                 (cachedir / dirname).mkdir()
                 (self._monadir / dirname).symlink_to(cachedir / dirname)
 
+    def fsck(self) -> Iterator[str]:
+        """Verify hashes of all cached objects and stored files.
+
+        Yield descriptions of found inconsistencies.
+        """
+        with using_hash_algorithm(self.hash_algorithm):
+            cache = Cache.from_path(self._monadir / Mona.CACHE)
+            try:
+                yield from cache.verify_all()
+            finally:
+                cache.db.close()
+            yield from FileManager(self._monadir / Mona.FILES).verify_all()
+
     @contextmanager
     def update_config(self) -> Iterator[MutableMapping[str, Any]]:
         if self._configfile.exists():
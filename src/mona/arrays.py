@@ -0,0 +1,91 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import json
+from typing import Iterable, List, Optional, Tuple, cast
+
+import numpy as np
+
+from .errors import CompositeError
+from .files import FileManager
+from .hashing import Hash, Hashed, HashedBytes, HashedComposite, HashResolver
+
+__all__ = ['HashedArray']
+
+
+@HashedComposite.register_type(np.ndarray)
+class HashedArray(Hashed[np.ndarray]):
+    """Numpy array hashed by its data type, shape and raw data.
+
+    With an active file manager, the data are stored as a file and arrays are
+    restored as read-only memory maps of that file, otherwise the data are
+    stored as a component of the hashed array.
+    """
+
+    def __init__(self, array: np.ndarray) -> None:
+        if array.dtype.hasobject or array.dtype.fields:
+            raise CompositeError(f'Unsupported array data type: {array.dtype}')
+        self._array = array
+        self._dtype: str = array.dtype.str
+        self._shape: Tuple[int, ...] = array.shape
+        data = np.ascontiguousarray(array).reshape(-1).view(np.uint8).data
+        fmngr = FileManager.active()
+        if fmngr:
+            self._content: Optional[HashedBytes] = None
+            self._content_hash = fmngr.store_bytes(data)
+        else:
+            self._content = HashedBytes(data.tobytes())
+            self._content_hash = self._content.hashid
+
+    @property
+    def spec(self) -> bytes:
+        return json.dumps([self._dtype, self._shape, self._content_hash]).encode()
+
+    @classmethod
+    def from_spec(cls, spec: bytes, resolve: HashResolver) -> HashedArray:
+        dtype_str, shape_list, content_hash = cast(
+            Tuple[str, List[int], Hash], json.loads(spec)
+        )
+        dtype, shape = np.dtype(dtype_str), tuple(shape_list)
+        fmngr = FileManager.active()
+        content: Optional[HashedBytes] = None
+        if fmngr:
+            path = fmngr.path_for(content_hash)
+            if path and dtype.itemsize * int(np.prod(shape)) > 0:
+                array = np.memmap(path, dtype, mode='r', shape=shape)
+            else:
+                array = np.frombuffer(fmngr.bytes_for(content_hash), dtype)
+        else:
+            content = cast(HashedBytes, resolve(content_hash))
+            array = np.frombuffer(content.value, dtype)
+        obj = cls.__new__(cls)
+        obj._array = array.reshape(shape)
+        obj._dtype, obj._shape = dtype_str, shape
+        obj._content, obj._content_hash = content, content_hash
+        return obj
+
+    @classmethod
+    def stored_contents(cls, spec: bytes) -> Iterable[Hash]:
+        _, _, content_hash = cast(Tuple[str, List[int], Hash], json.loads(spec))
+        return (content_hash,)
+
+    @property
+    def content_hash(self) -> Hash:
+        """Hash of the raw data."""
+        return self._content_hash
+
+    @property
+    def value(self) -> np.ndarray:
+        return self._array
+
+    @property
+    def label(self) -> str:
+        return f'<ndarray {np.dtype(self._dtype)} {self._shape}>'
+
+    @property
+    def components(self) -> Iterable[Hashed[object]]:
+        if self._content:
+            return (self._content,)
+        return ()
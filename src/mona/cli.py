@@ -1,6 +1,7 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import asyncio
 import logging
 import os
 import shutil
@@ -14,8 +15,11 @@ import click
 
 from .app import Mona
 from .dirtask import DirtaskInput, checkout_files
+from .distributed import Worker, parse_address
 from .files import File
 from .futures import STATE_COLORS, State
+from .hashing import HASH_ALGORITHMS
+from .plugins import Cache, Coordinator, Profiler, Tracer
 from .table import Table, lenstr
 from .tasks import Task
 from .utils import groupby, import_fullname, match_glob
@@ -52,10 +56,16 @@ def cli(ctx: click.Context, appname: str, debug: int) -> None:
 
 
 @cli.command()
+@click.option(
+    '--hash',
+    'hash_algorithm',
+    type=click.Choice(sorted(HASH_ALGORITHMS)),
+    help='Hash algorithm of the repository',
+)
 @click.pass_obj
-def init(app: Mona) -> None:
+def init(app: Mona, hash_algorithm: Optional[str]) -> None:
     """Initialize a Git repository."""
-    app.ensure_initialized()
+    app.ensure_initialized(hash_algorithm)
 
 
 class TaskFilter:
@@ -93,8 +103,16 @@ class ExceptionBuffer:
 @click.option('-p', '--pattern', multiple=True, help='Tasks to be executed')
 @click.option('-P', '--path', is_flag=True, help='Execute path-like tasks')
 @click.option('-j', '--cores', type=int, help='Number of cores')
+@click.option('--adaptive', is_flag=True, help='Adjust number of cores to load')
+@click.option('--pin-cores', is_flag=True, help='Pin subprocesses to their cores')
 @click.option('-l', '--limit', type=int, help='Limit number of tasks to N')
 @click.option('--maxerror', type=int, help='Number of errors in row to quit')
+@click.option('--trace', type=Path, help='Write a Chrome trace of the run')
+@click.option('--listen', metavar='[HOST:]PORT', help='Run tasks on connected workers')
+@click.option(
+    '--worker-timeout', type=float, default=60, help='Time to wait for a worker'
+)
+@click.option('--slurm', is_flag=True, help='Submit directory tasks to Slurm')
 @click.argument('entry')
 @click.argument('args', nargs=-1)
 @click.pass_obj
@@ -102,9 +120,15 @@ def run(
     app: Mona,
     pattern: List[str],
     cores: Optional[int],
+    adaptive: bool,
+    pin_cores: bool,
     path: bool,
     limit: Optional[int],
     maxerror: Optional[int],
+    trace: Optional[Path],
+    listen: Optional[str],
+    worker_timeout: float,
+    slurm: bool,
     entry: str,
     args: List[str],
 ) -> None:
@@ -112,18 +136,72 @@ def run(
     app.last_entry = entry_args = [entry, *args]
     task_filter = TaskFilter(pattern, no_path=not path)
     exception_buffer = ExceptionBuffer(maxerror)
-    with app.create_session(ncores=cores) as sess:
+    tracer = Tracer() if trace else None
+    sess = app.create_session(
+        ncores=cores, slurm=slurm, adaptive=adaptive, pin_cores=pin_cores
+    )
+    if tracer:
+        tracer(sess)
+    if listen:
+        Coordinator(*parse_address(listen), timeout=worker_timeout)(sess)
+    with sess:
         result = sess.eval(
             app.call_entry(*entry_args),
             exception_handler=exception_buffer,
             task_filter=task_filter,
             limit=limit,
         )
+    if tracer:
+        assert trace
+        tracer.save(trace)
+        log.info(f'Trace written to {trace}.')
     if app.get_entry(entry).stdout:
         log.info(f'Printing result to standard output.')
         print(result)
 
 
+@cli.command()
+@click.option('-j', '--cores', type=int, help='Number of cores')
+@click.option('-i', '--interval', type=float, default=1e-3, help='Sampling interval')
+@click.option(
+    '-o', '--output', type=Path, default=Path('profile.txt'), help='Output file'
+)
+@click.argument('entry')
+@click.argument('args', nargs=-1)
+@click.pass_obj
+def profile(
+    app: Mona,
+    cores: Optional[int],
+    interval: float,
+    output: Path,
+    entry: str,
+    args: List[str],
+) -> None:
+    """Run a given rule and write a profile in the collapsed-stack format."""
+    app.last_entry = entry_args = [entry, *args]
+    profiler = Profiler(interval)
+    with app.create_session(ncores=cores) as sess:
+        profiler(sess)
+        sess.eval(app.call_entry(*entry_args))
+    profiler.save(output)
+    log.info(f'Profile written to {output}.')
+
+
+@cli.command()
+@click.option('-j', '--cores', type=int, default=1, help='Number of cores')
+@click.option('--timeout', type=float, default=60, help='Time to wait for coordinator')
+@click.option('--pin-cores', is_flag=True, help='Pin subprocesses to their cores')
+@click.argument('address', metavar='[HOST:]PORT')
+@click.pass_obj
+def worker(
+    app: Mona, cores: int, timeout: float, pin_cores: bool, address: str
+) -> None:
+    """Run tasks received from a coordinator started with mona run --listen."""
+    host, port = parse_address(address)
+    with app.create_session(ncores=cores, cache=False, pin_cores=pin_cores):
+        asyncio.run(Worker(cores).run(host, port, timeout=timeout))
+
+
 @cli.command(context_settings={'ignore_unknown_options': True})
 @click.argument('profile')
 @click.option('-j', '--jobs', type=int, default=1, help='Number of launched workers')
@@ -301,10 +379,39 @@ def graph(app: Mona, file: Optional[Path]) -> None:
         shutil.move(tgt, file)
 
 
+@cli.command()
+@click.argument('pattern')
+@click.pass_obj
+def explain(app: Mona, pattern: str) -> None:
+    """Explain why tasks are not cached."""
+    with app.create_session(warn=False, write='never', full_restore=True) as sess:
+        app.call_last_entry()
+        tasks = [task for task in sess.all_tasks() if match_glob(task.label, pattern)]
+        if not tasks:
+            raise click.ClickException(f'No tasks matching {pattern!r}')
+        cache = cast(Cache, sess.storage['cache'])
+        for task in tasks:
+            for line in cache.explain(task):
+                click.echo(line)
+
+
+@cli.command()
+@click.pass_obj
+def fsck(app: Mona) -> None:
+    """Verify integrity of the cache and stored files."""
+    nerrors = 0
+    for error in app.fsck():
+        click.echo(error)
+        nerrors += 1
+    if nerrors:
+        raise click.ClickException(f'Found {nerrors} inconsistencies')
+    log.info('No inconsistencies found.')
+
+
 @cli.command()
 @click.option('-p', '--pattern', multiple=True, help='Tasks to be checked out')
 @click.option('--done', is_flag=True, help='Check out only finished tasks')
-@click.option('-c', '--copy', is_flag=True, help='Copy instead of symlinking')
+@click.option('-c', '--copy', is_flag=True, help='Copy instead of linking')
 @click.pass_obj
 def checkout(app: Mona, pattern: List[str], done: bool, copy: bool) -> None:
     """Checkout path-labeled tasks into a directory tree."""
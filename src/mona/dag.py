@@ -4,6 +4,7 @@
 from __future__ import annotations
 
 import asyncio
+from collections import deque
 from enum import Enum
 from typing import (
     Any,
@@ -90,6 +91,18 @@ class SetDeque(Deque[_T]):
         return x
 
 
+async def _get_result(
+    done: asyncio.Queue[NodeResult[_T]], idle: Optional[Callable[[bool], None]]
+) -> NodeResult[_T]:
+    if not idle or not done.empty():
+        return await done.get()
+    idle(True)
+    try:
+        return await done.get()
+    finally:
+        idle(False)
+
+
 async def traverse_async(
     start: Iterable[_T],
     edges_from: Callable[[_T], Iterable[_T]],
@@ -97,6 +110,7 @@ async def traverse_async(
     execute: NodeExecutor[_T],
     depth: bool = False,
     priority: Priority = default_priority,
+    idle: Callable[[bool], None] = None,
 ) -> AsyncIterator[Union[Step, NodeException]]:
     """Traverse a self-extending DAG, yield steps.
 
@@ -107,6 +121,8 @@ async def traverse_async(
                     with incoming edge from it (run only on scheduled nodes)
     :param depth: Traverse depth-first if true, breadth-first otherwise
     :param priority: Priorize steps in order
+    :param idle: Called with True when there is nothing to do but wait for
+                 executed nodes, and with False once a node finished
     """
     visited: Set[_T] = set()
     to_visit, to_execute = SetDeque[_T](), Deque[_T]()
@@ -142,7 +158,7 @@ async def traverse_async(
             extend_from(edges_from(node), to_visit, filter=visited)
         elif action is Action.RESULTS:
             yield Step(action, None, progress)
-            node, exc, nodes = await done.get()
+            node, exc, nodes = await _get_result(done, idle)
             if exc:
                 yield NodeException(node, exc)
             extend_from(nodes, to_visit, filter=visited)
@@ -165,8 +181,7 @@ def traverse(
 ) -> Iterator[_T]:
     """Traverse a DAG, yield visited notes."""
     visited: Set[_T] = set()
-    queue = Deque[_T]()
-    queue.extend(start)
+    queue: Deque[_T] = deque(start)
     while queue:
         n = queue.pop() if depth else queue.popleft()
         visited.add(n)
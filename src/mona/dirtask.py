@@ -13,6 +13,7 @@ from typing import (
     Iterable,
     List,
     Optional,
+    Set,
     Tuple,
     Union,
     cast,
@@ -90,15 +91,7 @@ class DirtaskTmpdir:
     def __exit__(self, exc_type: Any, *args: Any) -> None:
         try:
             if not exc_type:
-                self._outputs: Dict[str, File] = {}
-                for path in self._tmpdir.glob('**/*'):
-                    if not path.is_file():
-                        continue
-                    relpath = str(path.relative_to(self._tmpdir))
-                    if self._output_filter and not self._output_filter(relpath):
-                        continue
-                    file = File.from_path(path, self._tmpdir, keep=False)
-                    self._outputs[relpath] = file
+                self._outputs = collect_outputs(self._tmpdir, self._output_filter)
         finally:
             self._ctx.__exit__(exc_type, *args)
 
@@ -154,6 +147,41 @@ def validate_file_inputs(
     return exe, inputs
 
 
+def checkout_task_dir(
+    root: Path, exe: Any, raw_inputs: List[Any]
+) -> Tuple[File, Set[str]]:
+    """Validate inputs of a directory task and check them out in a directory.
+
+    Return the executable and the relative paths of all inputs.
+    """
+    exe, inputs = validate_file_inputs(exe, raw_inputs)
+    checkout_files(root, exe, inputs)
+    input_names = {
+        str(inp if isinstance(inp, File) else inp[0]) for inp in [exe, *inputs]
+    }
+    return exe, input_names
+
+
+def collect_outputs(
+    root: Path, output_filter: Callable[[str], bool] = None
+) -> Dict[str, File]:
+    """Store files in a directory in the file manager.
+
+    :param output_filter: true for files to be collected
+
+    Return the files by their relative paths.
+    """
+    outputs: Dict[str, File] = {}
+    for path in root.glob('**/*'):
+        if not path.is_file():
+            continue
+        relpath = str(path.relative_to(root))
+        if output_filter and not output_filter(relpath):
+            continue
+        outputs[relpath] = File.from_path(path, root, keep=False)
+    return outputs
+
+
 @Rule
 async def dir_task(exe: File, inputs: List[DirtaskInputRaw]) -> Dict[str, File]:
     """Create a rule with an executable and a files as inputs.
@@ -161,14 +189,12 @@ async def dir_task(exe: File, inputs: List[DirtaskInputRaw]) -> Dict[str, File]:
     The result of the task is a dictionary of all new files created by running
     the executable.
     """
-    exe, inputs = validate_file_inputs(exe, inputs)
-    input_names = {
-        str(inp if isinstance(inp, File) else inp[0]) for inp in [exe, *inputs]
-    }
-    ncores = cast(Optional[int], Session.active().running_task.storage.get('ncores'))
+    storage = Session.active().running_task.storage
+    ncores = cast(Optional[int], storage.get('ncores'))
+    resources = cast('Optional[Dict[str, float]]', storage.get('resources'))
     dirtask_tmpdir = DirtaskTmpdir(lambda p: p not in input_names)
     with dirtask_tmpdir as tmpdir:
-        checkout_files(tmpdir, exe, inputs)
+        exe, input_names = checkout_task_dir(tmpdir, exe, inputs)
         out_path, err_path = tmpdir / 'STDOUT', tmpdir / 'STDERR'
         try:
             with out_path.open('w') as stdout, err_path.open('w') as stderr:
@@ -178,6 +204,7 @@ async def dir_task(exe: File, inputs: List[DirtaskInputRaw]) -> Dict[str, File]:
                     stderr=stderr,
                     cwd=tmpdir,
                     ncores=ncores,
+                    resources=resources,
                 )
         except subprocess.CalledProcessError as e:
             if dirtask_tmpdir.has_tmpdir_manager():
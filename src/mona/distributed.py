@@ -0,0 +1,325 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+import asyncio
+import logging
+import pickle
+import struct
+from itertools import count
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    cast,
+)
+
+from .errors import MonaError
+from .hashing import (
+    Hash,
+    Hashed,
+    HashResolver,
+    InternTable,
+    hash_algorithm,
+    using_intern_table,
+)
+from .plugins.files import FileManager
+from .pyhash import hash_function
+from .rules import Rule
+from .sessions import Session
+from .tasks import Task
+from .utils import fullname_of, import_fullname
+
+__all__ = ()
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 47101
+HEADER = struct.Struct('!Q')
+
+ObjectRow = Tuple[Hash, str, bytes]
+# task hash, task metadata, task storage
+CreatedTask = Tuple[Hash, Optional[bytes], Dict[str, object]]
+RequestHandler = Callable[..., Awaitable[object]]
+# rule name, hash of its coroutine function, task label, objects, argument hashes
+TaskPayload = Tuple[str, Hash, str, List[ObjectRow], List[Hash]]
+
+
+class ConnectionLost(MonaError):
+    pass
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """Parse an address of the form ``[HOST:]PORT``."""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def rows_of(objs: Iterable[Hashed[object]]) -> List[ObjectRow]:
+    """Return specs of objects and all their components and task arguments."""
+    rows: Dict[Hash, ObjectRow] = {}
+    queue = list(objs)
+    while queue:
+        obj = queue.pop()
+        if obj.hashid in rows:
+            continue
+        rows[obj.hashid] = (obj.hashid, fullname_of(obj.__class__), obj.spec)
+        queue.extend(obj.args if isinstance(obj, Task) else obj.components)
+    return list(rows.values())
+
+
+def resolver_for(
+    rows: Sequence[ObjectRow],
+    register: Callable[[Hashed[object]], Hashed[object]] = None,
+) -> HashResolver:
+    """Create a resolver of objects from their specs.
+
+    :param register: callable that is passed each newly created object and
+                     returns the object to be used in its place
+    """
+    specs = {hashid: (typetag, spec) for hashid, typetag, spec in rows}
+    objs: Dict[Hash, Hashed[object]] = {}
+
+    def resolve(hashid: Hash) -> Hashed[object]:
+        obj = objs.get(hashid)
+        if obj:
+            return obj
+        typetag, spec = specs[hashid]
+        factory = cast(Type[object], import_fullname(typetag))
+        assert issubclass(factory, Hashed)
+        obj = factory.from_spec(spec, resolve)
+        assert obj.hashid == hashid
+        if register:
+            obj = register(obj)
+        objs[hashid] = obj
+        return obj
+
+    return resolve
+
+
+def file_hashes_of(rows: Sequence[ObjectRow]) -> List[Hash]:
+    """Return hashes of all contents stored in the file manager among objects."""
+    hashes: List[Hash] = []
+    for _, typetag, spec in rows:
+        factory = cast(Type[object], import_fullname(typetag))
+        assert issubclass(factory, Hashed)
+        hashes.extend(factory.stored_contents(spec))
+    return hashes
+
+
+class Channel:
+    """Bidirectional request-reply connection over an asyncio stream.
+
+    Messages are pickled, so channels should be used only on trusted networks.
+
+    :param handler: coroutine function called with the channel and the
+                    arguments of each received request, whose return value is
+                    sent back as a reply
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        handler: RequestHandler,
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._handler = handler
+        self._reqids = count()
+        self._replies: Dict[int, asyncio.Future[object]] = {}
+        self._handlers: Set[asyncio.Task[None]] = set()
+        self._closed = False
+
+    def __repr__(self) -> str:
+        peer = self._writer.get_extra_info('peername')
+        return f'<Channel peer={peer} closed={self._closed}>'
+
+    @property
+    def closed(self) -> bool:
+        """Whether the connection was closed."""
+        return self._closed
+
+    async def _send(self, msg: Tuple[int, str, object]) -> None:
+        if self._closed:
+            raise ConnectionLost(f'Connection closed: {self!r}')
+        data = pickle.dumps(msg)
+        self._writer.write(HEADER.pack(len(data)) + data)
+        await self._writer.drain()
+
+    async def request(self, *args: object) -> Any:
+        """Send a request and return the reply."""
+        reqid = next(self._reqids)
+        fut = self._replies[reqid] = asyncio.get_running_loop().create_future()
+        try:
+            await self._send((reqid, 'request', args))
+            return await fut
+        finally:
+            del self._replies[reqid]
+
+    async def _handle(self, reqid: int, args: Tuple[object, ...]) -> None:
+        try:
+            reply: Tuple[str, object] = ('reply', await self._handler(self, *args))
+        except Exception as exc:
+            reply = ('error', exc)
+        try:
+            await self._send((reqid, *reply))
+        except (pickle.PicklingError, AttributeError, TypeError, MonaError) as exc:
+            await self._send((reqid, 'error', MonaError(f'Cannot send reply: {exc}')))
+
+    async def serve(self) -> None:
+        """Receive messages until the connection is closed."""
+        try:
+            while True:
+                header = await self._reader.readexactly(HEADER.size)
+                (size,) = HEADER.unpack(header)
+                reqid, kind, payload = pickle.loads(
+                    await self._reader.readexactly(size)
+                )
+                if kind == 'request':
+                    handler = asyncio.create_task(self._handle(reqid, payload))
+                    self._handlers.add(handler)
+                    handler.add_done_callback(self._handlers.discard)
+                    continue
+                fut = self._replies.get(reqid)
+                if not fut or fut.done():
+                    continue
+                if kind == 'error':
+                    fut.set_exception(payload)
+                else:
+                    fut.set_result(payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._closed = True
+            for fut in self._replies.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionLost(f'Connection lost: {self!r}'))
+            for handler in self._handlers:
+                handler.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            self._writer.close()
+
+    def close(self) -> None:
+        """Close the connection."""
+        self._writer.close()
+
+
+async def fetch_blobs(channel: Channel, hashes: Iterable[Hash]) -> None:
+    """Fetch file contents missing in the active file manager from the peer."""
+    fmngr = FileManager.active()
+    assert fmngr
+    missing = [hashid for hashid in set(hashes) if hashid not in fmngr]
+    if not missing:
+        return
+    log.debug(f'Fetching {len(missing)} files from {channel!r}')
+    blobs: Dict[Hash, bytes] = await channel.request('blobs', missing)
+    for content in blobs.values():
+        fmngr.store_bytes(content)
+
+
+def blobs_for(hashes: Iterable[Hash]) -> Dict[Hash, bytes]:
+    """Return file contents from the active file manager."""
+    fmngr = FileManager.active()
+    assert fmngr
+    return {hashid: fmngr.bytes_for(hashid) for hashid in hashes}
+
+
+class Worker:
+    """Runs tasks received from a coordinator in the active session.
+
+    Tasks are run in the worker's own session, whose file manager is used to
+    store files, and missing file contents are fetched from the coordinator
+    on demand. Tasks created by a task are sent back to the coordinator
+    together with its result and removed from the session, as are objects
+    interned while running the task.
+
+    :param int ncores: number of tasks to be run concurrently
+    """
+
+    def __init__(self, ncores: int = 1) -> None:
+        self._ncores = ncores
+
+    async def _run_task(
+        self,
+        channel: Channel,
+        rule_name: str,
+        corohash: Hash,
+        label: str,
+        rows: List[ObjectRow],
+        arg_hashes: List[Hash],
+    ) -> Tuple[object, ...]:
+        rule = import_fullname(rule_name)
+        assert isinstance(rule, Rule)
+        if hash_function(rule.corofunc) != corohash:
+            raise MonaError(f'Rule {rule_name} differs from that of coordinator')
+        await fetch_blobs(channel, file_hashes_of(rows))
+        sess = Session.active()
+        # objects interned while running a task are released with the task
+        with using_intern_table(InternTable()):
+            resolve = resolver_for(rows)
+            args = [resolve(hashid) for hashid in arg_hashes]
+            task = Task(
+                rule.corofunc, *args, label=label, rule=rule.corofunc.__name__
+            )
+            log.info(f'Running {task}')
+            result = await sess.run_task_async(task)
+        created = sess.side_effects_of(task)
+        sess.forget(task)
+        created_rows: List[CreatedTask] = [
+            (t.hashid, t.metadata(), t.storage) for t in created
+        ]
+        if not isinstance(result, Hashed):
+            return ('object', result, rows_of(created), created_rows)
+        rows = rows_of([result, *created])
+        return ('hashed', result.hashid, rows, created_rows)
+
+    async def _handle(self, channel: Channel, command: str, *args: Any) -> object:
+        if command == 'run':
+            return await self._run_task(channel, *args)
+        if command == 'blobs':
+            return blobs_for(args[0])
+        raise MonaError(f'Unknown request: {command!r}')
+
+    async def _connect(
+        self, host: str, port: int, timeout: float
+    ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                return await asyncio.open_connection(host, port)
+            except OSError:
+                if loop.time() > deadline:
+                    raise
+            await asyncio.sleep(0.1)
+
+    async def run(
+        self, host: str, port: int = DEFAULT_PORT, timeout: float = 0
+    ) -> None:
+        """Serve a coordinator until it closes the connection.
+
+        :param str host: host of the coordinator
+        :param int port: port of the coordinator
+        :param float timeout: how long to keep trying to connect
+        """
+        reader, writer = await self._connect(host, port, timeout)
+        log.info(f'Connected to coordinator at {host}:{port}')
+        channel = Channel(reader, writer, self._handle)
+        async with Session.active().run_context():
+            serving = asyncio.create_task(channel.serve())
+            try:
+                await channel.request('hello', self._ncores, hash_algorithm())
+            except ConnectionLost:  # coordinator finished before greeting
+                pass
+            await serving
+        log.info('Coordinator closed connection')
@@ -3,10 +3,22 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
+import io
 import json
+import mmap
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Iterable, List, Optional, Tuple, Type, TypeVar, Union, cast
+from typing import (
+    BinaryIO,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
 from .hashing import Hash, Hashed, HashedBytes, HashedComposite, HashResolver
 from .rules import Rule
@@ -17,6 +29,7 @@ __version__ = '0.4.0'
 __all__ = ['file_collection', 'File']
 
 _FM = TypeVar('_FM', bound='FileManager')
+Buffer = Union[bytes, memoryview]
 
 
 @Rule
@@ -34,7 +47,7 @@ class FileManager(ABC):
         ...
 
     @abstractmethod
-    def store_bytes(self, content: bytes) -> Hash:
+    def store_bytes(self, content: Buffer) -> Hash:
         ...
 
     @abstractmethod
@@ -45,6 +58,28 @@ class FileManager(ABC):
     def target_in(self, path: Path, content_hash: Hash, *, mutable: bool) -> None:
         ...
 
+    def path_for(self, content_hash: Hash) -> Optional[Path]:
+        """Return a path of stored content that can be read directly if any."""
+        return None
+
+    def open_for(self, content_hash: Hash) -> BinaryIO:
+        """Return a binary file object with stored content."""
+        path = self.path_for(content_hash)
+        if path:
+            return path.open('rb')
+        return io.BytesIO(self.bytes_for(content_hash))
+
+    def memoryview_for(self, content_hash: Hash) -> memoryview:
+        """Return a read-only view of stored content, memory-mapped if possible."""
+        path = self.path_for(content_hash)
+        if path:
+            with path.open('rb') as f:
+                # empty files cannot be mapped
+                if f.seek(0, io.SEEK_END):
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    return memoryview(mm)
+        return memoryview(self.bytes_for(content_hash))
+
     @classmethod
     def active(cls: Type[_FM]) -> Optional[_FM]:
         fmngr = cast(Optional[_FM], Session.active().storage.get('file_manager'))
@@ -108,8 +143,28 @@ class File:
         """Return content of the file as string."""
         return self.read_bytes().decode()
 
+    def open(self) -> BinaryIO:
+        """Return a binary file object with content of the file.
+
+        Content stored by a file manager is read from the stored file as
+        needed rather than all at once.
+        """
+        if isinstance(self._content, bytes):
+            return io.BytesIO(self._content)
+        return self._fmngr.open_for(self._content)
+
+    def memoryview(self) -> memoryview:
+        """Return a read-only view of content of the file.
+
+        Content stored by a file manager is memory-mapped rather than copied
+        if possible.
+        """
+        if isinstance(self._content, bytes):
+            return memoryview(self._content)
+        return self._fmngr.memoryview_for(self._content)
+
     def target_in(self, path: Path, *, mutable: bool = False) -> None:
-        """Create an actual file or a symlink at the given location.
+        """Create an actual file or a link at the given location.
 
         :param Path path: where the file should be created
         :param bool mutable: whether the created file will be mutable
@@ -187,6 +242,11 @@ class HashedFile(Hashed[File]):
             file = File(path, cast(HashedBytes, resolve(content_hash)).value)
         return cls(file)
 
+    @classmethod
+    def stored_contents(cls, spec: bytes) -> Iterable[Hash]:
+        _, content_hash = cast(Tuple[str, Hash], json.loads(spec))
+        return (content_hash,)
+
     @property
     def value(self) -> File:
         return self._file
@@ -5,13 +5,20 @@ from __future__ import annotations
 
 import hashlib
 import json
+import struct
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, partial
+from importlib import import_module
 from typing import (
     Any,
     Callable,
     Dict,
     Generic,
     Iterable,
+    Iterator,
+    List,
     NewType,
     Optional,
     Set,
@@ -22,14 +29,16 @@ from typing import (
     cast,
 )
 
-from .json import ClassJSONDecoder, ClassJSONEncoder, JSONValue, validate_json
-from .utils import Literal, shorten_text
+from .errors import MonaError
+from .json import ClassJSONDecoder, JSONValue, encode_json
+from .utils import Literal, fullname_of, shorten_text
 
 __version__ = '0.2.0'
 __all__ = ()
 
 _T = TypeVar('_T')
 _T_co = TypeVar('_T_co', covariant=True)
+_H = TypeVar('_H', bound='Hashed[object]')
 Hash = NewType('Hash', str)
 # symbolic type for a JSON-like container including custom classes
 Composite = NewType('Composite', object)
@@ -37,10 +46,77 @@ HashResolver = Callable[[Hash], 'Hashed[object]']
 TypeRegister = Dict[Type[object], Callable[[Any], object]]
 
 
-def hash_text(text: Union[str, bytes]) -> Hash:
+# hashlib objects, whose type is private
+Hasher = Any
+HASH_ALGORITHMS: Dict[str, Callable[[], Hasher]] = {
+    'sha1': hashlib.sha1,
+    'blake2b': partial(hashlib.blake2b, digest_size=20),
+    'sha256': hashlib.sha256,
+}
+DEFAULT_HASH_ALGORITHM = 'sha1'
+
+_hash_algorithm: ContextVar[str] = ContextVar(
+    'hash_algorithm', default=DEFAULT_HASH_ALGORITHM
+)
+
+
+def hash_algorithm() -> str:
+    """Return the name of the active hash algorithm."""
+    return _hash_algorithm.get()
+
+
+@contextmanager
+def using_hash_algorithm(name: str) -> Iterator[None]:
+    """Activate a hash algorithm within a context.
+
+    :param str name: one of :data:`HASH_ALGORITHMS`
+    """
+    if name not in HASH_ALGORITHMS:
+        raise MonaError(f'Unknown hash algorithm: {name!r}')
+    token = _hash_algorithm.set(name)
+    try:
+        yield
+    finally:
+        _hash_algorithm.reset(token)
+
+
+_composite_threshold: ContextVar[Optional[int]] = ContextVar(
+    'composite_threshold', default=None
+)
+
+
+def composite_threshold() -> Optional[int]:
+    """Return the active size threshold of nested composites, if any."""
+    return _composite_threshold.get()
+
+
+@contextmanager
+def using_composite_threshold(threshold: Optional[int]) -> Iterator[None]:
+    """Hash nested composites separately within a context.
+
+    :param threshold: nested lists and dictionaries whose JSON encoding has at
+                      least this many characters are hashed as separate
+                      composites referenced by their hashes. If None, nested
+                      composites are always encoded inline.
+    """
+    token = _composite_threshold.set(threshold)
+    try:
+        yield
+    finally:
+        _composite_threshold.reset(token)
+
+
+def new_hasher() -> Hasher:
+    """Create a hashlib object of the active hash algorithm."""
+    return HASH_ALGORITHMS[_hash_algorithm.get()]()
+
+
+def hash_text(text: Union[str, bytes, memoryview]) -> Hash:
     if isinstance(text, str):
         text = text.encode()
-    return Hash(hashlib.sha1(text).hexdigest())
+    hasher = new_hasher()
+    hasher.update(text)
+    return Hash(hasher.hexdigest())
 
 
 class Hashed(ABC, Generic[_T_co]):
@@ -72,6 +148,14 @@ class Hashed(ABC, Generic[_T_co]):
         """
         return ()
 
+    @classmethod
+    def stored_contents(cls, spec: bytes) -> Iterable[Hash]:
+        """Hashes of contents in a file manager required by the constructor.
+
+        To be implemented by subclasses that store data in a file manager.
+        """
+        return ()
+
     def metadata(self) -> Optional[bytes]:
         return None
 
@@ -98,17 +182,81 @@ class Hashed(ABC, Generic[_T_co]):
         return self.hashid[:6]
 
 
+class InternTable:
+    """Table of hashed objects keyed by the ingredients of their hashes.
+
+    Structurally identical objects requested repeatedly are then constructed
+    and hashed only once. The number of such savings is kept in :attr:`hits`,
+    the number of constructed objects in :attr:`misses`.
+    """
+
+    def __init__(self) -> None:
+        self._objects: Dict[Tuple[object, ...], Hashed[object]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self) -> str:
+        return f'<InternTable hits={self.hits} misses={self.misses}>'
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def get(self, key: Tuple[object, ...], factory: Callable[[], _H]) -> _H:
+        """Return an object stored under a key, or create it by a factory."""
+        try:
+            obj = self._objects[key]
+        except KeyError:
+            obj = self._objects[key] = factory()
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cast(_H, obj)
+
+    def clear(self) -> None:
+        """Release all stored objects."""
+        self._objects.clear()
+
+
+_intern_table: ContextVar[Optional[InternTable]] = ContextVar(
+    'intern_table', default=None
+)
+
+
+@contextmanager
+def using_intern_table(table: InternTable) -> Iterator[None]:
+    """Intern hashed objects within a context."""
+    token = _intern_table.set(table)
+    try:
+        yield
+    finally:
+        _intern_table.reset(token)
+
+
+def interned(key: Tuple[object, ...], factory: Callable[[], _H]) -> _H:
+    """Return an interned object if there is an active intern table."""
+    table = _intern_table.get()
+    if table is None:
+        return factory()
+    return table.get(key, factory)
+
+
+# JSON specs start with "["
+PACKED_SPEC_MAGIC = b'\x00MC1'
+
+
 class HashedComposite(Hashed[Composite]):
     _type_register: TypeRegister = {}
+    # modules registering types of optional dependencies, imported on first use
+    _lazy_type_register: Dict[str, str] = {'numpy:ndarray': 'mona.arrays'}
+    _type_factories: Dict[Type[object], Optional[Callable[[Any], object]]] = {}
 
     def __init__(self, jsonstr: str, components: Iterable[Hashed[object]]) -> None:
         self._jsonstr = jsonstr
         self._components = {comp.hashid: comp for comp in components}
-        self._label = repr(self.resolve(lambda hashed: Literal(hashed.label)))
 
     @classmethod
     def from_object(cls, obj: object) -> HashedComposite:
-        return cls(*cls.parse_object(obj))
+        return hashed_scalar(obj) or cls._from_parts(*cls.parse_object(obj))
 
     @property
     def value(self) -> Composite:
@@ -120,15 +268,51 @@ class HashedComposite(Hashed[Composite]):
     def spec(self) -> bytes:
         return json.dumps([self._jsonstr, *sorted(self._components)]).encode()
 
+    @property
+    def packed_spec(self) -> bytes:
+        """Compact binary form of the spec, see :meth:`unpack_spec`."""
+        hashids = sorted(self._components)
+        digest_size = len(hashids[0]) // 2 if hashids else 0
+        return b''.join(
+            [
+                PACKED_SPEC_MAGIC,
+                struct.pack('<IB', len(self._jsonstr), digest_size),
+                self._jsonstr.encode(),
+                *(bytes.fromhex(h) for h in hashids),
+            ]
+        )
+
+    @staticmethod
+    def unpack_spec(spec: bytes) -> Tuple[str, List[Hash]]:
+        """Return the canonical JSON and component hashes of a spec.
+
+        Accepts both the JSON spec, from which the hash is calculated, and the
+        packed spec, which stores the canonical JSON as raw ASCII and the
+        hashes as raw digests.
+        """
+        if not spec.startswith(PACKED_SPEC_MAGIC):
+            jsonstr, *hashids = json.loads(spec)
+            return jsonstr, hashids
+        start = len(PACKED_SPEC_MAGIC) + struct.calcsize('<IB')
+        size, digest_size = struct.unpack_from('<IB', spec, len(PACKED_SPEC_MAGIC))
+        end = start + size
+        jsonstr = spec[start:end].decode()
+        digests = memoryview(spec)[end:]
+        hashids = [
+            Hash(digests[i:][:digest_size].hex())
+            for i in range(0, len(digests), digest_size or 1)
+        ]
+        return jsonstr, hashids
+
     @classmethod
     def from_spec(cls, spec: bytes, resolve: HashResolver) -> HashedComposite:
-        jsonstr: str
-        hashids: Tuple[Hash, ...]
-        jsonstr, *hashids = json.loads(spec)
+        jsonstr, hashids = cls.unpack_spec(spec)
         return cls(jsonstr, (resolve(h) for h in hashids))
 
     @property
     def label(self) -> str:
+        if not hasattr(self, '_label'):
+            self._label = repr(self.resolve(lambda hashed: Literal(hashed.label)))
         return self._label
 
     @property
@@ -147,10 +331,28 @@ class HashedComposite(Hashed[Composite]):
             Composite, json.loads(self._jsonstr, hook=hook, cls=ClassJSONDecoder)
         )
 
+    @classmethod
+    def _factory_for(cls, klass: Type[object]) -> Optional[Callable[[Any], object]]:
+        try:
+            return cls._type_factories[klass]
+        except KeyError:
+            pass
+        factory: Optional[Callable[[Any], object]] = None
+        for base in klass.__mro__:
+            module = cls._lazy_type_register.pop(fullname_of(base), None)
+            if module:
+                import_module(module)
+            if base in cls._type_register:
+                factory = cls._type_register[base]
+                break
+        cls._type_factories[klass] = factory
+        return factory
+
     @classmethod
     def _wrap_type(cls, obj: _T) -> Union[_T, Hashed[_T]]:
-        if obj.__class__ in cls._type_register:
-            return cast(Hashed[_T], cls._type_register[obj.__class__](obj))
+        factory = cls._factory_for(obj.__class__)
+        if factory:
+            return cast(Hashed[_T], factory(obj))
         return obj
 
     @classmethod
@@ -161,25 +363,66 @@ class HashedComposite(Hashed[Composite]):
                 return (o, 'Hashed', {'hashid': o.hashid})
             return None
 
-        classes = tuple(cls._type_register) + (Hashed,)
-        validate_json(obj, lambda x: isinstance(x, classes))
+        def split(
+            jsonstr: str, tape: Set[object]
+        ) -> Tuple[object, str, Dict[str, JSONValue]]:
+            child = cls._from_parts(jsonstr, cast(Set[Hashed[object]], tape))
+            return (child, 'Hashed', {'hashid': child.hashid})
+
         components: Set[Hashed[object]] = set()
-        jsonstr = json.dumps(
-            obj, sort_keys=True, tape=components, default=default, cls=ClassJSONEncoder
-        )
+        threshold = composite_threshold()
+        if threshold is None:
+            jsonstr = encode_json(obj, cast(Set[object], components), default)
+        else:
+            jsonstr = encode_json(
+                obj, cast(Set[object], components), default, split, threshold
+            )
         return jsonstr, components
 
+    @classmethod
+    def _from_parts(
+        cls, jsonstr: str, components: Set[Hashed[object]]
+    ) -> HashedComposite:
+        # components are fully determined by their hashes in jsonstr
+        return interned(
+            (HashedComposite, jsonstr), lambda: HashedComposite(jsonstr, components)
+        )
+
     @classmethod
     def register_type(
         cls, klass: Type[_T]
     ) -> Callable[[Type[Hashed[_T]]], Type[Hashed[_T]]]:
         def decorator(hashed_klass: Type[Hashed[_T]]) -> Type[Hashed[_T]]:
             cls._type_register[klass] = hashed_klass
+            cls._type_factories.clear()
             return hashed_klass
 
         return decorator
 
 
+SCALAR_TYPES = (type(None), bool, int, float)
+MAX_MEMO_STRING = 64
+
+
+@lru_cache(maxsize=2 ** 16)
+def _hashed_scalar(jsonstr: str, algorithm: str) -> HashedComposite:
+    obj = HashedComposite(jsonstr, ())
+    assert obj.hashid  # computed with the algorithm in the key
+    return obj
+
+
+def hashed_scalar(obj: object) -> Optional[HashedComposite]:
+    """Return a memoized composite of a scalar or a short string.
+
+    Return None for other objects.
+    """
+    if obj.__class__ in SCALAR_TYPES or (
+        obj.__class__ is str and len(obj) <= MAX_MEMO_STRING
+    ):
+        return _hashed_scalar(json.dumps(obj), hash_algorithm())
+    return None
+
+
 @HashedComposite.register_type(bytes)
 class HashedBytes(Hashed[bytes]):
     def __init__(self, content: bytes) -> None:
@@ -2,12 +2,14 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import json
+from json.encoder import encode_basestring_ascii
 from pathlib import PosixPath
 from typing import (
     Any,
     Callable,
     Dict,
     Iterable,
+    List,
     NewType,
     Optional,
     Set,
@@ -30,6 +32,7 @@ JSONValue = Union[None, bool, int, float, str, JSONContainer]
 JSONConverter = Callable[[_T], Dict[str, JSONValue]]
 JSONAdapter = Callable[[Dict[str, JSONValue]], _T]
 JSONDefault = Callable[[object], Optional[Tuple[object, str, Dict[str, JSONValue]]]]
+JSONSplit = Callable[[str, Set[object]], Tuple[object, str, Dict[str, JSONValue]]]
 JSONHook = Callable[[str, Dict[str, JSONValue]], Union[_T, Dict[str, JSONValue]]]
 ClassRegister = Dict[Type[object], Tuple[JSONConverter[Any], JSONAdapter[object]]]
 
@@ -65,6 +68,155 @@ def validate_json(obj: object, hook: Callable[[object], bool] = None) -> None:
         pass
 
 
+def _float_str(o: float) -> str:
+    if o != o:
+        return 'NaN'
+    if o == float('inf'):
+        return 'Infinity'
+    if o == -float('inf'):
+        return '-Infinity'
+    return float.__repr__(o)
+
+
+_SCALAR_TYPES = {str, int, float, bool, type(None)}
+
+
+class _CanonicalEncoder:
+    def __init__(
+        self,
+        tape: Set[object],
+        default: JSONDefault,
+        split: Optional[JSONSplit] = None,
+        threshold: int = 0,
+    ) -> None:
+        self._tape = tape
+        self._default = default
+        self._split = split
+        self._threshold = threshold
+        self._depth = 0
+        self._classes = tuple(registered_classes)
+        self._chunks: List[str] = []
+        self._markers: Set[int] = set()
+
+    def __call__(self, obj: object) -> str:
+        self._encode(obj)
+        return ''.join(self._chunks)
+
+    def _encode(self, o: object) -> None:
+        append = self._chunks.append
+        if isinstance(o, str):
+            append(encode_basestring_ascii(o))
+        elif o is None:
+            append('null')
+        elif o is True:
+            append('true')
+        elif o is False:
+            append('false')
+        elif isinstance(o, int):
+            append(int.__repr__(o))
+        elif isinstance(o, float):
+            append(_float_str(o))
+        elif isinstance(o, (list, dict)):
+            if self._split and self._depth > 0 and o:
+                self._encode_split(o)
+            elif isinstance(o, list):
+                self._encode_list(o)
+            else:
+                self._encode_dict(o)
+        elif isinstance(o, self._classes):
+            enc, _ = registered_classes[o.__class__]
+            self._encode_dict({'_type': o.__class__.__name__, **enc(o)})
+        else:
+            encoded = self._default(o)
+            if encoded is None:
+                raise CompositeError(f'Unknown object: {o!r}')
+            o, type_tag, dct = encoded
+            self._tape.add(o)
+            self._encode_dict({'_type': type_tag, **dct})
+
+    def _encode_split(self, o: Union[List[object], Dict[str, object]]) -> None:
+        assert self._split
+        chunks, tape = self._chunks, self._tape
+        self._chunks, self._tape = [], set()
+        try:
+            if isinstance(o, list):
+                self._encode_list(o)
+            else:
+                self._encode_dict(o)
+            jsonstr, child_tape = ''.join(self._chunks), self._tape
+        finally:
+            self._chunks, self._tape = chunks, tape
+        if len(jsonstr) < self._threshold:
+            chunks.append(jsonstr)
+            tape.update(child_tape)
+            return
+        child, type_tag, dct = self._split(jsonstr, child_tape)
+        tape.add(child)
+        self._encode_dict({'_type': type_tag, **dct})
+
+    def _enter(self, o: object) -> None:
+        if id(o) in self._markers:
+            raise ValueError('Circular reference detected')
+        self._markers.add(id(o))
+        self._depth += 1
+
+    def _exit(self, o: object) -> None:
+        self._markers.remove(id(o))
+        self._depth -= 1
+
+    def _encode_list(self, o: List[object]) -> None:
+        append = self._chunks.append
+        if all(item.__class__ in _SCALAR_TYPES for item in o):
+            append(json.dumps(o))
+            return
+        self._enter(o)
+        append('[')
+        for i, item in enumerate(o):
+            if i:
+                append(', ')
+            self._encode(item)
+        append(']')
+        self._exit(o)
+
+    def _encode_dict(self, o: Dict[str, object]) -> None:
+        self._enter(o)
+        for key in o:
+            if not isinstance(key, str):
+                raise CompositeError('Dict keys must be strings')
+        append = self._chunks.append
+        append('{')
+        for i, key in enumerate(sorted(o)):
+            if i:
+                append(', ')
+            append(encode_basestring_ascii(key))
+            append(': ')
+            self._encode(o[key])
+        append('}')
+        self._exit(o)
+
+
+def encode_json(
+    obj: object,
+    tape: Set[object],
+    default: JSONDefault,
+    split: JSONSplit = None,
+    threshold: int = 0,
+) -> str:
+    """Validate and encode an object in a single pass.
+
+    The result is identical to that of :func:`validate_json` followed by
+    :func:`json.dumps` with ``sort_keys=True`` and :class:`ClassJSONEncoder`,
+    except that validation errors are raised as soon as they are encountered.
+
+    :param split: if given, called with the encoding of each nested list or
+                  dictionary at least ``threshold`` characters long and the
+                  objects put on the tape while encoding it, and returns an
+                  object to be encoded in its place in the same way as
+                  ``default``
+    """
+    return _CanonicalEncoder(tape, default, split, threshold)(obj)
+
+
 class ClassJSONEncoder(json.JSONEncoder):
     def __init__(
         self, *args: Any, tape: Set[object], default: JSONDefault, **kwargs: Any
@@ -103,11 +255,10 @@ class ClassJSONDecoder(json.JSONDecoder):
         }
 
     def _my_object_hook(self, dct: Dict[str, JSONValue]) -> object:
-        try:
-            type_tag = dct.pop('_type')
-            assert isinstance(type_tag, str)
-        except KeyError:
+        if '_type' not in dct:
             return dct
+        type_tag = dct.pop('_type')
+        assert isinstance(type_tag, str)
         if type_tag in self._default_decs:
             return self._default_decs[type_tag](dct)
         return self._hook(type_tag, dct)
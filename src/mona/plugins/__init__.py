@@ -1,6 +1,19 @@
 from .cache import Cache
+from .coordinator import Coordinator
 from .files import FileManager
 from .parallel import Parallel
+from .profiler import Profiler
+from .slurm import Slurm
 from .tmpdir import TmpdirManager
+from .tracer import Tracer
 
-__all__ = ['Parallel', 'Cache', 'FileManager', 'TmpdirManager']
+__all__ = [
+    'Parallel',
+    'Cache',
+    'FileManager',
+    'TmpdirManager',
+    'Profiler',
+    'Tracer',
+    'Coordinator',
+    'Slurm',
+]
@@ -3,8 +3,10 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
+import json
 import logging
 import pickle
+import random
 import sqlite3
 from contextlib import contextmanager
 from enum import Enum
@@ -12,11 +14,13 @@ from weakref import WeakValueDictionary
 from typing import (
     Any,
     Dict,
+    Iterable,
     Iterator,
     List,
     NamedTuple,
     Optional,
     Sequence,
+    Set,
     Tuple,
     Type,
     TypeVar,
@@ -24,8 +28,19 @@ from typing import (
     cast,
 )
 
+from ..errors import MonaError
 from ..futures import Future, State
-from ..hashing import Hash, Hashed
+from ..hashing import (
+    DEFAULT_HASH_ALGORITHM,
+    PACKED_SPEC_MAGIC,
+    Hash,
+    Hashed,
+    HashedComposite,
+    composite_threshold,
+    hash_algorithm,
+    hash_text,
+)
+from ..pyhash import diff_functions, function_specs
 from ..sessions import Session, SessionPlugin, TaskExecuted, TaskExecutor
 from ..tasks import Task
 from ..utils import Pathable, fullname_of, get_timestamp, import_fullname
@@ -36,6 +51,7 @@ log = logging.getLogger(__name__)
 
 _T_co = TypeVar('_T_co', covariant=True)
 WeakDict = WeakValueDictionary
+SQLITE_MAX_VARS = 999
 
 
 class TaskRow(NamedTuple):
@@ -83,18 +99,47 @@ class WriteAccess(Enum):
 
 
 class Cache(SessionPlugin):
-    """Plugin that caches tasks and objects in a session to an SQLite database."""
+    """Plugin that caches tasks and objects in a session to an SQLite database.
+
+    :param db: database connection
+    :param str write: when to write to the database, one of ``'eager'``,
+                      ``'on_exit'``, or ``'never'``
+    :param bool full_restore: restore also tasks that have finished
+    :param float verify: fraction of restored objects whose hashes are
+                         recomputed and checked. The remaining objects adopt
+                         the stored hashes, see :meth:`verify_all` for an
+                         offline check of the whole database
+    :param int spec_version: 1 stores specs of composites as JSON, 2 in the
+                             packed binary form, see
+                             :meth:`~mona.hashing.HashedComposite.unpack_spec`.
+                             Both can be read, and hashes do not depend on it
+
+    The hash algorithm and the composite threshold of a session, which both
+    determine hashes, are recorded in a new database. Sessions with other
+    settings are refused.
+    """
 
     name = 'db_cache'
 
     def __init__(
-        self, db: sqlite3.Connection, write: str = 'eager', full_restore: bool = False
+        self,
+        db: sqlite3.Connection,
+        write: str = 'eager',
+        full_restore: bool = False,
+        verify: float = 1.0,
+        spec_version: int = 1,
     ) -> None:
         self._db = db
         self._objects: Dict[Hash, Hashed[object]] = {}
         self._object_cache: WeakDict[Hash, Hashed[object]] = WeakDict()
+        self._factories: Dict[str, Type[Hashed[object]]] = {}
         self._write = WriteAccess[write.upper()]
         self._full_restore = full_restore
+        self._verify = verify
+        if spec_version not in {1, 2}:
+            raise MonaError(f'Unknown spec version: {spec_version}')
+        self._packed = spec_version == 2
+        self._stored_functions: Set[Hash] = set()
 
     def __repr__(self) -> str:
         return f'<Cache nobjects={len(self._objects)}>'
@@ -104,11 +149,29 @@ class Cache(SessionPlugin):
         """Database connection."""
         return self._db
 
+    def _spec_of(self, obj: Hashed[object]) -> bytes:
+        if self._packed and isinstance(obj, HashedComposite):
+            return obj.packed_spec
+        return obj.spec
+
     def _store_objects(self, objs: Sequence[Hashed[object]]) -> None:
         obj_rows = [
-            ObjectRow(obj.hashid, fullname_of(obj.__class__), obj.spec) for obj in objs
+            ObjectRow(obj.hashid, fullname_of(obj.__class__), self._spec_of(obj))
+            for obj in objs
         ]
         self._db.executemany('INSERT OR IGNORE INTO objects VALUES (?,?,?)', obj_rows)
+        self._store_functions(obj for obj in objs if isinstance(obj, Task))
+
+    def _store_functions(self, tasks: Iterable[Task[object]]) -> None:
+        specs: Dict[Hash, str] = {}
+        corohashes = {task.corohash for task in tasks}
+        for corohash in {h for hs in corohashes for h in hs.split(',')}:
+            if corohash not in self._stored_functions:
+                specs.update(function_specs(Hash(corohash)))
+        self._db.executemany(
+            'INSERT OR IGNORE INTO functions VALUES (?,?)', specs.items()
+        )
+        self._stored_functions.update(specs)
 
     def _store_targets(self, objs: Sequence[Hashed[object]]) -> None:
         sessionid = cast(int, Session.active().storage['cache:sessionid'])
@@ -174,14 +237,23 @@ class Cache(SessionPlugin):
         assert raw_row
         return TargetRow(*raw_row)
 
-    def _object_factory_for(self, hashid: Hash) -> Tuple[bytes, Type[Hashed[object]]]:
+    def _object_row_for(self, hashid: Hash) -> Optional[ObjectRow]:
         raw_row = self._db.execute(
             'SELECT * FROM objects WHERE hashid = ?', (hashid,)
         ).fetchone()
-        assert raw_row
-        row = ObjectRow(*raw_row)
-        factory = cast(Type[object], import_fullname(row.typetag))
-        assert issubclass(factory, Hashed)
+        if not raw_row:
+            return None
+        return ObjectRow(*raw_row)
+
+    def _object_factory_for(self, hashid: Hash) -> Tuple[bytes, Type[Hashed[object]]]:
+        row = self._object_row_for(hashid)
+        assert row
+        try:
+            factory = self._factories[row.typetag]
+        except KeyError:
+            klass = cast(Type[object], import_fullname(row.typetag))
+            assert issubclass(klass, Hashed)
+            factory = self._factories[row.typetag] = klass
         return row.spec, factory
 
     def _object_for(self, hashid: Hash) -> Hashed[object]:
@@ -196,7 +268,10 @@ class Cache(SessionPlugin):
                 obj = CachedTask(hashid)
         if not obj:
             obj = factory.from_spec(spec, self._object_for)
-        assert hashid == obj.hashid
+        if self._verify >= 1 or random.random() < self._verify:
+            assert hashid == obj.hashid
+        else:
+            obj._hashid = hashid  # trust the database
         metadata = self._target_row_for(hashid).metadata
         if metadata is not None:
             obj.set_metadata(metadata)
@@ -263,31 +338,102 @@ class Cache(SessionPlugin):
         )
         sess.storage['cache:sessionid'] = cur.lastrowid
 
+    def _recorded_setting(self, key: str, value: str, legacy: str) -> str:
+        # record the setting of a new cache, caches created before the setting
+        # was recorded used the legacy value
+        row = self._db.execute(
+            'SELECT value FROM settings WHERE key = ?', (key,)
+        ).fetchone()
+        if row:
+            return cast(str, row[0])
+        populated = self._db.execute('SELECT 1 FROM objects LIMIT 1').fetchone()
+        recorded = legacy if populated else value
+        self._db.execute('INSERT INTO settings VALUES (?,?)', (key, recorded))
+        self._db.commit()
+        return recorded
+
+    def _check_hash_algorithm(self) -> None:
+        algorithm = self._recorded_setting(
+            'hash_algorithm', hash_algorithm(), DEFAULT_HASH_ALGORITHM
+        )
+        if algorithm != hash_algorithm():
+            raise MonaError(
+                f'Cache uses {algorithm} hashes, session uses {hash_algorithm()}'
+            )
+
+    def _check_composite_threshold(self) -> None:
+        threshold = json.loads(
+            self._recorded_setting(
+                'composite_threshold', json.dumps(composite_threshold()), 'null'
+            )
+        )
+        if threshold != composite_threshold():
+            raise MonaError(
+                f'Cache uses composite threshold {threshold}, '
+                f'session uses {composite_threshold()}'
+            )
+
     def post_enter(self, sess: Session) -> None:  # noqa: D102
+        self._check_hash_algorithm()
+        self._check_composite_threshold()
+        sess.storage['cache'] = self
         if self._write is WriteAccess.EAGER:
             self._store_session(sess)
 
+    def _restore_tasks(self, tasks: Sequence[Task[object]]) -> List[Task[object]]:
+        self._to_restore = list(reversed(tasks))
+        restored: List[Task[object]] = []
+        while self._to_restore:
+            t = self._to_restore.pop()
+            self._restore_task(t)
+            restored.append(t)
+        del self._to_restore
+        return restored
+
+    def _insert_tasks(self, tasks: Sequence[Task[object]]) -> None:
+        self._db.executemany(
+            'INSERT INTO tasks VALUES (?,?,?,?,?)',
+            (TaskRow(task.hashid, task.state.name) for task in tasks),
+        )
+        self._store_objects(tasks)
+
     def post_create(self, task: Task[object]) -> None:  # noqa: D102
         row = self._task_row_for(task.hashid)
         if row:
-            self._to_restore = [task]
-            tasks: List[Task[object]] = []
-            while self._to_restore:
-                t = self._to_restore.pop()
-                self._restore_task(t)
-                tasks.append(t)
-            del self._to_restore
+            tasks = self._restore_tasks([task])
         elif self._write is WriteAccess.EAGER:
             tasks = [task]
-            self._db.execute(
-                'INSERT INTO tasks VALUES (?,?,?,?,?)',
-                TaskRow(task.hashid, task.state.name),
-            )
-            self._store_objects(tasks)
+            self._insert_tasks(tasks)
         if self._write is WriteAccess.EAGER:
             self._store_targets(tasks)
             self._db.commit()
 
+    def _stored_task_hashes(self, hashids: Sequence[Hash]) -> Set[Hash]:
+        stored: Set[Hash] = set()
+        for start in range(0, len(hashids), SQLITE_MAX_VARS):
+            end = start + SQLITE_MAX_VARS
+            chunk = hashids[start:end]
+            stored.update(
+                hashid
+                for hashid, in self._db.execute(
+                    'SELECT hashid FROM tasks WHERE hashid IN '
+                    f'({",".join(len(chunk) * "?")})',
+                    chunk,
+                )
+            )
+        return stored
+
+    def post_create_tasks(self, tasks: Sequence[Task[object]]) -> None:  # noqa: D102
+        stored = self._stored_task_hashes([task.hashid for task in tasks])
+        new_tasks = [task for task in tasks if task.hashid not in stored]
+        restored = self._restore_tasks(
+            [task for task in tasks if task.hashid in stored]
+        )
+        if self._write is WriteAccess.EAGER:
+            self._insert_tasks(new_tasks)
+            self._store_targets([*restored, *new_tasks])
+            self._db.commit()
+
     def post_task_run(self, task: Task[object]) -> None:  # noqa: D102
         if self._write is not WriteAccess.EAGER:
             return
@@ -311,6 +457,100 @@ class Cache(SessionPlugin):
         self._objects.clear()
         self._db.commit()
 
+    def verify_all(self) -> Iterator[str]:
+        """Recompute hashes of all stored objects and check references of tasks.
+
+        Yield descriptions of found inconsistencies.
+        """
+        hashids: Set[Hash] = set()
+        for hashid, typetag, spec in self._db.execute('SELECT * FROM objects'):
+            hashids.add(hashid)
+            if isinstance(spec, bytes) and spec.startswith(PACKED_SPEC_MAGIC):
+                jsonstr, components = HashedComposite.unpack_spec(spec)
+                spec = json.dumps([jsonstr, *components]).encode()
+            if hash_text(spec) != hashid:
+                yield f'Object {hashid} ({typetag}) does not match its hash'
+        for row in self._db.execute('SELECT * FROM tasks'):
+            task_row = TaskRow(*row)
+            if task_row.hashid not in hashids:
+                yield f'Task {task_row.hashid} is missing its object'
+            if task_row.result_type == ResultType.HASHED.name:
+                result = cast(Hash, task_row.result)
+                if result not in hashids:
+                    yield f'Task {task_row.hashid} is missing result {result}'
+            for child in filter(None, (task_row.side_effects or '').split(',')):
+                if child not in hashids:
+                    yield f'Task {task_row.hashid} is missing side effect {child}'
+
+    def _function_spec_for(self, hashid: Hash) -> Optional[str]:
+        row = self._db.execute(
+            'SELECT spec FROM functions WHERE hashid = ?', (hashid,)
+        ).fetchone()
+        return cast(str, row[0]) if row else None
+
+    def explain(self, task: Task[object]) -> Iterator[str]:
+        """Describe why a task is not in the cache.
+
+        The task is compared to the most recently stored task with the same
+        label, recursing into changed arguments that are tasks.
+        """
+        if self._task_row_for(task.hashid):
+            yield f'{task}: cached'
+            return
+        raw_row = self._db.execute(
+            'SELECT objectid FROM targets WHERE label = ? '
+            'ORDER BY sessionid DESC LIMIT 1',
+            (task.label,),
+        ).fetchone()
+        if not raw_row:
+            yield f'{task}: no stored task with this label'
+            return
+        yield from self._explain(raw_row[0], task)
+
+    def _explain(self, old: Hash, task: Task[object]) -> Iterator[str]:
+        yield f'{task.label}: {old[:6]} -> {task.tag}'
+        row = self._object_row_for(old)
+        assert row
+        old_rule, old_corohash, *old_args = json.loads(row.spec)
+        rule, corohash, *args = json.loads(task.spec)
+        if old_rule != rule:
+            yield f'  rule changed: {old_rule} -> {rule}'
+        elif old_corohash != corohash:
+            yield f'  function {rule} changed'
+            for line in self._explain_function(old_corohash, corohash):
+                yield f'    {line}'
+        if len(old_args) != len(args):
+            yield f'  number of arguments changed: {len(old_args)} -> {len(args)}'
+            return
+        for i, (old_arg, arg) in enumerate(zip(old_args, task.args)):
+            if old_arg != arg.hashid:
+                yield from self._explain_arg(i, old_arg, arg)
+
+    def _explain_function(self, old: str, new: str) -> Iterator[str]:
+        old_hashes, new_hashes = old.split(','), new.split(',')
+        if len(old_hashes) != len(new_hashes):
+            yield 'batch implementation added or removed'
+        for old_hash, new_hash in zip(old_hashes, new_hashes):
+            if old_hash != new_hash:
+                yield from diff_functions(
+                    Hash(old_hash), Hash(new_hash), self._function_spec_for
+                )
+
+    def _explain_arg(self, i: int, old: Hash, arg: Hashed[object]) -> Iterator[str]:
+        row = self._object_row_for(old)
+        old_type = self._object_factory_for(old)[1] if row else None
+        if isinstance(arg, Task) and old_type is Task:
+            for line in self._explain(old, arg):
+                yield f'  {line}'
+            return
+        yield f'  argument {i} changed: {old[:6]} -> {arg}'
+        if row and isinstance(arg, HashedComposite) and old_type:
+            if issubclass(old_type, HashedComposite):
+                _, old_components = HashedComposite.unpack_spec(row.spec)
+                for comp in arg.components:
+                    if comp.hashid not in old_components:
+                        yield f'    new component: {comp}'
+
     @contextmanager
     def _db_lock(self) -> Iterator[None]:
         self._db.execute('BEGIN IMMEDIATE TRANSACTION')
@@ -357,6 +597,22 @@ CREATE TABLE IF NOT EXISTS tasks (
     result       BLOB,
         FOREIGN KEY (hashid) REFERENCES objects(hashid)
 )
+"""
+        )
+        db.execute(
+            """\
+CREATE TABLE IF NOT EXISTS functions (
+    hashid TEXT PRIMARY KEY,
+    spec   TEXT
+)
+"""
+        )
+        db.execute(
+            """\
+CREATE TABLE IF NOT EXISTS settings (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+)
 """
         )
         db.execute(
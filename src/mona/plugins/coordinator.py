@@ -0,0 +1,207 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, cast
+
+from ..distributed import (
+    DEFAULT_PORT,
+    Channel,
+    ConnectionLost,
+    CreatedTask,
+    ObjectRow,
+    TaskPayload,
+    blobs_for,
+    fetch_blobs,
+    file_hashes_of,
+    resolver_for,
+    rows_of,
+)
+from ..errors import MonaError
+from ..files import FileManager
+from ..hashing import Hash, Hashed, HashResolver, hash_algorithm
+from ..pyhash import hash_function
+from ..sessions import Session, SessionPlugin, TaskRunner
+from ..tasks import HashedFuture, Task, TaskComposite
+from ..utils import fullname_of
+
+__all__ = ['Coordinator']
+
+log = logging.getLogger(__name__)
+
+
+class Coordinator(SessionPlugin):
+    """Plugin that runs tasks on workers connected over TCP.
+
+    Workers are started with ``mona worker`` and can connect at any time while
+    the session runs. Tasks of rules are sent to free workers together with
+    the values of their arguments, and their results are sent back. Contents
+    of files are transferred between the file managers of the coordinator and
+    the workers on demand. Tasks created by tasks on workers are sent back
+    and added to the session. Tasks that cannot be sent to workers are passed
+    to the task runner of plugins registered earlier, such as
+    :class:`~mona.plugins.Slurm`, or run locally. When no worker is connected
+    for a given time while a task waits for one, the session fails.
+
+    Messages are pickled, so the coordinator should listen only on trusted
+    networks.
+
+    :param str host: address to listen on
+    :param int port: port to listen on
+    :param float timeout: how long to wait for a worker to connect
+    """
+
+    name = 'coordinator'
+
+    def __init__(
+        self, host: str = '127.0.0.1', port: int = DEFAULT_PORT, timeout: float = 60
+    ) -> None:
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._channels: Set[Channel] = set()
+        self._serving: Set['asyncio.Task[None]'] = set()
+
+    def __repr__(self) -> str:
+        return f'<Coordinator address={self._host}:{self._port}>'
+
+    def post_enter(self, sess: Session) -> None:  # noqa: D102
+        self._next_runner = cast(Optional[TaskRunner], sess.storage.get('task_runner'))
+        sess.storage['task_runner'] = self._run_task
+
+    async def pre_run(self) -> None:  # noqa: D102
+        if not FileManager.active():
+            raise MonaError('Coordinator requires a file manager')
+        self._slots: 'asyncio.Queue[Channel]' = asyncio.Queue()
+        self._server = await asyncio.start_server(
+            self._connected, self._host, self._port
+        )
+        log.info(f'Listening for workers on {self._host}:{self._port}')
+
+    async def post_run(self) -> None:  # noqa: D102
+        self._server.close()
+        for channel in self._channels:
+            channel.close()
+        await asyncio.gather(*self._serving, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _connected(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        channel = Channel(reader, writer, self._handle)
+        serving = asyncio.current_task()
+        assert serving
+        self._channels.add(channel)
+        self._serving.add(serving)
+        try:
+            await channel.serve()
+        finally:
+            self._channels.discard(channel)
+            self._serving.discard(serving)
+        log.info(f'Worker disconnected: {channel!r}')
+
+    async def _handle(self, channel: Channel, command: str, *args: Any) -> object:
+        if command == 'hello':
+            ncores: int = args[0]
+            if args[1] != hash_algorithm():
+                raise MonaError(
+                    f'Worker uses {args[1]} hashes, coordinator {hash_algorithm()}'
+                )
+            log.info(f'Worker connected with {ncores} cores: {channel!r}')
+            for _ in range(ncores):
+                self._slots.put_nowait(channel)
+            return None
+        if command == 'blobs':
+            return blobs_for(args[0])
+        raise MonaError(f'Unknown request: {command!r}')
+
+    def _payload_for(self, task: Task[object]) -> Optional[TaskPayload]:
+        if not task.rule:
+            return None
+        args: List[Hashed[object]] = []
+        for arg in task.args:
+            if not isinstance(arg, HashedFuture):
+                args.append(arg)
+                continue
+            hashed = TaskComposite.maybe_hashed(arg.value)
+            if not hashed or isinstance(hashed, HashedFuture):
+                return None
+            args.append(hashed)
+        return (
+            fullname_of(task.corofunc),
+            hash_function(task.corofunc),
+            task.label,
+            rows_of(args),
+            [arg.hashid for arg in args],
+        )
+
+    async def _acquire(self) -> Channel:
+        if self._slots.empty():
+            log.debug('Waiting for a free worker')
+        while True:
+            try:
+                channel = await asyncio.wait_for(self._slots.get(), self._timeout)
+            except asyncio.TimeoutError:
+                if self._channels:
+                    continue
+                raise MonaError(
+                    f'No worker connected within {self._timeout} s'
+                ) from None
+            if not channel.closed:
+                return channel
+
+    async def _run_remotely(
+        self, task: Task[object], payload: TaskPayload
+    ) -> Tuple[Channel, Tuple[Any, ...]]:
+        while True:
+            channel = await self._acquire()
+            try:
+                return channel, await channel.request('run', *payload)
+            except ConnectionLost:
+                log.warning(f'Lost worker while running {task}, rescheduling')
+            finally:
+                if not channel.closed:
+                    self._slots.put_nowait(channel)
+
+    def _resolver_for(
+        self, rows: Sequence[ObjectRow], created: Sequence[CreatedTask]
+    ) -> HashResolver:
+        sess = Session.active()
+        caller = sess.running_task
+        created_by_hash: Dict[Hash, Tuple[Optional[bytes], Dict[str, object]]] = {
+            hashid: (metadata, storage) for hashid, metadata, storage in created
+        }
+
+        def register(obj: Hashed[object]) -> Hashed[object]:
+            if not isinstance(obj, Task) or obj.hashid not in created_by_hash:
+                return obj
+            metadata, storage = created_by_hash[obj.hashid]
+            if metadata is not None:
+                obj.set_metadata(metadata)
+            obj.storage.update(storage)
+            sess.add_side_effect_of(caller, obj)
+            task, registered = sess.register_task(obj)
+            if registered:
+                sess.run_plugins('post_create', task)
+            return task
+
+        return resolver_for(rows, register)
+
+    async def _run_task(self, task: Task[object]) -> object:
+        payload = self._payload_for(task)
+        if not payload:
+            if self._next_runner:
+                return await self._next_runner(task)
+            return await task.corofunc(*(arg.value for arg in task.args))
+        channel, (kind, result, rows, created) = await self._run_remotely(
+            task, payload
+        )
+        await fetch_blobs(channel, file_hashes_of(rows))
+        resolve = self._resolver_for(rows, created)
+        for hashid, *_ in created:
+            resolve(hashid)
+        if kind == 'object':
+            return result
+        assert kind == 'hashed'
+        return resolve(result)
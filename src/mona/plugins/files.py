@@ -1,33 +1,257 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
-import hashlib
+import errno
+import os
 import shutil
+import sqlite3
+import tempfile
+import time
+import weakref
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Union
+from threading import Lock
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple, Union
 
 from ..errors import FilesError
-from ..files import FileManager as _FileManager
-from ..hashing import Hash
+from ..files import Buffer, FileManager as _FileManager
+from ..hashing import Hash, hash_algorithm, hash_text, new_hasher
 from ..sessions import Session, SessionPlugin
-from ..utils import Pathable, make_nonwritable, make_writable
+from ..utils import (
+    Pathable,
+    clone_file,
+    make_nonwritable,
+    make_writable,
+    reflink,
+)
 
 __version__ = '0.2.0'
 
 
+StatKey = Tuple[int, int, int, int]
+
+# files modified this recently may still change within the mtime resolution
+RACY_NS = 2 * 10 ** 9
+CHUNK_SIZE = 2 ** 20
+
+
+def _stat_key(st: os.stat_result) -> StatKey:
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _hash_file(path: Path) -> Hash:
+    hasher = new_hasher()
+    with path.open('rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return Hash(hasher.hexdigest())
+
+
+def _copy_file(src: BinaryIO, dst: BinaryIO, hashing: bool) -> Optional[Hash]:
+    hasher = new_hasher() if hashing else None
+    while True:
+        data = src.read(CHUNK_SIZE)
+        if not data:
+            break
+        if hasher:
+            hasher.update(data)
+        dst.write(data)
+    return Hash(hasher.hexdigest()) if hasher else None
+
+
+def _try_rename(src: Path, dst: Path) -> bool:
+    try:
+        src.rename(dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        return False
+    return True
+
+
+def _try_link(src: Path, dst: Path) -> bool:
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in {errno.EXDEV, errno.EPERM, errno.EMLINK}:
+            raise
+        return False
+    return True
+
+
+def _ingest(
+    path: Path, dirname: Path, keep: bool, hashid: Hash = None
+) -> Tuple[Hash, Path]:
+    """Move or copy a file into a directory under a temporary name.
+
+    The file is renamed if not kept and on the same file system, reflinked if
+    kept and supported by the file system, and copied in chunks otherwise.
+    Copies are hashed on the way, synced to disk, and keep the permissions of
+    the original.
+
+    :param hashid: known hash of the file, which is then not rehashed
+
+    Return the hash of the file and its new path.
+    """
+    fd, tmpname = tempfile.mkstemp(prefix='.ingest-', dir=str(dirname))
+    tmp = Path(tmpname)
+    try:
+        with open(fd, 'wb') as dst:
+            if keep or not _try_rename(path, tmp):
+                with path.open('rb') as src:
+                    if not reflink(src.fileno(), dst.fileno()):
+                        hashid = _copy_file(src, dst, not hashid) or hashid
+                dst.flush()
+                os.fsync(dst.fileno())
+                shutil.copymode(path, tmp)
+                if not keep:
+                    path.unlink()
+        if not hashid:
+            hashid = _hash_file(tmp)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+    return hashid, tmp
+
+
+class StatIndex:
+    """Persistent index of content hashes of files keyed by their stat data.
+
+    Like the git index, a hash is returned only if the device, inode, size
+    and modification time of a file are unchanged since it was hashed.
+    """
+
+    def __init__(self, path: Pathable) -> None:
+        self._db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._lock = Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                """\
+CREATE TABLE IF NOT EXISTS entries (
+    algorithm TEXT,
+    device    INTEGER,
+    inode     INTEGER,
+    size      INTEGER,
+    mtime_ns  INTEGER,
+    hashid    TEXT,
+    PRIMARY KEY (algorithm, device, inode)
+)
+"""
+            )
+
+    def get(self, st: os.stat_result) -> Optional[Hash]:
+        """Return the hash of a file with given stat data if known."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size, mtime_ns, hashid FROM entries '
+                'WHERE algorithm = ? AND device = ? AND inode = ?',
+                (hash_algorithm(), st.st_dev, st.st_ino),
+            ).fetchone()
+        if row and tuple(row[:2]) == (st.st_size, st.st_mtime_ns):
+            return Hash(row[2])
+        return None
+
+    def set(self, st: os.stat_result, hashid: Hash) -> None:
+        """Record the hash of a file with given stat data."""
+        if time.time_ns() - st.st_mtime_ns < RACY_NS:
+            return
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?)',
+                (hash_algorithm(), *_stat_key(st), hashid),
+            )
+
+
+class ReadCache:
+    """In-memory cache of file contents with a budget on their total size.
+
+    The least recently used contents are evicted first, and contents larger
+    than the budget are not cached at all.
+    """
+
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+        self.size = 0
+        self._contents: 'OrderedDict[Hash, bytes]' = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def __iter__(self) -> Iterator[Hash]:
+        return iter(list(self._contents))
+
+    def __contains__(self, hashid: Hash) -> bool:
+        return hashid in self._contents
+
+    def get(self, hashid: Hash) -> Optional[bytes]:
+        """Return cached content and mark it as recently used."""
+        with self._lock:
+            content = self._contents.get(hashid)
+            if content is not None:
+                self._contents.move_to_end(hashid)
+        return content
+
+    def put(self, hashid: Hash, content: bytes) -> None:
+        """Cache content, evicting least recently used contents if needed."""
+        if len(content) > self.budget:
+            return
+        with self._lock:
+            if hashid in self._contents:
+                self._contents.move_to_end(hashid)
+                return
+            self._contents[hashid] = content
+            self.size += len(content)
+            while self.size > self.budget:
+                _, evicted = self._contents.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self) -> None:
+        """Evict all contents."""
+        with self._lock:
+            self._contents.clear()
+            self.size = 0
+
+
 class FileManager(_FileManager, SessionPlugin):
-    """Plugin that manages storage of abstract task files in a file system."""
+    """Plugin that manages storage of abstract task files in a file system.
+
+    :param root: directory where files are stored
+    :param bool eager: store files immediately rather than when
+                       :meth:`store_cache` is called. Files stored from paths
+                       are meanwhile kept in a spool directory in the root,
+                       which is removed also when the manager is discarded
+                       without storing them
+    :param index: path to a database of content hashes of stored paths, which
+                  are then not rehashed while unchanged, see :class:`StatIndex`
+    :param int cache_size: budget in bytes of the cache of contents read or
+                           stored, see :class:`ReadCache`
+    """
 
     name = 'file_manager'
 
-    def __init__(self, root: Union[str, Pathable], eager: bool = True) -> None:
+    def __init__(
+        self,
+        root: Union[str, Pathable],
+        eager: bool = True,
+        index: Pathable = None,
+        cache_size: int = 2 ** 28,
+    ) -> None:
         self._root = Path(root).resolve()
-        self._cache: Dict[Hash, bytes] = {}
+        self._cache = ReadCache(cache_size)
+        self._pending: Dict[Hash, bytes] = {}
         self._path_cache: Dict[Path, Hash] = {}
+        self._spooled: Dict[Hash, Path] = {}
+        self._spool: Optional[Path] = None
         self._eager = eager
+        self._index = StatIndex(index) if index else None
 
     def __repr__(self) -> str:
-        return f'<FileManager ncache={len(self._cache)}>'
+        return f'<FileManager ncache={len(self._cache)} npending={len(self._pending)}>'
 
     def _path(self, hashid: Hash, must_exist: bool = False) -> Path:
         path = self._root / hashid[:2] / hashid[2:]
@@ -41,77 +265,140 @@ class FileManager(_FileManager, SessionPlugin):
         return path
 
     def __contains__(self, hashid: Hash) -> bool:
-        return hashid in self._cache or self._path(hashid).is_file()
+        return (
+            hashid in self._cache
+            or hashid in self._pending
+            or hashid in self._spooled
+            or self._path(hashid).is_file()
+        )
 
     def post_enter(self, sess: Session) -> None:  # noqa: D102
         sess.storage['file_manager'] = self
 
-    def _store_bytes(self, hashid: Hash, content: bytes) -> None:
+    def _store_bytes(self, hashid: Hash, content: Buffer) -> None:
         stored_path = self._path_primed(hashid)
         stored_path.write_bytes(content)
         make_nonwritable(stored_path)
 
-    def store_bytes(self, content: bytes) -> Hash:  # noqa: D102
-        hashid = Hash(hashlib.sha1(content).hexdigest())
+    def store_bytes(self, content: Buffer) -> Hash:  # noqa: D102
+        hashid = hash_text(content)
         if hashid not in self:
-            self._cache[hashid] = content
-            if self._eager:
-                self._store_bytes(hashid, content)
+            if not self._eager:
+                self._pending[hashid] = bytes(content)
+                return hashid
+            self._store_bytes(hashid, content)
+            # buffers of other objects are not copied if already written
+            if isinstance(content, bytes):
+                self._cache.put(hashid, content)
         return hashid
 
-    def _store_path(self, hashid: Hash, path: Path, keep: bool) -> None:
+    def _commit(self, hashid: Hash, path: Path) -> None:
         stored_path = self._path_primed(hashid)
-        if keep:
-            shutil.copy(path, stored_path)
-        else:
-            path.rename(stored_path)
-        make_nonwritable(stored_path)
+        if stored_path.exists():
+            path.unlink()
+            return
+        make_nonwritable(path)
+        path.replace(stored_path)
+
+    def _spool_dir(self) -> Path:
+        # in the root, so that spooled files can be renamed into place
+        if not self._spool:
+            self._spool = Path(tempfile.mkdtemp(prefix='.spool-', dir=self._root))
+            self._spool_cleanup = weakref.finalize(
+                self, shutil.rmtree, self._spool, ignore_errors=True
+            )
+        return self._spool
 
     def store_path(self, path: Path, *, keep: bool) -> Hash:  # noqa: D102
         hashid = self._path_cache.get(path)
         if hashid:
             return hashid
-        sha1 = hashlib.sha1()
-        with path.open('rb') as f:
-            while True:
-                data = f.read(2 ** 20)
-                if not data:
-                    break
-                sha1.update(data)
-        hashid = Hash(sha1.hexdigest())
-        if hashid not in self:
-            # TODO this is not good with large files
-            self._cache[hashid] = path.read_bytes()
-            if self._eager:
-                self._store_path(hashid, path, keep)
+        hashid = self._index.get(path.stat()) if self._index else None
+        if not hashid or hashid not in self:
+            hashid = self._ingest_path(path, keep, hashid)
         return self._path_cache.setdefault(path, hashid)
 
+    def _ingest_path(self, path: Path, keep: bool, hashid: Optional[Hash]) -> Hash:
+        st = path.stat() if self._index and keep else None
+        dirname = self._root if self._eager else self._spool_dir()
+        hashid, tmp = _ingest(path, dirname, keep, hashid)
+        # files changed while being read are not indexed
+        if self._index and st and _stat_key(path.stat()) == _stat_key(st):
+            self._index.set(st, hashid)
+        if self._eager:
+            self._commit(hashid, tmp)
+        elif hashid in self._spooled:
+            tmp.unlink()
+        else:
+            self._spooled[hashid] = tmp
+        return hashid
+
+    def path_for(self, hashid: Hash) -> Optional[Path]:  # noqa: D102
+        path = self._path(hashid)
+        return path if path.is_file() else None
+
+    def _content_for(self, hashid: Hash) -> Optional[bytes]:
+        content = self._pending.get(hashid)
+        if content is None:
+            content = self._cache.get(hashid)
+        return content
+
     def bytes_for(self, hashid: Hash) -> bytes:  # noqa: D102
-        try:
-            return self._cache[hashid]
-        except KeyError:
-            pass
-        path = self._path(hashid, must_exist=True)
-        return self._cache.setdefault(hashid, path.read_bytes())
+        content = self._content_for(hashid)
+        if content is not None:
+            return content
+        path = self._spooled.get(hashid) or self._path(hashid, must_exist=True)
+        content = path.read_bytes()
+        self._cache.put(hashid, content)
+        return content
 
     def target_in(
         self, path: Path, hashid: Hash, *, mutable: bool
     ) -> None:  # noqa: D102
-        content = self._cache.get(hashid)
-        if content:
+        content = self._content_for(hashid)
+        if content is not None:
             path.write_bytes(content)
             if not mutable:
                 make_nonwritable(path)
             return
+        spooled_path = self._spooled.get(hashid)
+        if spooled_path:
+            clone_file(spooled_path, path)
+            if mutable:
+                make_writable(path)
+            else:
+                make_nonwritable(path)
+            return
         stored_path = self._path(hashid, must_exist=True)
+        if path.exists():
+            path.unlink()
         if mutable:
-            shutil.copy(stored_path, path)
+            clone_file(stored_path, path)
             make_writable(path)
-        else:
-            if path.exists():
-                path.unlink()
+        elif not _try_link(stored_path, path):
             path.symlink_to(stored_path)
 
+    def verify_all(self) -> Iterator[str]:
+        """Rehash all stored files.
+
+        Yield descriptions of files whose content does not match their hash.
+        """
+        for path in sorted(self._root.glob('*/*')):
+            if path.parent.name.startswith('.'):
+                continue
+            hashid = Hash(path.parent.name + path.name)
+            if _hash_file(path) != hashid:
+                yield f'File {hashid} does not match its hash'
+
     def store_cache(self) -> None:  # noqa: D102
-        for hashid, content in self._cache.items():
+        for hashid, content in self._pending.items():
             self._store_bytes(hashid, content)
+        self._pending.clear()
+        try:
+            for hashid, path in self._spooled.items():
+                self._commit(hashid, path)
+        finally:
+            self._spooled.clear()
+            if self._spool:
+                self._spool_cleanup()
+                self._spool = None
@@ -2,39 +2,232 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import asyncio
+import inspect
 import logging
+import math
 import os
-from contextlib import asynccontextmanager
-from typing import Any, AsyncGenerator, Optional, Set, TypeVar
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
+from ..errors import MonaError
 from ..sessions import Session, SessionPlugin, TaskExecuted, TaskExecutor
 from ..tasks import Corofunc, Task
+from ..tracing import Tracer
 
 log = logging.getLogger(__name__)
 
 _T = TypeVar('_T')
+Resources = Dict[str, float]
+# rule of the running task, name of the coroutine function, number of cores
+DurationKey = Tuple[str, str, int]
+
+# the adaptive mode backs off above this load average per CPU
+OVERLOAD = 1.25
+# or above this fraction of CPU time spent waiting on I/O
+IOWAIT_LIMIT = 0.25
+
+
+class _Request(NamedTuple):
+    resources: Resources
+    key: DurationKey
+    granted: 'asyncio.Future[List[int]]'
+
+
+class _Job(NamedTuple):
+    resources: Resources
+    key: DurationKey
+    start: float
+    end: float  # expected
+
+
+class _LoadSample(NamedTuple):
+    time: float
+    # busy, iowait and total CPU time of the host from /proc/stat
+    host: Optional[Tuple[int, int, int]]
+    # CPU time of this process and its terminated children
+    own: float
+
+
+@lru_cache(maxsize=None)
+def _accepts(corofunc: Callable[..., object], param: str) -> bool:
+    return param in inspect.signature(corofunc).parameters
+
+
+def _parse_cpulist(cpulist: str) -> List[int]:
+    cpus: List[int] = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _numa_nodes() -> List[List[int]]:
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    nodes: List[List[int]] = []
+    for path in sorted(
+        Path('/sys/devices/system/node').glob('node[0-9]*'),
+        key=lambda path: int(path.name[4:]),
+    ):
+        try:
+            node_cpus = set(_parse_cpulist((path / 'cpulist').read_text()))
+        except OSError:
+            continue
+        node = [cpu for cpu in cpus if cpu in node_cpus]
+        if node:
+            nodes.append(node)
+    placed = {cpu for node in nodes for cpu in node}
+    rest = [cpu for cpu in cpus if cpu not in placed]
+    if rest:
+        nodes.append(rest)
+    return nodes
+
+
+def _load_sample() -> _LoadSample:
+    host: Optional[Tuple[int, int, int]]
+    try:
+        with open('/proc/stat') as f:
+            # user nice system idle iowait irq softirq steal ...
+            times = [int(x) for x in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        host = None
+    else:
+        idle, iowait = times[3], times[4]
+        total = sum(times[:8])
+        host = total - idle - iowait, iowait, total
+    own = sum(
+        usage.ru_utime + usage.ru_stime
+        for usage in map(
+            resource.getrusage, [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]
+        )
+    )
+    return _LoadSample(time.monotonic(), host, own)
 
 
 class Parallel(SessionPlugin):
-    """Plugin that enables running tasks in parallel."""
+    """Plugin that enables running tasks in parallel.
+
+    Waiting processes and threads are started in the order of their requests.
+    When the first of them does not fit, the resources are reserved for it at
+    the earliest time at which they are expected to be released, and the
+    waiting requests behind it are started if they do not delay the
+    reservation. This is judged from durations of earlier runs of the same
+    kind. Running processes and threads of a kind that has not finished yet
+    are expected to take ``walltime`` seconds, and waiting ones of such a
+    kind are started only if they do not delay the reservation however long
+    they take.
+
+    Besides cores, the plugin can track arbitrary resources, such as memory or
+    scratch disk space in chosen units or licence seats. Processes and threads
+    declare the amounts they take with the ``resources`` argument of the
+    runners, and are started only once all of them are available. Resources
+    without a given capacity are not limited.
+
+    :param int ncores: number of cores, all available cores if not given
+    :param dict resources: capacities of other resources, e.g. ``{'mem_gb': 64}``
+    :param bool limit_memory: limit the virtual memory of subprocesses to their
+                              ``mem_gb`` requests
+    :param bool pin_cores: pin subprocesses to the cores they were given. This
+                           is off by default, as independent sessions on a
+                           host would pin their subprocesses to the same cores
+    :param bool adaptive: adjust the number of cores at runtime to the load of
+                          the host
+    :param float interval: seconds between adjustments in the adaptive mode
+    :param float walltime: expected duration in seconds of running processes
+                           and threads of a kind that has not finished yet
+
+    The cores are assigned from a single NUMA node where possible. With
+    pinning, the IDs of the assigned cores are passed to subprocesses in the
+    ``MONA_CORES`` environment variable as a comma-separated list.
+
+    In the adaptive mode, the number of cores is treated as a starting point
+    and is changed by one every ``interval`` seconds within one and twice its
+    value. It is lowered when the host is overloaded, that is when its load
+    average exceeds the number of CPUs by more than a quarter or more than a
+    quarter of CPU time is spent waiting on I/O, and raised when requests are
+    waiting while some CPUs of the host are idle, such as when the running
+    tasks are I/O-bound or other users leave the host. CPU times are read from
+    ``/proc/stat``, and where it is not available, the load average and the
+    CPU time used by the session and its subprocesses are used instead.
+    """
 
     name = 'parallel'
 
-    def __init__(self, ncores: int = None) -> None:
+    def __init__(
+        self,
+        ncores: int = None,
+        resources: Resources = None,
+        limit_memory: bool = False,
+        pin_cores: bool = False,
+        adaptive: bool = False,
+        interval: float = 2.0,
+        walltime: float = 3600.0,
+    ) -> None:
         self._ncores = ncores or os.cpu_count() or 1
-        self._available = self._ncores
+        self._nslots = 2 * self._ncores if adaptive else self._ncores
+        self._pin_cores = pin_cores and hasattr(os, 'sched_setaffinity')
+        # slots are mapped to CPUs node by node, repeatedly if oversubscribed
+        nodes = _numa_nodes()
+        cpus = [cpu for node in nodes for cpu in node]
+        self._slot_cpus = [cpus[slot % len(cpus)] for slot in range(self._nslots)]
+        self._slot_nodes = [
+            [slot for slot, cpu in enumerate(self._slot_cpus) if cpu in node]
+            for node in nodes
+        ]
+        self._capacity: Resources = {'ncores': self._nslots, **(resources or {})}
+        self._available = dict(self._capacity)
+        # slots held back from scheduling in the adaptive mode
+        self._withheld = self._nslots - self._ncores
+        self._available['ncores'] -= self._withheld
+        self._adaptive = adaptive
+        self._interval = interval
+        self._walltime = walltime
+        self._limit_memory = limit_memory
         self._asyncio_tasks: Set[asyncio.Task[Any]] = set()
-        self._pending: Optional[int] = None
+        self._pending: Optional[Resources] = None
+        self._durations: Dict[DurationKey, Tuple[float, int]] = {}
         self._registered_exceptions = 0
 
     def post_enter(self, sess: Session) -> None:  # noqa: D102
         sess.storage['scheduler'] = self._run_coro
+        self._process_pool = ProcessPoolExecutor(self._ncores)
+        sess.storage['process_pool'] = self._process_pool
+
+    def pre_exit(self, sess: Session) -> None:  # noqa: D102
+        self._process_pool.shutdown()
 
     async def pre_run(self) -> None:  # noqa: D102
-        self._sem = asyncio.BoundedSemaphore(self._ncores)
-        self._lock = asyncio.Lock()
+        self._queue: List[_Request] = []
+        self._running: Dict[int, _Job] = {}
+        self._free_slots = set(range(self._nslots))
+        if self._adaptive:
+            self._monitor = asyncio.create_task(self._adapt())
 
     async def post_run(self) -> None:  # noqa: D102
+        if self._adaptive:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
         if not self._asyncio_tasks:
             return
         log.info(f'Cancelling {len(self._asyncio_tasks)} running tasks...')
@@ -44,17 +237,139 @@ class Parallel(SessionPlugin):
         assert not self._asyncio_tasks
         log.info('All tasks cancelled')
 
-    def _release(self, ncores: int) -> None:
+    async def _adapt(self) -> None:
+        sample = _load_sample()
+        while True:
+            await asyncio.sleep(self._interval)
+            last, sample = sample, _load_sample()
+            self._adjust(last, sample)
+
+    def _adjust(self, last: _LoadSample, sample: _LoadSample) -> None:
+        ncpus = os.cpu_count() or 1
+        load = os.getloadavg()[0] if hasattr(os, 'getloadavg') else 0.0
+        own = (sample.own - last.own) / (sample.time - last.time)
+        if sample.host and last.host:
+            busy, iowait, total = (a - b for a, b in zip(sample.host, last.host))
+            busy_cpus = ncpus * busy / total if total else 0.0
+            iowait_frac = iowait / total if total else 0.0
+        else:
+            busy_cpus, iowait_frac = max(load, own), 0.0
+        effective = self._nslots - self._withheld
+        if effective > 1 and (load > OVERLOAD * ncpus or iowait_frac > IOWAIT_LIMIT):
+            change = -1
+        elif (
+            effective < self._nslots
+            and any(not request.granted.done() for request in self._queue)
+            and ncpus - busy_cpus >= 1
+        ):
+            change = 1
+        else:
+            return
+        log.debug(
+            f'Changing cores to {effective + change}: load {load:.1f}, '
+            f'{busy_cpus:.1f} of {ncpus} CPUs busy, {own:.1f} by session, '
+            f'iowait {iowait_frac:.0%}'
+        )
+        self._withheld -= change
+        self._available['ncores'] += change
+        if change > 0 and self._pending is None:
+            self._schedule()
+
+    def _fits(self, resources: Resources, available: Resources = None) -> bool:
+        available = available if available is not None else self._available
+        return all(
+            amount <= available[name]
+            for name, amount in resources.items()
+            if name in available
+        )
+
+    def _expected_duration(self, key: DurationKey, default: float = math.inf) -> float:
+        mean, _ = self._durations.get(key, (default, 0))
+        return mean
+
+    def _record_duration(self, key: DurationKey, duration: float) -> None:
+        mean, n = self._durations.get(key, (0.0, 0))
+        self._durations[key] = (mean + (duration - mean) / (n + 1), n + 1)
+
+    def _reservation(self, request: _Request) -> Tuple[float, Resources]:
+        # find when the request fits given the expected ends of running jobs
+        # and what would be left over at that time
+        available = dict(self._available)
+        shadow = asyncio.get_running_loop().time()
+        for job in sorted(self._running.values(), key=lambda job: job.end):
+            if self._fits(request.resources, available):
+                break
+            shadow = job.end
+            for name, amount in job.resources.items():
+                if name in available:
+                    available[name] += amount
+        for name, amount in request.resources.items():
+            if name in available:
+                available[name] -= amount
+        return shadow, available
+
+    def _grant(self, request: _Request, now: float) -> None:
+        for name, amount in request.resources.items():
+            if name in self._available:
+                self._available[name] -= amount
+        slots = self._take_slots(int(request.resources['ncores']))
+        end = now + self._expected_duration(request.key, self._walltime)
+        self._running[id(request)] = _Job(request.resources, request.key, now, end)
+        request.granted.set_result(slots)
+
+    def _take_slots(self, n: int) -> List[int]:
+        free_by_node = [
+            [slot for slot in node if slot in self._free_slots]
+            for node in self._slot_nodes
+        ]
+        fitting = [free for free in free_by_node if len(free) >= n]
+        if fitting:
+            slots = min(fitting, key=len)[:n]
+        else:
+            free_by_node.sort(key=len, reverse=True)
+            slots = [slot for free in free_by_node for slot in free][:n]
+        self._free_slots.difference_update(slots)
+        return slots
+
+    def _schedule(self) -> None:
+        now = asyncio.get_running_loop().time()
+        reservation: Optional[Tuple[float, Resources]] = None
+        waiting: List[_Request] = []
+        for request in self._queue:
+            if request.granted.done():
+                continue
+            if not self._fits(request.resources):
+                waiting.append(request)
+                if not reservation:
+                    reservation = self._reservation(request)
+                continue
+            if reservation:
+                shadow, extra = reservation
+                duration = self._expected_duration(request.key)
+                if math.isinf(duration) or now + duration > shadow:
+                    if not self._fits(request.resources, extra):
+                        waiting.append(request)
+                        continue
+                    for name, amount in request.resources.items():
+                        if name in extra:
+                            extra[name] -= amount
+                log.debug(f'Backfilling {request.key}')
+            self._grant(request, now)
+        self._queue = waiting
+
+    def _release(self, resources: Resources) -> None:
         if self._pending is None:
-            for _ in range(ncores):
-                self._sem.release()
-            self._available += ncores
+            for name, amount in resources.items():
+                if name in self._available:
+                    self._available[name] += amount
+            self._schedule()
         else:
-            self._pending += ncores
+            for name, amount in resources.items():
+                self._pending[name] = self._pending.get(name, 0) + amount
 
     def _stop(self) -> None:
         assert self._pending is None
-        self._pending = 0
+        self._pending = {}
         log.info(f'Stopping scheduler')
 
     def ignored_exception(self) -> None:  # noqa: D102
@@ -64,7 +379,7 @@ class Parallel(SessionPlugin):
         if self._registered_exceptions > 0:
             return
         assert self._pending is not None
-        log.info(f'Resuming scheduler with {self._pending} cores')
+        log.info(f'Resuming scheduler with {self._pending}')
         pending = self._pending
         self._pending = None
         self._release(pending)
@@ -89,20 +404,49 @@ class Parallel(SessionPlugin):
         return spawn_execute
 
     @asynccontextmanager
-    async def _acquire(self, ncores: int) -> AsyncGenerator[None, None]:
-        async with self._lock:
-            for _ in range(ncores):
-                await self._sem.acquire()
-                self._available -= 1
+    async def _acquire(
+        self, resources: Resources, key: DurationKey
+    ) -> AsyncGenerator[List[int], None]:
+        request = _Request(resources, key, asyncio.get_running_loop().create_future())
+        self._queue.append(request)
+        self._schedule()
+        try:
+            slots = await request.granted
+        except asyncio.CancelledError:
+            if request.granted.cancelled():
+                self._schedule()
+            else:
+                self._finish(request)
+            raise
         try:
-            yield
+            yield slots
         except Exception:
             if self._registered_exceptions == 0:
                 self._stop()
             self._registered_exceptions += 1
             raise
+        else:
+            job = self._running[id(request)]
+            self._record_duration(key, asyncio.get_running_loop().time() - job.start)
         finally:
-            self._release(ncores)
+            self._finish(request)
+
+    def _finish(self, request: _Request) -> None:
+        self._running.pop(id(request))
+        self._free_slots.update(request.granted.result())
+        self._release(request.resources)
+
+    def _requested(self, ncores: int, kwargs: Dict[str, Any]) -> Resources:
+        resources: Resources = {
+            'ncores': ncores,
+            **(kwargs.pop('resources', None) or {}),
+        }
+        for name, amount in resources.items():
+            if amount > self._capacity.get(name, amount):
+                raise MonaError(
+                    f'Requested {amount} of {name}, capacity is {self._capacity[name]}'
+                )
+        return resources
 
     async def _run_coro(self, corofunc: Corofunc[_T], *args: Any, **kwargs: Any) -> _T:
         task = Session.active().running_task
@@ -113,14 +457,38 @@ class Parallel(SessionPlugin):
             kwargs['ncores'] = n
         else:
             n = 1
-        if n > self._available:
-            log.debug(
-                f'Waiting for {n-self._available}/{n} unavailable cores for {task}'
-            )
+        resources = self._requested(n, kwargs)
+        if (
+            self._limit_memory
+            and 'mem_gb' in resources
+            and _accepts(corofunc, 'mem_limit')
+        ):
+            kwargs['mem_limit'] = int(resources['mem_gb'] * 2 ** 30)
+        key = (task.rule or task.corofunc.__qualname__, corofunc.__name__, n)
+        if self._queue or not self._fits(resources):
+            unavailable = [
+                name
+                for name, amount in resources.items()
+                if amount > self._available.get(name, amount)
+            ]
+            log.debug(f'Waiting for unavailable {", ".join(unavailable)} for {task}')
             waited = True
         else:
             waited = False
-        async with self._acquire(n):
+        tracer = Tracer.active()
+        if tracer:
+            spanid = tracer.begin('wait', task, **resources)
+        async with self._acquire(resources, key) as slots:
+            if tracer:
+                tracer.end('wait', spanid)
             if waited:
-                log.debug(f'All {n} cores available for "{task}", resuming')
-            return await corofunc(*args, **kwargs)
+                log.debug(f'All resources available for "{task}", resuming')
+            if self._pin_cores and _accepts(corofunc, 'cores'):
+                kwargs['cores'] = sorted({self._slot_cpus[slot] for slot in slots})
+            span: ContextManager[None] = (
+                tracer.span(corofunc.__name__.lstrip('_'), task, slots)
+                if tracer
+                else nullcontext()
+            )
+            with span:
+                return await corofunc(*args, **kwargs)
@@ -0,0 +1,107 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import logging
+import sys
+import threading
+from pathlib import Path
+from types import FrameType
+from typing import Counter, Dict, List, Optional, Tuple
+
+from ..sessions import Session, SessionPlugin
+from ..utils import Pathable
+
+__all__ = ['Profiler']
+
+log = logging.getLogger(__name__)
+
+Stack = Tuple[str, ...]
+
+_task_entries = {Session.run_task_async.__code__, Session.run_batch_async.__code__}
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    qualname = getattr(code, 'co_qualname', code.co_name)
+    return f'{qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})'
+
+
+class Profiler(SessionPlugin):
+    """Plugin that profiles running sessions by sampling call stacks.
+
+    Samples taken while a task runs are attributed to the task and its rule,
+    all other samples to the session itself, which covers Mona internals such
+    as traversal and hashing. The profile can be saved in the collapsed-stack
+    format understood by flame-graph tools such as speedscope.
+
+    :param float interval: sampling interval in seconds
+    """
+
+    name = 'profiler'
+
+    def __init__(self, interval: float = 1e-3) -> None:
+        self._interval = interval
+        self._samples: Counter[Stack] = Counter()
+        self._thread: Optional[threading.Thread] = None
+
+    def __repr__(self) -> str:
+        return f'<Profiler nsamples={sum(self._samples.values())}>'
+
+    def _stack_of(self, frame: Optional[FrameType]) -> Stack:
+        frames: List[FrameType] = []
+        while frame:
+            frames.append(frame)
+            if frame.f_code in _task_entries:
+                break
+            frame = frame.f_back
+        frames.reverse()
+        root = frames[0]
+        if root.f_code in _task_entries:
+            tasks = root.f_locals.get('tasks')
+            task = tasks[0] if tasks else root.f_locals['task']
+            rule = task.rule or task.corofunc.__qualname__
+            prefix: Stack = (f'rule:{rule}', f'task:{task.label}')
+        else:
+            prefix = ('session',)
+        return (*prefix, *map(_frame_name, frames))
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame:
+                self._samples[self._stack_of(frame)] += 1
+
+    async def pre_run(self) -> None:  # noqa: D102
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), daemon=True
+        )
+        self._thread.start()
+
+    async def post_run(self) -> None:  # noqa: D102
+        assert self._thread
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        for rule, nsamples in sorted(
+            self.rule_samples().items(), key=lambda x: x[1], reverse=True
+        ):
+            log.info(f'{rule}: {nsamples * self._interval:.3f}s')
+
+    def rule_samples(self) -> Dict[str, int]:
+        """Return numbers of samples taken in individual rules."""
+        counts: Counter[str] = Counter()
+        for stack, count in self._samples.items():
+            counts[stack[0]] += count
+        return dict(counts)
+
+    def collapsed_stacks(self) -> List[str]:
+        """Return the profile in the collapsed-stack format."""
+        return [
+            ';'.join(name.replace(';', ',') for name in stack) + f' {count}'
+            for stack, count in sorted(self._samples.items())
+        ]
+
+    def save(self, path: Pathable) -> None:
+        """Save the profile in the collapsed-stack format."""
+        Path(path).write_text(''.join(f'{l}\n' for l in self.collapsed_stacks()))
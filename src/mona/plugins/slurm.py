@@ -0,0 +1,292 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import asyncio
+import logging
+import os
+import shlex
+import shutil
+from pathlib import Path
+from tempfile import mkdtemp, mkstemp
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, cast
+
+from ..dirtask import (
+    DirTaskProcessError,
+    checkout_task_dir,
+    collect_outputs,
+    dir_task,
+)
+from ..errors import MonaError
+from ..sessions import Session, SessionPlugin, TaskRunner
+from ..tasks import Task
+from ..utils import Pathable
+
+__all__ = ['Slurm']
+
+log = logging.getLogger(__name__)
+
+# cores per task, -1 for whole nodes, memory per task in GB
+JobKey = Tuple[Optional[int], Optional[float]]
+# state, exit code
+JobState = Tuple[str, int]
+
+TERMINAL_STATES = {
+    'BOOT_FAIL',
+    'CANCELLED',
+    'COMPLETED',
+    'DEADLINE',
+    'FAILED',
+    'NODE_FAIL',
+    'OUT_OF_MEMORY',
+    'PREEMPTED',
+    'TIMEOUT',
+}
+
+
+class _ArrayTask(NamedTuple):
+    path: Path
+    exe: str
+    done: 'asyncio.Future[JobState]'
+
+
+class Slurm(SessionPlugin):
+    """Plugin that runs directory tasks as jobs of the Slurm batch system.
+
+    Directory tasks that are ready to run are collected for a short while and
+    submitted in job arrays, each task being one element of an array. Tasks
+    are checked out into directories under a root directory, which must be
+    on a file system shared with the compute nodes, as must be the file
+    manager. Submitted jobs are polled with ``squeue`` and ``sacct``, and the
+    files created by finished tasks are stored in the file manager. Jobs
+    unknown to both commands for longer than a timeout are considered lost.
+    Other tasks are run as usual.
+
+    Tasks are grouped into arrays by the number of cores and the memory they
+    request via ``ncores`` and ``resources={'mem_gb': ...}`` in their storage.
+    Tasks with ``ncores=-1`` take whole nodes, other non-positive numbers of
+    cores are invalid. The number of cores a task was given is passed to it in
+    the ``MONA_NCORES`` environment variable.
+
+    :param root: directory for task directories, job scripts and job logs
+    :param int batch_size: maximum number of tasks in a job array
+    :param float delay: seconds to wait for more tasks before submitting
+    :param float poll: seconds between checks of submitted jobs
+    :param sbatch_args: additional options passed to ``sbatch``
+    :param float timeout: seconds after which a job unknown to ``squeue`` and
+                          ``sacct`` fails
+    """
+
+    name = 'slurm'
+
+    def __init__(
+        self,
+        root: Pathable,
+        batch_size: int = 100,
+        delay: float = 1.0,
+        poll: float = 10.0,
+        sbatch_args: Sequence[str] = (),
+        timeout: float = 300.0,
+    ) -> None:
+        self._root = Path(root).resolve()
+        self._batch_size = batch_size
+        self._delay = delay
+        self._poll = poll
+        self._sbatch_args = list(sbatch_args)
+        self._timeout = timeout
+
+    def __repr__(self) -> str:
+        return f'<Slurm root={self._root}>'
+
+    def post_enter(self, sess: Session) -> None:  # noqa: D102
+        self._next_runner = cast(Optional[TaskRunner], sess.storage.get('task_runner'))
+        sess.storage['task_runner'] = self._run_task
+
+    async def pre_run(self) -> None:  # noqa: D102
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._pending: Dict[JobKey, List[_ArrayTask]] = {}
+        self._flushes: Dict[JobKey, asyncio.TimerHandle] = {}
+        self._submissions: Set['asyncio.Task[None]'] = set()
+        self._jobs: Dict[str, List[_ArrayTask]] = {}
+        self._unknown_since: Dict[str, float] = {}
+        self._poller = asyncio.create_task(self._poll_jobs())
+
+    async def post_run(self) -> None:  # noqa: D102
+        self._poller.cancel()
+        for handle in self._flushes.values():
+            handle.cancel()
+        await asyncio.gather(self._poller, *self._submissions, return_exceptions=True)
+        if self._jobs:
+            log.info(f'Cancelling {len(self._jobs)} Slurm jobs')
+            try:
+                await self._command('scancel', *self._jobs)
+            except OSError as e:
+                log.warning(f'Could not cancel Slurm jobs: {e}')
+
+    async def _command(self, *args: str) -> Tuple[int, List[str]]:
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await proc.communicate()
+        if proc.returncode:
+            log.debug(f'{args[0]} failed: {stderr.decode().strip()}')
+        assert proc.returncode is not None
+        return proc.returncode, stdout.decode().splitlines()
+
+    def _job_key(self, task: Task[object]) -> JobKey:
+        ncores = cast(Optional[int], task.storage.get('ncores'))
+        if ncores is not None and ncores <= 0 and ncores != -1:
+            raise MonaError(f'Invalid number of cores: {ncores}')
+        resources = cast('Optional[Dict[str, float]]', task.storage.get('resources'))
+        return ncores, (resources or {}).get('mem_gb')
+
+    async def _run_task(self, task: Task[object]) -> object:
+        if task.corofunc is not dir_task.corofunc:
+            if self._next_runner:
+                return await self._next_runner(task)
+            return await task.corofunc(*(arg.value for arg in task.args))
+        key = self._job_key(task)
+        exe_arg, inputs_arg = (arg.value for arg in task.args)
+        path = Path(mkdtemp(prefix=f'{task.hashid[:6]}_', dir=str(self._root)))
+        try:
+            exe, input_names = checkout_task_dir(
+                path, exe_arg, cast(List[object], inputs_arg)
+            )
+        except Exception:
+            shutil.rmtree(path)
+            raise
+        array_task = _ArrayTask(
+            path, str(exe.path), asyncio.get_running_loop().create_future()
+        )
+        self._add(key, array_task)
+        state, returncode = await array_task.done
+        if state != 'COMPLETED':
+            stdout, stderr = (
+                p.read_bytes() if p.exists() else b''
+                for p in (path / 'STDOUT', path / 'STDERR')
+            )
+            raise DirTaskProcessError(
+                stdout,
+                stderr,
+                returncode,
+                f'{path / exe.path} (Slurm state {state}, exit code {returncode})',
+            )
+        outputs = collect_outputs(path, lambda p: p not in input_names)
+        shutil.rmtree(path)
+        return outputs
+
+    def _add(self, key: JobKey, array_task: _ArrayTask) -> None:
+        pending = self._pending.setdefault(key, [])
+        pending.append(array_task)
+        if len(pending) >= self._batch_size:
+            self._flush(key)
+        elif key not in self._flushes:
+            self._flushes[key] = asyncio.get_running_loop().call_later(
+                self._delay, self._flush, key
+            )
+
+    def _flush(self, key: JobKey) -> None:
+        handle = self._flushes.pop(key, None)
+        if handle:
+            handle.cancel()
+        array_tasks = self._pending.pop(key)
+        submission = asyncio.create_task(self._submit(key, array_tasks))
+        self._submissions.add(submission)
+        submission.add_done_callback(self._submissions.discard)
+
+    def _job_script(self, key: JobKey, array_tasks: List[_ArrayTask]) -> str:
+        ncores, mem_gb = key
+        options = [
+            '--job-name=mona',
+            f'--array=0-{len(array_tasks) - 1}',
+            f'--output={self._root}/slurm-%A_%a.log',
+        ]
+        env: List[str] = []
+        if ncores == -1:
+            options.append('--exclusive')
+            env.append('export MONA_NCORES=$SLURM_CPUS_ON_NODE')
+        elif ncores:
+            options.append(f'--cpus-per-task={ncores}')
+            env.append(f'export MONA_NCORES=${{SLURM_CPUS_PER_TASK:-{ncores}}}')
+        if mem_gb:
+            options.append(f'--mem={int(mem_gb * 1024)}M')
+        return '\n'.join(
+            [
+                '#!/bin/bash',
+                *(f'#SBATCH {option}' for option in options),
+                *env,
+                'dirs=(',
+                *(shlex.quote(str(t.path)) for t in array_tasks),
+                ')',
+                'exes=(',
+                *(shlex.quote(t.exe) for t in array_tasks),
+                ')',
+                'cd "${dirs[$SLURM_ARRAY_TASK_ID]}" || exit 1',
+                'exec "./${exes[$SLURM_ARRAY_TASK_ID]}" >STDOUT 2>STDERR',
+                '',
+            ]
+        )
+
+    async def _submit(self, key: JobKey, array_tasks: List[_ArrayTask]) -> None:
+        fd, filename = mkstemp(prefix='job_', suffix='.sh', dir=str(self._root))
+        os.close(fd)
+        script = Path(filename)
+        script.write_text(self._job_script(key, array_tasks))
+        try:
+            returncode, output = await self._command(
+                'sbatch', '--parsable', *self._sbatch_args, str(script)
+            )
+            if returncode or not output:
+                raise MonaError(f'Could not submit job array: {script}')
+        except (OSError, MonaError) as e:
+            for array_task in array_tasks:
+                if not array_task.done.done():
+                    array_task.done.set_exception(MonaError(str(e)))
+            return
+        jobid = output[0].split(';')[0]
+        log.info(f'Submitted {len(array_tasks)} tasks as Slurm job {jobid}')
+        self._jobs[jobid] = array_tasks
+
+    async def _poll_jobs(self) -> None:
+        while True:
+            await asyncio.sleep(self._poll)
+            if self._jobs:
+                await self._check_jobs()
+
+    async def _check_jobs(self) -> None:
+        jobids = ','.join(self._jobs)
+        squeue_failed, queued = await self._command(
+            'squeue', '-h', '-r', '-j', jobids, '-o', '%i'
+        )
+        _, rows = await self._command(
+            'sacct', '-n', '-P', '-X', '-j', jobids, '-o', 'JobID,State,ExitCode'
+        )
+        states: Dict[str, JobState] = {}
+        for row in rows:
+            elemid, state, exitcode = row.split('|')
+            states[elemid] = state.split()[0], int(exitcode.split(':')[0])
+        for jobid, array_tasks in list(self._jobs.items()):
+            for idx, array_task in enumerate(array_tasks):
+                elemid = f'{jobid}_{idx}'
+                if array_task.done.done():
+                    continue
+                state = states.get(elemid)
+                if elemid in queued or state:
+                    self._unknown_since.pop(elemid, None)
+                elif not squeue_failed:
+                    self._check_unknown(elemid, array_task)
+                if elemid not in queued and state and state[0] in TERMINAL_STATES:
+                    array_task.done.set_result(state)
+            if all(array_task.done.done() for array_task in array_tasks):
+                del self._jobs[jobid]
+
+    def _check_unknown(self, elemid: str, array_task: _ArrayTask) -> None:
+        now = asyncio.get_running_loop().time()
+        since = self._unknown_since.setdefault(elemid, now)
+        if now - since > self._timeout:
+            del self._unknown_since[elemid]
+            array_task.done.set_exception(
+                MonaError(
+                    f'Slurm job {elemid} unknown to squeue and sacct '
+                    f'for {self._timeout}s'
+                )
+            )
@@ -0,0 +1,112 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import json
+import os
+import time
+from itertools import count
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Set
+
+from ..sessions import Session, SessionPlugin
+from ..tasks import Task
+from ..tracing import Tracer as _Tracer
+from ..utils import Pathable
+
+__all__ = ['Tracer']
+
+TraceEvent = Dict[str, Any]
+
+
+class Tracer(_Tracer, SessionPlugin):
+    """Plugin that records a timeline of session execution.
+
+    The timeline contains traversal of tasks, their execution, waiting for and
+    occupying cores of the :class:`Parallel` plugin, and subprocesses. It can
+    be saved in the Chrome trace-event format, which can be viewed in
+    ``chrome://tracing`` or Perfetto.
+    """
+
+    name = 'tracer'
+
+    def __init__(self) -> None:
+        self._start = time.perf_counter()
+        self._pid = os.getpid()
+        self._events: List[TraceEvent] = []
+        self._spanids = count()
+        self._slots: Set[int] = set()
+
+    def __repr__(self) -> str:
+        return f'<Tracer nevents={len(self._events)}>'
+
+    def post_enter(self, sess: Session) -> None:  # noqa: D102
+        sess.storage['tracer'] = self
+
+    def now(self) -> float:  # noqa: D102
+        return (time.perf_counter() - self._start) * 1e6
+
+    def _event(
+        self, name: str, ph: str, task: Task[object] = None, **args: Any
+    ) -> TraceEvent:
+        if task:
+            args = {'task': task.label, 'hashid': task.hashid, **args}
+        event = {
+            'name': name,
+            'cat': 'mona',
+            'ph': ph,
+            'ts': self.now(),
+            'pid': self._pid,
+            'tid': 0,
+            'args': args,
+        }
+        self._events.append(event)
+        return event
+
+    def instant(  # noqa: D102
+        self, name: str, task: Task[object] = None, **args: Any
+    ) -> None:
+        self._event(name, 'i', task, **args)['s'] = 't'
+
+    def begin(  # noqa: D102
+        self, name: str, task: Task[object] = None, **args: Any
+    ) -> int:
+        spanid = next(self._spanids)
+        self._event(name, 'b', task, **args)['id'] = spanid
+        return spanid
+
+    def end(self, name: str, spanid: int) -> None:  # noqa: D102
+        self._event(name, 'e')['id'] = spanid
+
+    def complete(  # noqa: D102
+        self,
+        name: str,
+        start: float,
+        task: Task[object] = None,
+        slots: Sequence[int] = (),
+        **args: Any,
+    ) -> None:
+        for slot in slots:
+            self._slots.add(slot)
+            event = self._event(name, 'X', task, **args)
+            event.update({'ts': start, 'dur': event['ts'] - start, 'tid': slot + 1})
+
+    def _metadata(self) -> List[TraceEvent]:
+        names = {0: 'scheduler', **{slot + 1: f'core {slot}' for slot in self._slots}}
+        return [
+            {
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': self._pid,
+                'tid': tid,
+                'args': {'name': name},
+            }
+            for tid, name in names.items()
+        ]
+
+    def save(self, path: Pathable) -> None:
+        """Save the timeline in the Chrome trace-event format."""
+        trace = {
+            'traceEvents': [*self._metadata(), *self._events],
+            'displayTimeUnit': 'ms',
+        }
+        Path(path).write_text(json.dumps(trace))
@@ -2,20 +2,22 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import ast
+import dis
 import inspect
 import json
 import os
+import sqlite3
 import sys
 from itertools import chain, dropwhile
 from pathlib import Path
 from textwrap import dedent
 from types import CodeType, ModuleType
 import typing
-from typing import Any, Callable, Dict, Optional, TypeVar, cast
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TypeVar, cast
 
 from .errors import CompositeError, HashingError
-from .hashing import Hash, Hashed, HashedComposite, hash_text
-from .utils import fullname_of
+from .hashing import Hash, Hashed, HashedComposite, hash_algorithm, hash_text
+from .utils import Pathable, fullname_of
 
 __all__ = ()
 
@@ -23,7 +25,74 @@ _T = TypeVar('_T')
 
 # Travis duplicates some stdlib modules in virtualenv
 _stdlib_paths = [str(Path(m.__file__).parent) for m in [os, ast]]
-_cache: Dict[Callable[..., Any], Hash] = {}
+_cache: Dict[Tuple[Callable[..., Any], str], Hash] = {}
+# specs of hashed functions, used to explain changes of hashes
+_specs: Dict[Hash, str] = {}
+_python_version = '.'.join(map(str, sys.version_info[:2]))
+
+
+class AstCache:
+    """Persistent cache of normalized source code of functions.
+
+    Entries are keyed by the source file, qualified name and first line of a
+    function, and are valid only while the size and modification time of the
+    source file are unchanged.
+    """
+
+    def __init__(self, path: Pathable) -> None:
+        self._db = sqlite3.connect(str(path), timeout=30)
+        # losing recent entries on a system crash only costs rehashing
+        self._db.execute('PRAGMA synchronous = OFF')
+        with self._db:
+            self._db.execute(
+                """\
+CREATE TABLE IF NOT EXISTS ast_codes (
+    python   TEXT,
+    filename TEXT,
+    qualname TEXT,
+    lineno   INTEGER,
+    size     INTEGER,
+    mtime_ns INTEGER,
+    ast_code TEXT,
+    PRIMARY KEY (python, filename, qualname, lineno)
+)
+"""
+            )
+
+    def ast_code_of(self, func: Callable[..., Any]) -> str:
+        """Return a cached result of :func:`ast_code_of`."""
+        code = func.__code__
+        try:
+            st = os.stat(code.co_filename)
+        except OSError:
+            return ast_code_of(func)
+        key = _python_version, code.co_filename, func.__qualname__, code.co_firstlineno
+        row = self._db.execute(
+            'SELECT size, mtime_ns, ast_code FROM ast_codes '
+            'WHERE python = ? AND filename = ? AND qualname = ? AND lineno = ?',
+            key,
+        ).fetchone()
+        if row and tuple(row[:2]) == (st.st_size, st.st_mtime_ns):
+            return cast(str, row[2])
+        ast_code = ast_code_of(func)
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO ast_codes VALUES (?,?,?,?,?,?,?)',
+                (*key, st.st_size, st.st_mtime_ns, ast_code),
+            )
+        return ast_code
+
+
+_ast_cache: Optional[AstCache] = None
+
+
+def set_ast_cache(path: Optional[Pathable]) -> None:
+    """Persist normalized source code of hashed functions in a database.
+
+    :param path: path to the database, or None to disable persistence
+    """
+    global _ast_cache
+    _ast_cache = AstCache(path) if path else None
 
 
 def is_stdlib(mod: ModuleType) -> bool:
@@ -41,14 +110,84 @@ def version_of(mod: ModuleType) -> Optional[str]:
 
 
 def hash_function(func: Callable[..., Any]) -> Hash:
+    key = func, hash_algorithm()
     try:
-        return _cache[func]
+        return _cache[key]
     except KeyError:
         pass
-    ast_code = ast_code_of(func)
+    ast_code = _ast_cache.ast_code_of(func) if _ast_cache else ast_code_of(func)
     hashed_globals = hashed_globals_of(func)
     spec = json.dumps({'ast_code': ast_code, 'globals': hashed_globals}, sort_keys=True)
-    return _cache.setdefault(func, hash_text(spec))
+    hashid = hash_text(spec)
+    _specs[hashid] = spec
+    return _cache.setdefault(key, hashid)
+
+
+def _function_dep(hashed_global: str) -> Optional[Hash]:
+    kind, _, hashid = hashed_global.partition(':')
+    if kind in {'function', 'func_hash'} and hashid != 'self':
+        return Hash(hashid.split(',')[0])
+    return None
+
+
+def function_specs(hashid: Hash) -> Dict[Hash, str]:
+    """Return specs of a hashed function and all functions it depends on."""
+    specs: Dict[Hash, str] = {}
+    queue = [hashid]
+    while queue:
+        hashid = queue.pop()
+        if hashid in specs or hashid not in _specs:
+            continue
+        specs[hashid] = _specs[hashid]
+        hashed_globals: Dict[str, str] = json.loads(specs[hashid])['globals']
+        for value in hashed_globals.values():
+            dep = _function_dep(value)
+            if dep:
+                queue.append(dep)
+    return specs
+
+
+def _excerpt(a: str, b: str, width: int = 60) -> Tuple[str, str]:
+    start = next(
+        (i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b))
+    )
+    window = slice(max(start - width // 2, 0), start + width // 2)
+    return a[window], b[window]
+
+
+def diff_functions(
+    old: Hash, new: Hash, old_spec_for: Callable[[Hash], Optional[str]]
+) -> Iterator[str]:
+    """Describe how the ingredients of a function hash changed.
+
+    :param old: previous hash of a function
+    :param new: current hash of a function, hashed within this process
+    :param old_spec_for: returns a stored spec of a function hash
+    """
+    old_spec, new_spec = old_spec_for(old), _specs.get(new)
+    if old_spec is None or new_spec is None:
+        yield f'no stored ingredients for {old[:6]} -> {new[:6]}'
+        return
+    old_dct, new_dct = json.loads(old_spec), json.loads(new_spec)
+    if old_dct['ast_code'] != new_dct['ast_code']:
+        old_code, new_code = _excerpt(old_dct['ast_code'], new_dct['ast_code'])
+        yield f'code changed: ...{old_code}... -> ...{new_code}...'
+    old_globals: Dict[str, str] = old_dct['globals']
+    new_globals: Dict[str, str] = new_dct['globals']
+    for name in sorted(old_globals.keys() | new_globals.keys()):
+        old_value, new_value = old_globals.get(name), new_globals.get(name)
+        if old_value == new_value:
+            continue
+        if old_value is None:
+            yield f'global {name} added: {new_value}'
+        elif new_value is None:
+            yield f'global {name} removed: {old_value}'
+        else:
+            yield f'global {name} changed: {old_value} -> {new_value}'
+            old_dep, new_dep = _function_dep(old_value), _function_dep(new_value)
+            if old_dep and new_dep and old_dep != new_dep:
+                for line in diff_functions(old_dep, new_dep, old_spec_for):
+                    yield f'  {line}'
 
 
 def ast_code_of(func: Callable[..., Any]) -> str:
@@ -124,7 +263,8 @@ def hashed_globals_of(func: Callable[..., Any]) -> Dict[str, str]:
 
 
 # adapted function from stdlib which parses closures in code consts as well
-# see https://bugs.python.org/issue34947
+# see https://bugs.python.org/issue34947, and which considers only names loaded
+# as globals rather than all names, which include attributes
 def getclosurevars(func: Callable[..., Any]) -> inspect.ClosureVars:
     code = func.__code__
     nonlocal_vars = {
@@ -144,7 +284,10 @@ def getclosurevars(func: Callable[..., Any]) -> inspect.ClosureVars:
         for const in code.co_consts:
             if isinstance(const, CodeType):
                 codes.append(const)
-        for name in code.co_names:
+        for instr in dis.get_instructions(code):
+            if instr.opname not in {'LOAD_GLOBAL', 'LOAD_NAME'}:
+                continue
+            name = instr.argval
             try:
                 global_vars[name] = global_ns[name]
             except KeyError:
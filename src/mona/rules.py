@@ -3,13 +3,13 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import inspect
 from functools import wraps
-from typing import Any, Callable, Generic, List, TypeVar
+from typing import Any, Callable, Dict, Generic, Iterable, List, Optional, TypeVar
 
 from .errors import MonaError
 from .hashing import Hashed
 from .pyhash import hash_function
 from .sessions import Session
-from .tasks import Corofunc, Task
+from .tasks import BatchCorofunc, Corofunc, Task
 
 _T = TypeVar('_T')
 ArgFactory = Callable[[], Hashed[object]]
@@ -28,6 +28,7 @@ class Rule(Generic[_T]):
         if not inspect.iscoroutinefunction(corofunc):
             raise MonaError(f'Task function is not a coroutine: {corofunc}')
         self._corofunc = corofunc
+        self._batch_corofunc: Optional[BatchCorofunc[_T]] = None
         self._extra_arg_factories: List[ArgFactory] = []
         wraps(corofunc)(self)
 
@@ -36,6 +37,11 @@ class Rule(Generic[_T]):
             self._extra_args = [factory() for factory in self._extra_arg_factories]
             hashes = [
                 hash_function(self._corofunc),
+                *(
+                    [hash_function(self._batch_corofunc)]
+                    if self._batch_corofunc
+                    else []
+                ),
                 *(obj.hashid for obj in self._extra_args),
             ]
             self._hash = ','.join(hashes)
@@ -44,18 +50,37 @@ class Rule(Generic[_T]):
         self._ensure_extra_args()
         return self._hash
 
+    def _update_task_kwargs(self, kwargs: Dict[str, Any]) -> None:
+        assert 'rule' not in kwargs
+        kwargs['rule'] = self._corofunc.__name__
+        if self._batch_corofunc:
+            kwargs['batch'] = self._batch_corofunc
+
     def __call__(self, *args: Any, **kwargs: Any) -> Task[_T]:
         """Create a task.
 
         All arguments are passed to :class:`Task`.
         """
         self._ensure_extra_args()
-        assert 'rule' not in kwargs
-        kwargs['rule'] = self._corofunc.__name__
+        self._update_task_kwargs(kwargs)
         return Session.active().create_task(
             self._corofunc, *args, *self._extra_args, **kwargs
         )
 
+    def map(self, *iterables: Iterable[Any], **kwargs: Any) -> List[Task[_T]]:
+        """Create a task for each element of the iterables in bulk.
+
+        Equivalent to ``[rule(*args) for args in zip(*iterables)]``, but faster
+        for large sweeps, see :meth:`Session.create_tasks`.
+        """
+        self._ensure_extra_args()
+        self._update_task_kwargs(kwargs)
+        return Session.active().create_tasks(
+            self._corofunc,
+            ((*args, *self._extra_args) for args in zip(*iterables)),
+            **kwargs,
+        )
+
     def add_extra_arg(self, factory: ArgFactory) -> None:
         """Register an extra argument factory.
 
@@ -65,7 +90,31 @@ class Rule(Generic[_T]):
         assert not hasattr(self, '_extra_args')
         self._extra_arg_factories.append(factory)
 
+    def batch(self, corofunc: BatchCorofunc[_T]) -> BatchCorofunc[_T]:
+        """Register a vectorized implementation of the rule.
+
+        Tasks of the rule that become ready before the session runs out of
+        other work are then executed together in a single call of the
+        vectorized implementation, in batches of at most
+        :data:`~mona.sessions.BATCH_SIZE` tasks. The implementation is hashed
+        as part of the rule.
+        It receives a list of argument tuples and must return a list of results
+        in the same order. The first task of a batch acts as the running task.
+
+        :param corofunc: a coroutine function
+        """
+        if not inspect.iscoroutinefunction(corofunc):
+            raise MonaError(f'Batch function is not a coroutine: {corofunc}')
+        assert not hasattr(self, '_hash')
+        self._batch_corofunc = corofunc
+        return corofunc
+
     @property
     def corofunc(self) -> Corofunc[_T]:
         """Coroutine function associated with the rule."""
         return self._corofunc
+
+    @property
+    def batch_corofunc(self) -> Optional[BatchCorofunc[_T]]:
+        """Vectorized coroutine function associated with the rule."""
+        return self._batch_corofunc
@@ -5,19 +5,46 @@ import asyncio
 import logging
 import os
 import subprocess
-from typing import Any, Callable, Optional, Tuple, TypeVar, Union
+import sys
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 from typing_extensions import Protocol, runtime
 
 from .sessions import Session
 from .tasks import Corofunc
+from .tracing import Tracer
 
 __version__ = '0.1.1'
-__all__ = ['run_shell', 'run_process', 'run_thread']
+__all__ = ['run_shell', 'run_process', 'run_thread', 'run_in_process']
 
 log = logging.getLogger(__name__)
 
 _T = TypeVar('_T')
 ProcessOutput = Union[bytes, Tuple[bytes, bytes]]
+Resources = Dict[str, float]
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:  # Python 3.7
+    SharedMemory = None  # type: ignore
+
+SHARED_ARRAY_MIN_BYTES = 2 ** 16
+_default_process_pool: Optional[ProcessPoolExecutor] = None
 
 
 @runtime
@@ -34,7 +61,9 @@ def _scheduler() -> Optional[Scheduler]:
     return scheduler
 
 
-async def run_shell(cmd: str, ncores: int = None, **kwargs: Any) -> ProcessOutput:
+async def run_shell(
+    cmd: str, ncores: int = None, resources: Resources = None, **kwargs: Any
+) -> ProcessOutput:
     """Execute a command in a shell.
 
     Wrapper around :func:`asyncio.create_subprocess_shell` that handles errors
@@ -42,6 +71,8 @@ async def run_shell(cmd: str, ncores: int = None, **kwargs: Any) -> ProcessOutpu
 
     :param str cmd: a shell command to be executed
     :param int ncores: number of cores that should be taken by the process
+    :param dict resources: amounts of other resources taken by the process,
+                           see :class:`~mona.plugins.Parallel`
     :param kwargs: all other keyword arguments are passed to
                    :func:`~asyncio.create_subprocess_shell`.
                    :data:`~subprocess.PIPE` is passed to `stdin` and `stdout`
@@ -54,11 +85,15 @@ async def run_shell(cmd: str, ncores: int = None, **kwargs: Any) -> ProcessOutpu
     assert 'shell' not in kwargs
     kwargs['shell'] = True
     if scheduler:
-        return await scheduler(_run_process, cmd, ncores=ncores, **kwargs)
+        return await scheduler(
+            _run_process, cmd, ncores=ncores, resources=resources, **kwargs
+        )
     return await _run_process(cmd, **kwargs)
 
 
-async def run_process(*args: str, ncores: int = None, **kwargs: Any) -> ProcessOutput:
+async def run_process(
+    *args: str, ncores: int = None, resources: Resources = None, **kwargs: Any
+) -> ProcessOutput:
     """Create a subprocess.
 
     Wrapper around :func:`asyncio.create_subprocess_exec` that handles errors
@@ -66,6 +101,8 @@ async def run_process(*args: str, ncores: int = None, **kwargs: Any) -> ProcessO
 
     :param str args: arguments of the subprocess
     :param int ncores: number of cores that should be taken by the process
+    :param dict resources: amounts of other resources taken by the process,
+                           see :class:`~mona.plugins.Parallel`
     :param kwargs: all other keyword arguments are passed to
                    :func:`~asyncio.create_subprocess_exec`.
                    :data:`~subprocess.PIPE` is passed to `stdin` and `stdout`
@@ -76,7 +113,9 @@ async def run_process(*args: str, ncores: int = None, **kwargs: Any) -> ProcessO
     """
     scheduler = _scheduler()
     if scheduler:
-        return await scheduler(_run_process, args, ncores=ncores, **kwargs)
+        return await scheduler(
+            _run_process, args, ncores=ncores, resources=resources, **kwargs
+        )
     return await _run_process(args, **kwargs)
 
 
@@ -85,6 +124,8 @@ async def _run_process(
     shell: bool = False,
     input: bytes = None,
     ncores: int = None,
+    mem_limit: int = None,
+    cores: List[int] = None,
     **kwargs: Any,
 ) -> Union[bytes, Tuple[bytes, bytes]]:
     kwargs.setdefault('stdin', subprocess.PIPE)
@@ -92,14 +133,26 @@ async def _run_process(
     kwargs.setdefault('env', os.environ.copy())
     if ncores is not None:
         kwargs['env']['MONA_NCORES'] = str(ncores)
+    if cores is not None:
+        kwargs['env']['MONA_CORES'] = ','.join(map(str, cores))
+    if mem_limit is not None or cores is not None:
+        assert 'preexec_fn' not in kwargs
+        kwargs['preexec_fn'] = partial(_limit_child, mem_limit, cores)
     if shell:
         assert isinstance(args, str)
         proc = await asyncio.create_subprocess_shell(args, **kwargs)
     else:
         assert isinstance(args, tuple)
         proc = await asyncio.create_subprocess_exec(*args, **kwargs)
+    tracer = Tracer.active()
+    span: ContextManager[None] = (
+        tracer.span('process', pid=proc.pid, args=repr(args))
+        if tracer
+        else nullcontext()
+    )
     try:
-        stdout, stderr = await proc.communicate(input)
+        with span:
+            stdout, stderr = await proc.communicate(input)
     except asyncio.CancelledError:
         try:
             proc.terminate()
@@ -116,7 +169,18 @@ async def _run_process(
     return stdout, stderr
 
 
-async def run_thread(func: Callable[..., _T], *args: Any) -> _T:
+def _limit_child(mem_limit: Optional[int], cores: Optional[List[int]]) -> None:
+    if mem_limit is not None:
+        import resource
+
+        resource.setrlimit(resource.RLIMIT_AS, (mem_limit, mem_limit))
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+
+
+async def run_thread(
+    func: Callable[..., _T], *args: Any, resources: Resources = None
+) -> _T:
     """Run a callable in a new thread.
 
     Wrapper around :meth:`asyncio.AbstractEventLoop.run_in_executor` whose
@@ -124,15 +188,151 @@ async def run_thread(func: Callable[..., _T], *args: Any) -> _T:
 
     :param func: a callable
     :param args: positional arguments to the callable.
+    :param dict resources: amounts of resources taken by the thread,
+                           see :class:`~mona.plugins.Parallel`
 
     Return the result of the callable.
     """
     scheduler = _scheduler()
     if scheduler:
-        return await scheduler(_run_thread, func, *args)
+        return await scheduler(_run_thread, func, *args, resources=resources)
     return await _run_thread(func, *args)
 
 
 async def _run_thread(func: Callable[..., _T], *args: Any) -> _T:
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, func, *args)
+
+
+async def run_in_process(
+    func: Callable[..., _T], *args: Any, resources: Resources = None
+) -> _T:
+    """Run a callable in a worker process.
+
+    The worker processes are kept in a pool and reused. When the
+    :class:`~mona.plugins.Parallel` plugin is used, the pool is owned by the
+    plugin and each call takes a single core. Numpy arrays in the arguments and
+    the result are passed via shared memory rather than pickled. Arrays in the
+    result are views of the shared memory, which is released once they and
+    all arrays derived from them are freed.
+
+    :param func: a picklable callable, such as a module-level function
+    :param args: positional arguments to the callable.
+    :param dict resources: amounts of resources taken by the call,
+                           see :class:`~mona.plugins.Parallel`
+
+    Return the result of the callable.
+    """
+    scheduler = _scheduler()
+    if scheduler:
+        return await scheduler(_run_in_process, func, *args, resources=resources)
+    return await _run_in_process(func, *args)
+
+
+def _process_pool() -> Executor:
+    global _default_process_pool
+
+    pool = cast(Optional[Executor], Session.active().storage.get('process_pool'))
+    if pool:
+        return pool
+    if not _default_process_pool:
+        _default_process_pool = ProcessPoolExecutor()
+    return _default_process_pool
+
+
+async def _run_in_process(func: Callable[..., _T], *args: Any) -> _T:
+    loop = asyncio.get_running_loop()
+    arg_shms: List[Any] = []
+    try:
+        shared_args = cast(
+            Tuple[object, ...], _map_objects(args, lambda o: _to_shared(o, arg_shms))
+        )
+        shared_result = await loop.run_in_executor(
+            _process_pool(), _call_shared, func, shared_args
+        )
+    finally:
+        _release_shared(arg_shms, unlink=True)
+    return cast(_T, _map_objects(shared_result, _own_shared))
+
+
+class _SharedArray(NamedTuple):
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def _map_objects(obj: object, func: Callable[[object], object]) -> object:
+    obj = func(obj)
+    if type(obj) is list:
+        return [_map_objects(x, func) for x in cast(List[object], obj)]
+    if type(obj) is tuple:
+        return tuple(_map_objects(x, func) for x in cast(Tuple[object, ...], obj))
+    if type(obj) is dict:
+        return {
+            k: _map_objects(v, func) for k, v in cast(Dict[Any, object], obj).items()
+        }
+    return obj
+
+
+def _to_shared(obj: object, shms: List[Any]) -> object:
+    np = sys.modules.get('numpy')
+    if not (SharedMemory is not None and np and isinstance(obj, np.ndarray)):
+        return obj
+    if obj.nbytes < SHARED_ARRAY_MIN_BYTES or obj.dtype.hasobject:
+        return obj
+    shm = SharedMemory(create=True, size=obj.nbytes)
+    shms.append(shm)
+    np.ndarray(obj.shape, obj.dtype, buffer=shm.buf)[...] = obj
+    return _SharedArray(shm.name, obj.shape, obj.dtype.str)
+
+
+def _from_shared(obj: object, shms: List[Any]) -> object:
+    if not isinstance(obj, _SharedArray):
+        return obj
+    import numpy as np
+
+    shm = SharedMemory(obj.name)
+    shms.append(shm)
+    return np.ndarray(obj.shape, np.dtype(obj.dtype), buffer=shm.buf)
+
+
+def _own_shared(obj: object) -> object:
+    if not isinstance(obj, _SharedArray):
+        return obj
+    import numpy as np
+
+    shm = SharedMemory(obj.name)
+    shm.unlink()  # the mapping stays valid until closed
+    arr = np.ndarray(obj.shape, np.dtype(obj.dtype), buffer=shm.buf)
+    # views of the array keep it alive, so the memory is unmapped only after
+    # the last of them is freed
+    weakref.finalize(arr, shm.close).atexit = False
+    return arr
+
+
+def _release_shared(shms: List[Any], unlink: bool) -> None:
+    for shm in shms:
+        try:
+            shm.close()
+        except BufferError:  # still referenced from a living array
+            pass
+        if unlink:
+            shm.unlink()
+
+
+def _call_shared(
+    func: Callable[..., object], shared_args: Tuple[object, ...]
+) -> object:
+    arg_shms: List[Any] = []
+    result_shms: List[Any] = []
+    args = cast(
+        Tuple[object, ...],
+        _map_objects(shared_args, lambda o: _from_shared(o, arg_shms)),
+    )
+    try:
+        result = func(*args)
+        return _map_objects(result, lambda o: _to_shared(o, result_shms))
+    finally:
+        del args
+        _release_shared(arg_shms, unlink=False)
+        _release_shared(result_shms, unlink=False)
@@ -73,6 +73,7 @@ class Aims(Pluggable):
         - ``aims``: Aims executable, must be present in ``PATH``.
         - ``check``: Whether task should error out on abnormal Aims exit.
         - ``ncores``: Number of cores to use, all available if not given.
+        - ``resources``: Other resources taken by Aims, such as ``mem_gb``.
         """
         self.run_plugins('process', kwargs)
         script = File.from_str('aims.sh', kwargs.pop('script'))
@@ -82,6 +83,8 @@ class Aims(Pluggable):
         ]
         task = dir_task(script, inputs, label=label)
         task.storage['ncores'] = kwargs.pop('ncores', -1)
+        if 'resources' in kwargs:
+            task.storage['resources'] = kwargs.pop('resources')
         if kwargs:
             raise InvalidInput(f'Unknown Aims kwargs: {list(kwargs.keys())}')
         return task
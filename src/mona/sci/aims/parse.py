@@ -1,7 +1,6 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
-import io
 import xml.etree.ElementTree as ET  # noqa: N814
 from typing import IO, Any, Dict, Type
 
@@ -21,13 +20,13 @@ async def parse_aims(outputs: Dict[str, File]) -> Any:
     The task takes the output of :class:`mona.sci.aims.Aims` as an input and
     returns a dictionary of parsed results as output.
     """
-    stdout = outputs['results.xml'].read_text()
-    parsed = parse_xml(io.StringIO(stdout))
+    with outputs['results.xml'].open() as f:
+        parsed = parse_xml(f)
     energies = {x['name']: x['value'][0] for x in parsed['energy']}
     return {'energy': energies['Total energy']}
 
 
-def parse_xml(source: IO[str]) -> Any:
+def parse_xml(source: IO[Any]) -> Any:
     root = ET.parse(source).getroot()
     return parse_xmlelem(root)
 
@@ -7,13 +7,15 @@ import asyncio
 import logging
 import warnings
 from collections import defaultdict
-from contextlib import asynccontextmanager, contextmanager
-from contextvars import ContextVar
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar, copy_context
 from functools import wraps
 from itertools import chain
 from typing import (
+    TYPE_CHECKING,
     Any,
     AsyncGenerator,
+    Awaitable,
     Callable,
     Dict,
     FrozenSet,
@@ -23,6 +25,7 @@ from typing import (
     NamedTuple,
     Optional,
     Sequence,
+    Set,
     Tuple,
     TypeVar,
     Union,
@@ -39,13 +42,26 @@ from .dag import (
     traverse,
     traverse_async,
 )
-from .errors import FutureError, MonaError, SessionError, TaskError
+from .errors import CompositeError, FutureError, MonaError, SessionError, TaskError
 from .futures import STATE_COLORS
-from .hashing import Hash, Hashed
+from .hashing import (
+    DEFAULT_HASH_ALGORITHM,
+    HASH_ALGORITHMS,
+    Hash,
+    Hashed,
+    HashedComposite,
+    InternTable,
+    using_composite_threshold,
+    using_hash_algorithm,
+    using_intern_table,
+)
 from .pluggable import Pluggable, Plugin
-from .tasks import Corofunc, HashedFuture, State, Task, TaskComposite
+from .tasks import BatchCorofunc, Corofunc, HashedFuture, State, Task, TaskComposite
 from .utils import Literal, split
 
+if TYPE_CHECKING:
+    from .tracing import Tracer
+
 __version__ = '0.1.0'
 __all__ = ['Session']
 
@@ -57,6 +73,8 @@ TaskExecuted = NodeExecuted[ATask]
 TaskExecutor = NodeExecutor[ATask]
 ExceptionHandler = Callable[[ATask, Exception], bool]
 TaskFilter = Callable[[ATask], bool]
+TaskBatch = List[Tuple[ATask, TaskExecuted]]
+TaskRunner = Callable[[ATask], Awaitable[object]]
 
 _active_session: ContextVar[Optional[Session]] = ContextVar(
     'active_session', default=None
@@ -91,6 +109,10 @@ class SessionPlugin(Plugin['Session']):
     def post_create(self, task: ATask) -> None:
         pass
 
+    def post_create_tasks(self, tasks: Sequence[ATask]) -> None:
+        for task in tasks:
+            self.post_create(task)
+
 
 class SessionGraph(NamedTuple):
     deps: Dict[Hash, FrozenSet[Hash]]
@@ -106,6 +128,7 @@ class TraversalManager:
         exception_handler: ExceptionHandler = None,
         task_filter: TaskFilter = None,
         limit: int = None,
+        tracer: Tracer = None,
     ):
         self._edges_from = edges_from
         self._execute = execute
@@ -113,6 +136,7 @@ class TraversalManager:
         self._task_filter = task_filter
         self._limit = limit
         self._limit_reached = False
+        self._tracer = tracer
         self._exceptions: Dict[ATask, Exception] = {}
         self._n_executed = 0
         self._wont_schedule: List[ATask] = []
@@ -133,13 +157,24 @@ class TraversalManager:
 
     def schedule(self, task: ATask, register: Callable[[ATask], None]) -> None:
         if task.state < State.RUNNING:
-            task.add_ready_callback(register)
+            if self._tracer:
+                tracer = self._tracer
+
+                def _register(task: ATask) -> None:
+                    tracer.instant('ready', task)
+                    register(task)
+
+                task.add_ready_callback(_register)
+            else:
+                task.add_ready_callback(register)
         else:
             self._wont_schedule.append(task)
 
     async def execute(self, task: ATask, done: TaskExecuted) -> bool:
         def _done(execute_results: NodeResult[ATask]) -> None:
             n, e, candidates = execute_results
+            if self._tracer and spanid is not None:
+                self._tracer.end('run', spanid)
             tasks: List[ATask] = []
             for task in candidates:
                 self._append_filtered_to(tasks, task)
@@ -154,6 +189,7 @@ class TraversalManager:
                 log.info('Maximum number of executed tasks reached')
         self._n_executed += 1
         log.info(f'{task}: will run')
+        spanid = self._tracer.begin('run', task) if self._tracer else None
         assert await self._execute(task, _done)
         return True
 
@@ -196,6 +232,44 @@ class TraversalManager:
             log.info(msg)
 
 
+# results with at least this many items in nested lists and dictionaries are
+# hashed in a worker thread
+THREAD_HASHING_ITEMS = 10_000
+# batches are run as soon as they reach this size
+BATCH_SIZE = 1_000
+
+
+def _is_large(obj: object) -> bool:
+    stack = [obj]
+    nitems = 0
+    while stack:
+        o = stack.pop()
+        if isinstance(o, (list, dict)):
+            nitems += len(o)
+            if nitems >= THREAD_HASHING_ITEMS:
+                return True
+            stack.extend(o.values() if isinstance(o, dict) else o)
+    return False
+
+
+def _hash_detached(obj: object) -> Optional[Hashed[object]]:
+    """Hash an object outside the event loop.
+
+    Return None if the object contains futures, which must be created on the
+    event loop. Raise CompositeError if the object cannot be hashed.
+    """
+    hashed = HashedComposite.from_object(obj)
+    stack: List[Hashed[object]] = [hashed]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, HashedFuture):
+            return None
+        if isinstance(obj, HashedComposite):
+            stack.extend(obj.components)
+    assert hashed.hashid
+    return hashed
+
+
 class Session(Pluggable):
     """A context manager in which tasks can be created.
 
@@ -203,11 +277,23 @@ class Session(Pluggable):
                     plugin with the created session as an argument
     :param bool warn: warn at the end of session if some created tasks were not
                  executed and no tasks were explicitly filtered
+    :param str hash_algorithm: algorithm used to hash all objects within the
+                               session, see :data:`~mona.hashing.HASH_ALGORITHMS`
+    :param int composite_threshold: hash nested lists and dictionaries whose
+                                    JSON encoding has at least this many
+                                    characters as separate composites, see
+                                    :func:`~mona.hashing.using_composite_threshold`
     """
 
     def __init__(
-        self, plugins: Iterable[SessionPlugin] = None, warn: bool = True
+        self,
+        plugins: Iterable[SessionPlugin] = None,
+        warn: bool = True,
+        hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+        composite_threshold: int = None,
     ) -> None:
+        if hash_algorithm not in HASH_ALGORITHMS:
+            raise MonaError(f'Unknown hash algorithm: {hash_algorithm!r}')
         Pluggable.__init__(self)
         for plugin in plugins or ():
             plugin(self)
@@ -216,13 +302,25 @@ class Session(Pluggable):
         self._running_task: ContextVar[Optional[ATask]] = ContextVar('running_task')
         self._running_task.set(None)
         self._storage: Dict[str, Any] = {}
+        self._batches: Dict[BatchCorofunc[object], TaskBatch] = {}
+        self._batch_runners: Set[asyncio.Task[None]] = set()
+        self._dispatched: Set[ATask] = set()
+        self._idle = False
         self._warn = warn
+        self._hash_algorithm = hash_algorithm
+        self._composite_threshold = composite_threshold
+        self._intern_table = InternTable()
 
     def _check_active(self) -> None:
         sess = _active_session.get()
         if sess is None or sess is not self:
             raise SessionError(f'Not active: {self!r}', self)
 
+    @property
+    def intern_table(self) -> InternTable:
+        """Table of interned composites and task components."""
+        return self._intern_table
+
     @property
     def storage(self) -> Dict[str, object]:
         """General-purpose dictionary-based storage."""
@@ -240,7 +338,19 @@ class Session(Pluggable):
     def __enter__(self) -> Session:
         assert _active_session.get() is None
         self._active_session_token = _active_session.set(self)
-        self.run_plugins('post_enter', self)
+        self._hashing_ctx = ExitStack()
+        self._hashing_ctx.enter_context(using_hash_algorithm(self._hash_algorithm))
+        self._hashing_ctx.enter_context(
+            using_composite_threshold(self._composite_threshold)
+        )
+        self._intern_table = InternTable()
+        self._hashing_ctx.enter_context(using_intern_table(self._intern_table))
+        try:
+            self.run_plugins('post_enter', self)
+        except Exception:
+            self._hashing_ctx.close()
+            _active_session.reset(self._active_session_token)
+            raise
         return self
 
     def _filter_tasks(self, cond: TaskFilter) -> List[ATask]:
@@ -249,6 +359,10 @@ class Session(Pluggable):
     def __exit__(self, exc_type: Any, *args: Any) -> None:
         assert _active_session.get() is self
         self.run_plugins('pre_exit', self)
+        self._hashing_ctx.close()
+        del self._hashing_ctx
+        self._intern_table.clear()
+        log.debug(f'Interned objects: {self._intern_table}')
         _active_session.reset(self._active_session_token)
         del self._active_session_token
         if self._warn and exc_type is None:
@@ -257,6 +371,8 @@ class Session(Pluggable):
                 warnings.warn(f'tasks have never run: {tasks_not_run}', RuntimeWarning)
         self._tasks.clear()
         self._storage.clear()
+        self._batches.clear()
+        self._dispatched.clear()
         self._graph.deps.clear()
         self._graph.side_effects.clear()
         self._graph.backflow.clear()
@@ -279,7 +395,9 @@ class Session(Pluggable):
             assert self._running_task.get() is task
             self._running_task.set(None)
 
-    def _process_objects(self, objs: Iterable[Hashed[object]]) -> List[ATask]:
+    def _collect_objects(
+        self, objs: Iterable[Hashed[object]]
+    ) -> Tuple[List[ATask], List[Hashed[object]]]:
         objs = list(
             traverse(objs, lambda o: o.components if not isinstance(o, Task) else [])
         )
@@ -287,6 +405,10 @@ class Session(Pluggable):
         for task in tasks:
             if task.hashid not in self._tasks:
                 raise TaskError(f'Not in session: {task!r}', task)
+        return tasks, objs
+
+    def _process_objects(self, objs: Iterable[Hashed[object]]) -> List[ATask]:
+        tasks, objs = self._collect_objects(objs)
         self.run_plugins('save_hashed', objs)
         return tasks
 
@@ -302,10 +424,50 @@ class Session(Pluggable):
         self._graph.deps[task.hashid] = frozenset(t.hashid for t in arg_tasks)
         return task, True
 
+    def register_tasks(
+        self, tasks: Iterable[Task[_T]]
+    ) -> Tuple[List[Task[_T]], List[Task[_T]]]:
+        """Register tasks in a session in a single pass.
+
+        Return all tasks as registered in the session and those of them that
+        were newly registered.
+        """
+        all_tasks: List[Task[_T]] = []
+        new_tasks: List[Task[_T]] = []
+        objs: Dict[Hash, Hashed[object]] = {}
+        for task in tasks:
+            registered = cast(Optional[Task[_T]], self._tasks.get(task.hashid))
+            if registered:
+                all_tasks.append(registered)
+                continue
+            self._tasks[task.hashid] = task
+            task.register()
+            arg_tasks, arg_objs = self._collect_objects(task.args)
+            self._graph.deps[task.hashid] = frozenset(t.hashid for t in arg_tasks)
+            objs.update((obj.hashid, obj) for obj in arg_objs)
+            all_tasks.append(task)
+            new_tasks.append(task)
+        self.run_plugins('save_hashed', list(objs.values()))
+        return all_tasks, new_tasks
+
     def add_side_effect_of(self, caller: ATask, callee: ATask) -> None:
         """Register a task created by a task."""
         self._graph.side_effects[caller.hashid].append(callee.hashid)
 
+    def forget(self, task: ATask) -> None:
+        """Remove a task and the tasks it created from a session.
+
+        Created tasks are kept if they were created also by other tasks.
+        """
+        created = self._graph.side_effects.pop(task.hashid, [])
+        kept = {h for hashes in self._graph.side_effects.values() for h in hashes}
+        for hashid in [task.hashid, *created]:
+            if hashid in kept:
+                continue
+            self._tasks.pop(hashid, None)
+            self._graph.deps.pop(hashid, None)
+            self._graph.backflow.pop(hashid, None)
+
     def create_task(
         self, corofunc: Corofunc[_T], *args: Any, **kwargs: Any
     ) -> Task[_T]:
@@ -324,6 +486,40 @@ class Session(Pluggable):
             self.run_plugins('post_create', task)
         return task
 
+    def create_tasks(
+        self, corofunc: Corofunc[_T], args_list: Iterable[Sequence[Any]], **kwargs: Any
+    ) -> List[Task[_T]]:
+        """Create new tasks in bulk.
+
+        Arguments shared between the tasks are hashed only once and all tasks
+        are registered and passed to plugins in a single pass.
+
+        :param corofunc: a coroutine function to be executed
+        :param args_list: arguments to the coroutine for each task
+        :param kwargs: keyword arguments passed to :class:`~tasks.Task`
+        """
+        hashed_args: Dict[int, Hashed[object]] = {}
+
+        def ensure_hashed(arg: object) -> Hashed[object]:
+            try:
+                return hashed_args[id(arg)]
+            except KeyError:
+                pass
+            return hashed_args.setdefault(id(arg), TaskComposite.ensure_hashed(arg))
+
+        args_list = [list(args) for args in args_list]
+        tasks = [
+            Task(corofunc, *map(ensure_hashed, args), **kwargs) for args in args_list
+        ]
+        caller = self._running_task.get()
+        if caller:
+            for task in tasks:
+                self.add_side_effect_of(caller, task)
+        tasks, registered = self.register_tasks(tasks)
+        if registered:
+            self.run_plugins('post_create_tasks', registered)
+        return tasks
+
     @asynccontextmanager
     async def run_context(self) -> AsyncGenerator[None, None]:
         """Context in which tasks should be run."""
@@ -331,6 +527,9 @@ class Session(Pluggable):
         try:
             yield
         finally:
+            for runner in self._batch_runners:
+                runner.cancel()
+            await asyncio.gather(*self._batch_runners, return_exceptions=True)
             await self.run_plugins_async('post_run')
 
     async def _run_task(self, task: Task[_T]) -> Union[_T, Hashed[_T]]:
@@ -349,6 +548,9 @@ class Session(Pluggable):
 
     def set_result(self, task: Task[_T], result: Union[_T, Hashed[_T]]) -> None:
         """Attach a result to a task."""
+        tracer = cast(Optional['Tracer'], self._storage.get('tracer'))
+        if tracer:
+            tracer.instant('result', task)
         if not isinstance(result, Hashed):
             task.set_result(result)
             return
@@ -362,28 +564,141 @@ class Session(Pluggable):
         backflow = self._process_objects([result])
         self._graph.backflow[task.hashid] = frozenset(t.hashid for t in backflow)
 
-    async def run_task_async(self, task: Task[_T]) -> Union[_T, Hashed[_T]]:
-        """Run a task asynchronously."""
+    def _set_running(self, task: ATask) -> None:
         if task.state < State.READY:
             raise TaskError(f'Not ready: {task!r}', task)
         if task.state > State.READY:
             raise TaskError(f'Task was already run: {task!r}', task)
         task.set_running()
-        with self._running_task_ctx(task):
-            raw_result = await task.corofunc(*(arg.value for arg in task.args))
+
+    async def _hash_result(self, raw_result: _T) -> Union[_T, Hashed[_T]]:
+        if _is_large(raw_result):
+            loop = asyncio.get_running_loop()
+            try:
+                hashed = await loop.run_in_executor(
+                    None, copy_context().run, _hash_detached, raw_result
+                )
+            except CompositeError:
+                return raw_result
+            if hashed:
+                return cast(Hashed[_T], hashed)
+        return cast(_T, TaskComposite.maybe_hashed(raw_result)) or raw_result
+
+    def _set_has_run(
+        self, task: Task[_T], result: Union[_T, Hashed[_T]]
+    ) -> Union[_T, Hashed[_T]]:
         task.set_has_run()
         side_effects = self.side_effects_of(task)
         if side_effects:
             log.debug(f'{task}: created tasks: {list(map(Literal, side_effects))}')
-        result = cast(_T, TaskComposite.maybe_hashed(raw_result)) or raw_result
         self.set_result(task, result)
         self.run_plugins('post_task_run', task)
         return result
 
+    async def run_task_async(self, task: Task[_T]) -> Union[_T, Hashed[_T]]:
+        """Run a task asynchronously.
+
+        The task's coroutine function is called directly unless a plugin
+        provides a task runner, which may run it elsewhere.
+        """
+        self._set_running(task)
+        runner = cast(Optional[TaskRunner], self._storage.get('task_runner'))
+        with self._running_task_ctx(task):
+            if runner:
+                raw_result = cast(_T, await runner(task))
+            else:
+                raw_result = await task.corofunc(*(arg.value for arg in task.args))
+        return self._set_has_run(task, await self._hash_result(raw_result))
+
+    async def run_batch_async(
+        self, tasks: Sequence[Task[_T]]
+    ) -> List[Union[_T, Hashed[_T]]]:
+        """Run tasks of a rule in a single call of its vectorized implementation."""
+        batch_corofunc = tasks[0].batch_corofunc
+        assert batch_corofunc
+        assert all(task.batch_corofunc is batch_corofunc for task in tasks)
+        for task in tasks:
+            self._set_running(task)
+        with self._running_task_ctx(tasks[0]):
+            raw_results = await batch_corofunc(
+                [tuple(arg.value for arg in task.args) for task in tasks]
+            )
+        if len(raw_results) != len(tasks):
+            raise MonaError(
+                f'Batch of {len(tasks)} tasks got {len(raw_results)} results'
+            )
+        results = [await self._hash_result(raw_result) for raw_result in raw_results]
+        return [
+            self._set_has_run(task, result) for task, result in zip(tasks, results)
+        ]
+
+    def _backflow_of(self, task: ATask) -> Iterable[ATask]:
+        return [self._tasks[h] for h in self._graph.backflow.get(task.hashid, ())]
+
+    async def _run_batch(self, batch: TaskBatch) -> None:
+        log.debug(f'Running batch of {len(batch)} tasks')
+        try:
+            await self.run_batch_async([task for task, _ in batch])
+        except Exception as exc:
+            for task, done in batch:
+                done((task, exc, ()))
+        else:
+            for task, done in batch:
+                done((task, None, self._backflow_of(task)))
+
+    def _start_batch(self, batch_corofunc: BatchCorofunc[object]) -> None:
+        batch = self._batches.pop(batch_corofunc, None)
+        if not batch:
+            return
+        runner = asyncio.create_task(self._run_batch(batch))
+        self._batch_runners.add(runner)
+        runner.add_done_callback(self._batch_runners.discard)
+
+    def _maybe_start_batches(self) -> None:
+        # no other task can join a batch until some task finishes
+        if self._idle and not self._dispatched:
+            for batch_corofunc in list(self._batches):
+                self._start_batch(batch_corofunc)
+
+    def _set_idle(self, idle: bool) -> None:
+        self._idle = idle
+        self._maybe_start_batches()
+
+    def _set_undispatched(self, task: ATask) -> None:
+        self._dispatched.discard(task)
+        self._maybe_start_batches()
+
+    def _wrap_dispatch(self, execute: TaskExecutor) -> TaskExecutor:
+        async def _execute(task: ATask, done: TaskExecuted) -> bool:
+            def _done(execute_results: NodeResult[ATask]) -> None:
+                self._set_undispatched(task)
+                done(execute_results)
+
+            self._dispatched.add(task)
+            try:
+                return await execute(task, _done)
+            except BaseException:
+                self._set_undispatched(task)
+                raise
+
+        return _execute
+
+    def _add_to_batch(self, task: ATask, done: TaskExecuted) -> None:
+        batch_corofunc = task.batch_corofunc
+        assert batch_corofunc
+        batch = self._batches.setdefault(batch_corofunc, [])
+        batch.append((task, done))
+        if len(batch) >= BATCH_SIZE:
+            self._start_batch(batch_corofunc)
+
     async def _traverse_execute(self, task: ATask, done: TaskExecuted) -> bool:
+        if task.batch_corofunc:
+            self._add_to_batch(task, done)
+            self._set_undispatched(task)
+            return True
+        self._set_undispatched(task)
         await self.run_task_async(task)
-        backflow = (self._tasks[h] for h in self._graph.backflow.get(task.hashid, ()))
-        done((task, None, backflow))
+        done((task, None, self._backflow_of(task)))
         return True
 
     def eval(self, *args: Any, **kwargs: Any) -> Any:
@@ -419,6 +734,7 @@ class Session(Pluggable):
         if not isinstance(fut, HashedFuture):
             return obj
         fut.register()
+        tracer = cast(Optional['Tracer'], self._storage.get('tracer'))
         mngr = TraversalManager(
             lambda t: (
                 self._tasks[h]
@@ -426,10 +742,15 @@ class Session(Pluggable):
                     self._graph.deps[t.hashid], self._graph.backflow.get(t.hashid, [])
                 )
             ),
-            self.run_plugins('wrap_execute', self._traverse_execute, wrap_first=True),
+            self._wrap_dispatch(
+                self.run_plugins(
+                    'wrap_execute', self._traverse_execute, wrap_first=True
+                )
+            ),
             exception_handler,
             task_filter,
             limit,
+            tracer,
         )
         async for step_or_exception in traverse_async(
             self._process_objects([fut]),
@@ -438,14 +759,19 @@ class Session(Pluggable):
             mngr.execute,
             depth,
             priority,
+            self._set_idle,
         ):
             if isinstance(step_or_exception, NodeException):
                 task, exc = step_or_exception
+                if tracer:
+                    tracer.instant('error', task, exception=repr(exc))
                 mngr.handle_exception(task, exc)
                 self.run_plugins('ignored_exception')
                 task.set_error()
             else:
                 action, task, progress = step_or_exception
+                if tracer and task:
+                    tracer.instant(action.name.lower(), task)
                 progress_line = ' '.join(f'{k}={v}' for k, v in progress.items())
                 tag = action.name
                 if task:
@@ -9,13 +9,17 @@ import json
 import logging
 import pickle
 from abc import abstractmethod
+from functools import lru_cache
 from typing import (
     TYPE_CHECKING,
+    Any,
     Awaitable,
     Callable,
     Dict,
     Iterable,
+    List,
     Optional,
+    Set,
     Tuple,
     TypeVar,
     Union,
@@ -24,7 +28,15 @@ from typing import (
 
 from .errors import CompositeError, FutureError, TaskError
 from .futures import Future, State
-from .hashing import Composite, Hash, Hashed, HashedComposite, HashResolver
+from .hashing import (
+    Composite,
+    Hash,
+    Hashed,
+    HashedComposite,
+    HashResolver,
+    hashed_scalar,
+    interned,
+)
 from .pyhash import hash_function
 from .utils import Empty, Maybe, fullname_of, import_fullname
 
@@ -39,6 +51,10 @@ _T = TypeVar('_T')
 _T_co = TypeVar('_T_co', covariant=True)
 _U = TypeVar('_U')
 Corofunc = Callable[..., Awaitable[_T]]
+BatchCorofunc = Callable[[List[Tuple[Any, ...]]], Awaitable[List[_T]]]
+
+# rules are looked up for every task restored from a spec
+_import_rule = lru_cache(maxsize=None)(import_fullname)
 
 
 # Although this class could be hashable in principle, this would require
@@ -92,8 +108,10 @@ class Task(HashedFuture[_T_co]):
         label: str = None,
         default: Maybe[_T_co] = Empty._,
         rule: str = None,
+        batch: Optional[BatchCorofunc[_T_co]] = None,
     ) -> None:
         self._corofunc = corofunc
+        self._batch_corofunc = batch
         self._args = tuple(map(TaskComposite.ensure_hashed, args))
         Future.__init__(
             self, (arg for arg in self._args if isinstance(arg, HashedFuture))
@@ -114,7 +132,7 @@ class Task(HashedFuture[_T_co]):
         return json.dumps(
             [
                 fullname_of(self._corofunc),
-                hash_function(self._corofunc),
+                self.corohash,
                 *(fut.hashid for fut in self._args),
             ]
         ).encode()
@@ -125,12 +143,17 @@ class Task(HashedFuture[_T_co]):
         corohash: Hash
         arg_hashes: Tuple[Hash, ...]
         rule_name, corohash, *arg_hashes = json.loads(spec)
-        rule: Rule[_T] = import_fullname(rule_name)  # type: ignore
+        rule: Rule[_T] = _import_rule(rule_name)  # type: ignore
         corofunc = rule.corofunc
         assert inspect.iscoroutinefunction(corofunc)
-        assert hash_function(corofunc) == corohash
-        args = (resolve(h) for h in arg_hashes)
-        return cls(corofunc, *args)
+        task = cls(
+            corofunc,
+            *(resolve(h) for h in arg_hashes),
+            rule=corofunc.__name__,
+            batch=rule.batch_corofunc,
+        )
+        assert task.corohash == corohash
+        return task
 
     @property
     def label(self) -> str:
@@ -146,6 +169,19 @@ class Task(HashedFuture[_T_co]):
     def corofunc(self) -> Corofunc[_T_co]:
         return self._corofunc
 
+    @property
+    def batch_corofunc(self) -> Optional[BatchCorofunc[_T_co]]:
+        return self._batch_corofunc
+
+    @property
+    def corohash(self) -> Hash:
+        """Hash of the coroutine function and its vectorized implementation."""
+        if not self._batch_corofunc:
+            return hash_function(self._corofunc)
+        return Hash(
+            f'{hash_function(self._corofunc)},{hash_function(self._batch_corofunc)}'
+        )
+
     @property
     def args(self) -> Tuple[Hashed[object], ...]:
         return self._args
@@ -164,7 +200,7 @@ class Task(HashedFuture[_T_co]):
     def get(
         self, key: object, default: Maybe[object] = Empty._
     ) -> TaskComponent[object]:
-        return TaskComponent(self, [key], default)
+        return TaskComponent.create(self, [key], default)
 
     def resolve(
         self, handler: Callable[[Hashed[_T_co]], _U] = None
@@ -243,9 +279,18 @@ class TaskComponent(HashedFuture[_T_co]):
         self._keys = list(keys)
         Future.__init__(self, [cast(HashedFuture[object], task)])
         self._default = default
-        self._label = ''.join([self._task.label, *(f'[{k!r}]' for k in self._keys)])
         self.add_ready_callback(lambda self: self.set_done())
 
+    @classmethod
+    def create(
+        cls, task: Task[object], keys: List[object], default: Maybe[_T] = Empty._
+    ) -> TaskComponent[_T]:
+        """Create a task component, interned if it has no default."""
+        if not isinstance(default, Empty):
+            return TaskComponent(task, keys, default)
+        spec = json.dumps([task.hashid, *keys]).encode()
+        return interned((cls, spec), lambda: TaskComponent(task, keys))
+
     @property
     def spec(self) -> bytes:
         return json.dumps([self._task.hashid, *self._keys]).encode()
@@ -260,6 +305,10 @@ class TaskComponent(HashedFuture[_T_co]):
 
     @property
     def label(self) -> str:
+        if not hasattr(self, '_label'):
+            self._label = ''.join(
+                [self._task.label, *(f'[{k!r}]' for k in self._keys)]
+            )
         return self._label
 
     @property
@@ -275,7 +324,7 @@ class TaskComponent(HashedFuture[_T_co]):
     def get(
         self, key: object, default: Maybe[object] = Empty._
     ) -> TaskComponent[object]:
-        return TaskComponent(self._task, self._keys + [key], default)
+        return TaskComponent.create(self._task, self._keys + [key], default)
 
     @property
     def task(self) -> Task[object]:
@@ -313,10 +362,18 @@ class TaskComposite(HashedComposite, HashedFuture[Composite]):
 
     @classmethod
     def from_object(cls, obj: object) -> HashedComposite:
-        jsonstr, components = cls.parse_object(obj)
+        scalar = hashed_scalar(obj)
+        if scalar:
+            return scalar
+        return cls._from_parts(*cls.parse_object(obj))
+
+    @classmethod
+    def _from_parts(
+        cls, jsonstr: str, components: Set[Hashed[object]]
+    ) -> HashedComposite:
         if any(isinstance(comp, HashedFuture) for comp in components):
-            return cls(jsonstr, components)
-        return HashedComposite(jsonstr, components)
+            return interned((cls, jsonstr), lambda: cls(jsonstr, components))
+        return super()._from_parts(jsonstr, components)
 
     # override definition from HashedComposite
     value = HashedFuture.value  # type: ignore
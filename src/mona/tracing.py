@@ -0,0 +1,76 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional, Sequence, Type, TypeVar, cast
+
+from .sessions import Session
+from .tasks import Task
+
+__all__ = ()
+
+_TR = TypeVar('_TR', bound='Tracer')
+
+
+class Tracer(ABC):
+    @abstractmethod
+    def instant(self, name: str, task: Task[object] = None, **args: Any) -> None:
+        ...
+
+    @abstractmethod
+    def begin(self, name: str, task: Task[object] = None, **args: Any) -> int:
+        ...
+
+    @abstractmethod
+    def end(self, name: str, spanid: int) -> None:
+        ...
+
+    @abstractmethod
+    def complete(
+        self,
+        name: str,
+        start: float,
+        task: Task[object] = None,
+        slots: Sequence[int] = (),
+        **args: Any,
+    ) -> None:
+        ...
+
+    @abstractmethod
+    def now(self) -> float:
+        ...
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        task: Task[object] = None,
+        slots: Sequence[int] = None,
+        **args: Any,
+    ) -> Iterator[None]:
+        """Trace a block of code.
+
+        The block is traced in the given core slots if any, otherwise as an
+        asynchronous span.
+        """
+        if slots is not None:
+            start = self.now()
+            try:
+                yield
+            finally:
+                self.complete(name, start, task, slots, **args)
+        else:
+            spanid = self.begin(name, task, **args)
+            try:
+                yield
+            finally:
+                self.end(name, spanid)
+
+    @classmethod
+    def active(cls: Type[_TR]) -> Optional[_TR]:
+        tracer = cast(Optional[_TR], Session.active().storage.get('tracer'))
+        assert not tracer or isinstance(tracer, cls)
+        return tracer
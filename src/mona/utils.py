@@ -1,9 +1,11 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import errno
 import importlib
 import os
 import re
+import shutil
 import stat
 from datetime import datetime
 from enum import Enum
@@ -85,6 +87,56 @@ def make_writable(path: Pathable) -> None:
     os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) | stat.S_IWUSR)
 
 
+# from linux/fs.h
+FICLONE = 0x40049409
+
+
+def reflink(src: int, dst: int) -> bool:
+    """Make a file share the data of another file, copy-on-write.
+
+    Return whether the file system supports it.
+
+    :param src: descriptor of the source file open for reading
+    :param dst: descriptor of the destination file open for writing
+    """
+    try:
+        import fcntl
+
+        fcntl.ioctl(dst, FICLONE, src)
+    except (ImportError, OSError):
+        return False
+    return True
+
+
+def _copy_file_range(src: int, dst: int) -> bool:
+    copy_file_range = getattr(os, 'copy_file_range', None)  # Python 3.8+
+    if not copy_file_range:
+        return False
+    try:
+        while copy_file_range(src, dst, 2 ** 30):
+            pass
+    except OSError as e:
+        if e.errno in {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}:
+            return False
+        raise
+    return True
+
+
+def clone_file(src: Pathable, dst: Pathable) -> None:
+    """Copy a file with its permissions, sharing data if possible.
+
+    The data are reflinked or copied within the kernel with copy_file_range()
+    if the file system supports it, and copied by chunks otherwise.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if not reflink(fsrc.fileno(), fdst.fileno()) and not _copy_file_range(
+            fsrc.fileno(), fdst.fileno()
+        ):
+            # continues from where copy_file_range() may have stopped
+            shutil.copyfileobj(fsrc, fdst)
+    shutil.copymode(src, dst)
+
+
 def get_timestamp() -> str:
     return datetime.now().isoformat(timespec='seconds')
 
@@ -0,0 +1,63 @@
+import pytest  # type: ignore
+
+from mona import Rule, Session
+from mona.errors import CompositeError
+from mona.plugins import Cache, FileManager
+
+np = pytest.importorskip('numpy')
+
+
+@Rule
+async def total(arr):
+    return float(arr.sum())
+
+
+@Rule
+async def doubled(arr):
+    return 2 * arr
+
+
+@Rule
+async def nested(n):
+    return {'x': np.arange(n), 'y': [np.ones(2)]}
+
+
+def test_argument():
+    arr = np.arange(6.0).reshape(2, 3)
+    with Session(warn=False) as sess:
+        assert sess.eval(total(arr)) == 15
+        assert total(arr.copy()).hashid == total(arr).hashid
+        assert total(np.asfortranarray(arr)).hashid == total(arr).hashid
+        assert total(arr.reshape(3, 2)).hashid != total(arr).hashid
+        assert total(arr.astype(np.float32)).hashid != total(arr).hashid
+        assert total(arr[:, ::2]).hashid == total(arr[:, ::2].copy()).hashid
+
+
+def test_object_array():
+    with Session(warn=False):
+        with pytest.raises(CompositeError):
+            total(np.array([object()]))
+
+
+def test_restore(tmpdir):
+    db = tmpdir.join('cache.db')
+    arr = np.arange(5)
+    with Session([Cache.from_path(db), FileManager(tmpdir.mkdir('files'))]) as sess:
+        assert (sess.eval(doubled(arr)) == 2 * arr).all()
+    sess = Session([Cache.from_path(db), FileManager(tmpdir.join('files'))])
+    with sess:
+        result = doubled(arr).value
+        assert isinstance(result, np.memmap)
+        assert not result.flags.writeable
+        assert (result == 2 * arr).all()
+        assert (sess.eval(doubled(result)) == 4 * arr).all()
+
+
+def test_without_file_manager(tmpdir):
+    db = tmpdir.join('cache.db')
+    with Session([Cache.from_path(db)]) as sess:
+        sess.eval(nested(3))
+    with Session([Cache.from_path(db)]) as sess:
+        result = nested(3).value
+        assert (result['x'] == np.arange(3)).all()
+        assert not result['y'][0].flags.writeable
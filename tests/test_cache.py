@@ -1,7 +1,10 @@
 import pytest  # type: ignore
 
-from mona import Rule, Session
+from mona import Rule, Session, pyhash
+from mona.errors import MonaError
+from mona.hashing import Hashed
 from mona.plugins import Cache, FileManager
+from mona.tasks import Task
 from tests.test_dirtask import analysis, calcs
 from tests.test_files import calcs2
 
@@ -33,6 +36,29 @@ def test_db_files(db, tmpdir, mocker):
         assert not sess.run_task_async.called
 
 
+def test_hash_algorithm(db):
+    with Session([Cache(db)]) as sess:
+        sess.eval(analysis(calcs()))
+    db.execute('DELETE FROM settings')  # cache from before algorithms were recorded
+    with pytest.raises(MonaError, match='sha1'):
+        with Session([Cache(db)], hash_algorithm='blake2b'):
+            pass
+    with Session([Cache(db)]) as sess:
+        assert sess.eval(analysis(calcs())) == 20
+
+
+def test_composite_threshold(db):
+    with Session([Cache(db)], composite_threshold=100) as sess:
+        sess.eval(analysis(calcs()))
+    with pytest.raises(MonaError, match='composite threshold 100'):
+        with Session([Cache(db)]):
+            pass
+    db.execute('DELETE FROM settings')  # cache from before thresholds were recorded
+    with pytest.raises(MonaError, match='composite threshold None'):
+        with Session([Cache(db)], composite_threshold=100):
+            pass
+
+
 def test_postponed(db):
     cache = Cache(db, write='on_exit')
     sess = Session([cache])
@@ -54,3 +80,102 @@ def test_pickled(db):
         sess.eval(get_object())
     with Session([Cache(db)]) as sess:
         assert type(get_object().value) is object
+
+
+def test_from_spec():
+    with Session(warn=False):
+        task = get_object()
+        restored = Task.from_spec(task.spec, lambda hashid: None)
+    assert restored.hashid == task.hashid
+    assert restored.rule == task.rule == 'get_object'
+
+
+@Rule
+async def square(x):
+    return x ** 2
+
+
+def test_map(db):
+    with Session([Cache(db)]) as sess:
+        assert sess.eval(square.map(range(5))) == [0, 1, 4, 9, 16]
+    with Session([Cache(db)]) as sess:
+        tasks = square.map(range(7))
+        assert all(task.done() for task in tasks[:5])
+        assert sess.eval(tasks) == [0, 1, 4, 9, 16, 25, 36]
+
+
+FACTOR = 2
+
+
+@Rule
+async def scaled(x):
+    return FACTOR * x
+
+
+@Rule
+async def shifted(x):
+    return x + 1
+
+
+def test_explain(db, monkeypatch):
+    with Session([Cache(db)]) as sess:
+        sess.eval(shifted(scaled(1)))
+    monkeypatch.setattr(pyhash, '_cache', {})
+    monkeypatch.setitem(globals(), 'FACTOR', 3)
+    with Session([Cache(db, write='never')], warn=False) as sess:
+        task = shifted(scaled(1))
+        lines = list(sess.storage['cache'].explain(task))
+        assert list(sess.storage['cache'].explain(shifted(1))) == [
+            f'{shifted(1)}: no stored task with this label'
+        ]
+    assert lines[0].startswith('shifted(scaled(1)): ')
+    assert lines[1].startswith('  scaled(1): ')
+    assert lines[2] == '    function tests.test_cache:scaled changed'
+    assert lines[3].startswith('      global FACTOR changed: composite:')
+    assert len(lines) == 4
+
+
+def test_trusted_restore(db, monkeypatch):
+    with Session([Cache(db)]) as sess:
+        sess.eval(analysis(calcs()))
+    hashed = []
+    get_hash = Hashed.get_hash
+    monkeypatch.setattr(
+        Hashed, 'get_hash', lambda self: hashed.append(self) or get_hash(self)
+    )
+    counts = {}
+    for verify in [1, 0]:
+        with Session([Cache(db, full_restore=True, verify=verify)]) as sess:
+            assert sess.eval(analysis(calcs())) == 20
+        counts[verify] = len(hashed)
+        hashed.clear()
+    assert counts[0] < counts[1]
+
+
+def test_verify_all(db):
+    with Session([Cache(db)]) as sess:
+        sess.eval(analysis(calcs()))
+    cache = Cache(db)
+    assert not list(cache.verify_all())
+    (hashid,) = db.execute(
+        "SELECT hashid FROM objects WHERE typetag LIKE '%Task'"
+    ).fetchone()
+    db.execute("UPDATE objects SET spec = '[]' WHERE hashid = ?", (hashid,))
+    assert list(cache.verify_all()) == [
+        f'Object {hashid} (mona.tasks:Task) does not match its hash'
+    ]
+
+
+def test_packed_specs(db):
+    with Session([Cache(db, spec_version=2)]) as sess:
+        sess.eval(analysis(calcs()))
+    specs = [
+        spec
+        for spec, in db.execute(
+            "SELECT spec FROM objects WHERE typetag LIKE '%Composite'"
+        )
+    ]
+    assert specs and all(spec.startswith(b'\x00') for spec in specs)
+    assert not list(Cache(db).verify_all())
+    with Session([Cache(db, full_restore=True)]) as sess:
+        assert sess.eval(analysis(calcs())) == 20
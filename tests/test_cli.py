@@ -0,0 +1,41 @@
+import json
+import sys
+from textwrap import dedent
+
+from click.testing import CliRunner  # type: ignore
+
+from mona.cli import cli
+
+PROJECT = '''
+from mona import Rule
+from mona.app import Mona
+
+app = Mona()
+
+
+@Rule
+async def square(x):
+    return x ** 2
+
+
+@app.entry('main')
+@Rule
+async def main():
+    return [square(x) for x in range(3)]
+'''
+
+
+def test_run_trace(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('cliproject.py').write(dedent(PROJECT))
+    monkeypatch.setattr(sys, 'path', sys.path[:])
+    monkeypatch.delitem(sys.modules, 'cliproject', raising=False)
+    runner = CliRunner()
+    args = ['--app', 'cliproject:app']
+    result = runner.invoke(cli, [*args, 'init'])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(cli, [*args, 'run', '--trace', 'trace.json', 'main'])
+    assert result.exit_code == 0, result.output
+    events = json.loads(tmpdir.join('trace.json').read())['traceEvents']
+    results = [e for e in events if e['name'] == 'result']
+    assert len(results) == 4
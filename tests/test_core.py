@@ -1,8 +1,13 @@
+import asyncio
 import subprocess
 
 import pytest  # type: ignore
 
-from mona import Rule, Session, run_shell, run_thread
+from mona import Rule, Session, run_shell, run_thread, sessions
+from mona.hashing import HashedComposite
+from mona.plugins import Parallel
+from mona.sessions import SessionPlugin
+from mona.tasks import TaskComposite
 
 
 @Rule
@@ -88,6 +93,16 @@ def test_partial_eval():
         assert total(main).call() == 3
 
 
+def test_forget():
+    with Session(warn=False) as sess:
+        main = multi(3)
+        sess.run_task(main)
+        kept = multi(2)
+        sess.run_task(kept)
+        sess.forget(main)
+        assert set(sess.all_tasks()) == {kept, *sess.side_effects_of(kept)}
+
+
 def test_graphviz():
     with Session() as sess:
         sess.eval(identity(multi(5)))
@@ -121,3 +136,147 @@ def test_stderr():
 
     with Session() as sess:
         assert int(sess.eval(f()[1])) == 5
+
+
+def test_batch():
+    batch_sizes = []
+
+    @Rule
+    async def square(x):
+        return x ** 2
+
+    @square.batch
+    async def squares(args):
+        batch_sizes.append(len(args))
+        return [x ** 2 for x, in args]
+
+    with Session() as sess:
+        assert sess.eval([square(x) for x in range(5)]) == [0, 1, 4, 9, 16]
+        assert sess.eval(total([square(x) for x in range(5, 7)])) == 61
+    assert batch_sizes == [5, 2]
+
+
+def test_batch_parallel():
+    @Rule
+    async def square(x):
+        return x ** 2
+
+    @square.batch
+    async def squares(args):
+        return [x ** 2 for x, in args]
+
+    with Session([Parallel()]) as sess:
+        assert sess.eval(total([square(x) for x in range(5)])) == 30
+
+
+class Stagger(SessionPlugin):
+    name = 'stagger'
+
+    def __init__(self):
+        self._n = 0
+
+    def wrap_execute(self, execute):
+        async def _execute(task, done):
+            self._n += 1
+            for _ in range(self._n):
+                await asyncio.sleep(0)
+            return await execute(task, done)
+
+        return _execute
+
+
+def test_batch_staggered(monkeypatch):
+    batch_sizes = []
+
+    @Rule
+    async def square(x):
+        return x ** 2
+
+    @square.batch
+    async def squares(args):
+        batch_sizes.append(len(args))
+        return [x ** 2 for x, in args]
+
+    with Session([Parallel(), Stagger()]) as sess:
+        assert sess.eval(total([square(x) for x in range(5)])) == 30
+    monkeypatch.setattr(sessions, 'BATCH_SIZE', 2)
+    with Session([Parallel(), Stagger()]) as sess:
+        assert sess.eval(total([square(x) for x in range(5, 10)])) == 255
+    assert batch_sizes == [5, 2, 2, 1]
+
+
+def test_batch_hash():
+    async def square(x):
+        return x ** 2
+
+    async def squares(args):
+        return [x ** 2 for x, in args]
+
+    async def squares2(args):
+        return [x * x for x, in args]
+
+    with Session(warn=False):
+        plain = Rule(square)(1)
+        batched = Rule(square)
+        batched.batch(squares)
+        batched2 = Rule(square)
+        batched2.batch(squares2)
+        hashes = {plain.hashid, batched(1).hashid, batched2(1).hashid}
+    assert len(hashes) == 3
+
+
+def test_map():
+    with Session() as sess:
+        tasks = identity.map(range(5))
+        assert tasks[2] is identity(2)
+        assert sess.eval(total(tasks)) == 10
+        assert sess.eval(identity.map([[1, 2], [1, 2]])) == [[1, 2], [1, 2]]
+        assert len(sess._tasks) == 7
+
+
+def test_interning():
+    def pair():
+        return HashedComposite.from_object([1, 2])
+
+    with Session() as sess:
+        xs = [identity(x) for x in range(3)]
+        assert TaskComposite.ensure_hashed(xs) is TaskComposite.ensure_hashed(list(xs))
+        assert pair() is pair()
+        assert xs[0]['a'] is xs[0]['a']
+        assert xs[0].get('a', 1) is not xs[0].get('a', 1)
+        assert sess.eval(total(xs)) == 3
+    assert sess.intern_table.hits >= 3
+    assert pair() is not pair()
+
+
+@Rule
+async def table(n):
+    return {'rows': [[i, str(i)] for i in range(n)]}
+
+
+@Rule
+async def fan_out(n):
+    return [identity(i) for i in range(n)]
+
+
+@Rule
+async def opaque(n):
+    return [object() for _ in range(n)]
+
+
+def test_thread_hashing(monkeypatch):
+    with Session() as sess:
+        small = sess.run_task(table(100))
+    detached = []
+    hash_detached = sessions._hash_detached
+    monkeypatch.setattr(
+        sessions,
+        '_hash_detached',
+        lambda obj: detached.append(obj) or hash_detached(obj),
+    )
+    monkeypatch.setattr(sessions, 'THREAD_HASHING_ITEMS', 50)
+    with Session() as sess:
+        assert sess.run_task(table(100)).hashid == small.hashid
+        assert sess.eval(total(fan_out(100))) == 4950
+        assert len(sess.run_task(opaque(100))) == 100
+    assert len(detached) == 3
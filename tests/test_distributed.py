@@ -0,0 +1,142 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+from contextlib import contextmanager
+
+import pytest  # type: ignore
+
+from mona import Rule, Session
+from mona.distributed import Worker, rows_of
+from mona.errors import MonaError
+from mona.files import File
+from mona.plugins import Coordinator, FileManager, Parallel
+from mona.pyhash import hash_function
+from mona.tasks import TaskComposite
+from mona.utils import fullname_of
+
+
+@Rule
+async def shout(file):
+    await asyncio.sleep(0.1)
+    return [os.getpid(), File.from_str(file.path, file.read_text().upper())]
+
+
+@Rule
+async def shout_all(n):
+    return [shout(File.from_str(f'{i}.txt', f'file {i}')) for i in range(n)]
+
+
+@Rule
+async def spawn(n):
+    return [os.getpid(), shout_all(n)]
+
+
+@Rule
+async def doubled(arr):
+    return 2 * arr
+
+
+@Rule
+async def fail():
+    raise ValueError('failed on worker')
+
+
+def run_worker(port, root):
+    with Session([Parallel(1), FileManager(root)], warn=False):
+        asyncio.run(Worker().run('127.0.0.1', port, timeout=10))
+
+
+@contextmanager
+def workers(n, root):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    ctx = multiprocessing.get_context('fork')
+    procs = [
+        ctx.Process(target=run_worker, args=(port, root.mkdir(f'worker{i}')))
+        for i in range(n)
+    ]
+    for proc in procs:
+        proc.start()
+    yield port
+    for proc in procs:
+        proc.join(10)
+        assert proc.exitcode == 0
+
+
+def test_workers(tmpdir):
+    sess = Session([Parallel(), FileManager(tmpdir.mkdir('coordinator'))])
+    with workers(2, tmpdir) as port:
+        Coordinator(port=port)(sess)
+        with sess:
+            results = sess.eval(shout_all(4))
+            assert [file.read_text() for _, file in results] == [
+                f'FILE {i}' for i in range(4)
+            ]
+    pids = {pid for pid, _ in results}
+    assert len(pids) == 2
+    assert os.getpid() not in pids
+
+
+def test_worker_error(tmpdir):
+    sess = Session([Parallel(), FileManager(tmpdir.mkdir('coordinator'))])
+    with workers(1, tmpdir) as port:
+        Coordinator(port=port)(sess)
+        with sess:
+            with pytest.raises(ValueError, match='failed on worker'):
+                sess.eval(fail())
+
+
+def test_worker_arrays(tmpdir):
+    np = pytest.importorskip('numpy')
+    sess = Session([Parallel(), FileManager(tmpdir.mkdir('coordinator'))])
+    with workers(1, tmpdir) as port:
+        Coordinator(port=port)(sess)
+        with sess:
+            arr = sess.eval(doubled(np.arange(5)))
+    assert (arr == 2 * np.arange(5)).all()
+
+
+def test_worker_creates_tasks(tmpdir):
+    sess = Session([Parallel(), FileManager(tmpdir.mkdir('coordinator'))])
+    with workers(1, tmpdir) as port:
+        Coordinator(port=port)(sess)
+        with sess:
+            task = spawn(2)
+            pid, results = sess.eval(task)
+            assert len(sess.side_effects_of(task)) == 1
+            assert len(list(sess.all_tasks())) == 4
+    assert [file.read_text() for _, file in results] == ['FILE 0', 'FILE 1']
+    assert pid != os.getpid()
+    assert {pid for pid, _ in results} == {pid}
+
+
+def test_no_workers(tmpdir):
+    sess = Session([Parallel(), FileManager(tmpdir)])
+    Coordinator(port=0, timeout=0.1)(sess)
+    with sess:
+        with pytest.raises(MonaError, match='No worker'):
+            sess.eval(fail())
+
+
+def test_worker_intern_table(tmpdir):
+    async def run_tasks(sess):
+        sizes = []
+        async with sess.run_context():
+            for n in range(1, 5):
+                arg = TaskComposite.ensure_hashed(n)
+                await Worker()._run_task(
+                    None,
+                    rule,
+                    hash_function(spawn.corofunc),
+                    'spawn',
+                    rows_of([arg]),
+                    [arg.hashid],
+                )
+                sizes.append(len(sess.intern_table))
+        return sizes
+
+    rule = fullname_of(spawn)
+    with Session([Parallel(), FileManager(tmpdir)], warn=False) as sess:
+        assert len(set(asyncio.run(run_tasks(sess)))) == 1
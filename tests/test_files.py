@@ -1,4 +1,7 @@
+import gc
+import os
 import shutil
+import tempfile
 from pathlib import Path
 
 import pytest  # type: ignore
@@ -7,7 +10,7 @@ from mona import Rule, Session
 from mona.dirtask import dir_task
 from mona.errors import FilesError
 from mona.files import File, HashedFile
-from mona.plugins import FileManager
+from mona.plugins import FileManager, files
 from tests.test_dirtask import calcs
 
 
@@ -57,7 +60,8 @@ def test_hashing(tmpdir):
         sess.run_task(task)
         alt_input = task, task.resolve().resolve()['STDOUT']
     alt_input = run(calcs2, fmngr)
-    assert len(fmngr._cache) == 12
+    # files stored from paths are not buffered in memory
+    assert len(fmngr._cache) == 6
     assert len(list(Path(tmpdir).glob('*/*'))) == 12
     assert isinstance(without_fmngr[1], HashedFile)
     assert isinstance(with_fmngr[1], HashedFile)
@@ -121,3 +125,118 @@ def test_alt_input2(datafile, tmpdir):
             [File.from_path('data'), [Path('input'), 'data']],
         )
         assert int(sess.run_task(task).value['STDOUT'].read_text()) == 4
+
+
+def test_stat_index(tmpdir, monkeypatch):
+    def store(path, root):
+        fmngr = FileManager(tmpdir.mkdir(root), index=tmpdir.join('index.db'))
+        return fmngr.store_path(path, keep=True)
+
+    path = Path(tmpdir.join('data'))
+    path.write_text('abc')
+    os.utime(path, (1e9, 1e9))
+    hashid = store(path, 'a')
+    hashed = []
+    new_hasher = files.new_hasher
+    monkeypatch.setattr(files, 'new_hasher', lambda: hashed.append(1) or new_hasher())
+    assert store(path, 'b') == hashid
+    assert not hashed
+    path.write_text('abd')
+    os.utime(path, (1e9, 1e9 + 1))
+    assert store(path, 'c') != hashid
+    assert hashed == [1]
+
+
+@pytest.mark.parametrize('eager', [True, False])
+def test_store_path(tmpdir, eager):
+    fmngr = FileManager(tmpdir.mkdir('files'), eager=eager)
+    content = os.urandom(3 * files.CHUNK_SIZE // 2)
+    kept, moved = Path(tmpdir.join('kept')), Path(tmpdir.join('moved'))
+    kept.write_bytes(content)
+    moved.write_bytes(content)
+    kept.chmod(0o644)
+    hashid = fmngr.store_path(kept, keep=True)
+    assert fmngr.store_path(moved, keep=False) == hashid
+    assert hashid in fmngr
+    assert not fmngr._cache
+    assert kept.read_bytes() == content
+    assert (fmngr.path_for(hashid) is not None) == eager
+    other = Path(tmpdir.join('other'))
+    other.write_bytes(content[::-1])
+    fmngr.store_path(other, keep=False)
+    assert not other.exists()
+    fmngr.store_cache()
+    stored = fmngr.path_for(hashid)
+    assert stored and stored.read_bytes() == content
+    assert stored.stat().st_mode & 0o777 == 0o444
+    assert not list(Path(tmpdir.join('files')).glob('.ingest-*'))
+    assert not list(fmngr.verify_all())
+
+
+def test_spool(tmpdir, monkeypatch):
+    shm = Path('/dev/shm')
+    if not shm.is_dir() or shm.stat().st_dev == Path(tmpdir).stat().st_dev:
+        pytest.skip('needs /dev/shm on another file system')
+    monkeypatch.setattr(tempfile, 'tempdir', str(shm))
+    root = Path(tmpdir.mkdir('files'))
+    fmngr = FileManager(root, eager=False)
+    path = Path(tmpdir.join('data'))
+    path.write_bytes(b'data')
+    hashid = fmngr.store_path(path, keep=False)
+    fmngr.store_cache()
+    stored = fmngr.path_for(hashid)
+    assert stored and stored.read_bytes() == b'data'
+    assert [p.name for p in root.iterdir()] == [hashid[:2]]
+    fmngr = FileManager(root, eager=False)
+    path.write_bytes(b'other')
+    fmngr.store_path(path, keep=False)
+    assert len(list(root.iterdir())) == 2
+    del fmngr
+    gc.collect()
+    assert [p.name for p in root.iterdir()] == [hashid[:2]]
+
+
+def test_read_cache(tmpdir):
+    fmngr = FileManager(tmpdir, cache_size=10)
+    with Session([fmngr]):
+        stored = [File.from_str(str(i), 4 * str(i)) for i in range(3)]
+        assert list(fmngr._cache) == [file.content for file in stored[1:]]
+        assert stored[1].read_text() == '1111'
+        big = File.from_str('big', 11 * 'x')
+        assert stored[0].read_text() == '0000'
+        assert list(fmngr._cache) == [stored[1].content, stored[0].content]
+        assert fmngr._cache.size == 8
+        assert big.content not in fmngr._cache
+        assert big.read_bytes() == 11 * b'x'
+
+
+def test_streaming_access(tmpdir):
+    with Session([FileManager(tmpdir)]):
+        file = File.from_str('data', 'abc')
+        with file.open() as f:
+            assert f.read(2) == b'ab'
+        view = file.memoryview()
+        assert view.readonly
+        assert bytes(view) == b'abc'
+        assert bytes(File.from_str('empty', '').memoryview()) == b''
+    with Session():
+        file = File.from_str('data', 'abc')
+        assert file.open().read() == b'abc'
+        assert bytes(file.memoryview()) == b'abc'
+
+
+def test_target_in(tmpdir):
+    root = Path(tmpdir.mkdir('checkout'))
+    fmngr = FileManager(tmpdir.mkdir('files'))
+    with Session([fmngr]):
+        file = File.from_str('data', 'abc')
+        fmngr._cache.clear()
+        file.target_in(root)
+        stored = Path(tmpdir.join('files', file.content[:2], file.content[2:]))
+        assert (root / 'data').samefile(stored)
+        assert not (root / 'data').is_symlink()
+        file.target_in(root, mutable=True)
+        assert not (root / 'data').samefile(stored)
+        (root / 'data').write_text('abd')
+        assert stored.read_text() == 'abc'
+        assert stored.stat().st_mode & 0o777 == 0o444
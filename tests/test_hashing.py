@@ -1,6 +1,19 @@
+import importlib
+import sys
+
 import pytest  # type: ignore
 
-from mona.errors import HashingError
+from mona import Rule, Session, pyhash
+from mona.errors import HashingError, MonaError
+from mona.files import File
+from mona.hashing import (
+    HASH_ALGORITHMS,
+    HashedComposite,
+    hash_text,
+    using_composite_threshold,
+    using_hash_algorithm,
+)
+from mona.plugins import Cache, FileManager
 from mona.pyhash import hash_function
 
 
@@ -63,3 +76,115 @@ def test_unhashable():
 
     with pytest.raises(HashingError):
         hash_function(f)
+
+
+def test_algorithm():
+    async def f():
+        return 1
+
+    with using_hash_algorithm('blake2b'):
+        h1 = hash_function(f)
+    assert len(h1) == 40
+    assert h1 != hash_function(f)
+
+
+def test_unknown_algorithm():
+    with pytest.raises(MonaError):
+        Session(hash_algorithm='md5')
+
+
+@Rule
+async def double_file(file):
+    return File.from_str('out', 2 * file.read_text())
+
+
+def test_session_algorithm(tmpdir):
+    hashes = {}
+    for algorithm in ['sha1', 'blake2b']:
+        fmngr = FileManager(tmpdir.mkdir(algorithm))
+        with Session([fmngr], hash_algorithm=algorithm) as sess:
+            task = double_file(File.from_str('in', 'x'))
+            assert sess.eval(task).read_text() == 'xx'
+            hashes[algorithm] = task.hashid, set(fmngr._cache)
+    assert hashes['sha1'][0] != hashes['blake2b'][0]
+    assert not hashes['sha1'][1] & hashes['blake2b'][1]
+
+
+@pytest.mark.parametrize('algorithm', sorted(HASH_ALGORITHMS))
+def test_hash_text(algorithm):
+    data = 'x' * 2 ** 16
+    with using_hash_algorithm(algorithm):
+        hashes = {hash_text(data), hash_text(data.encode())}
+        hashes.add(hash_text(memoryview(data.encode())))
+    assert hashes == {HASH_ALGORITHMS[algorithm](data.encode()).hexdigest()}
+
+
+def test_composite_threshold():
+    obj = {'a': list(range(100)), 'b': [{'c': 'x' * 100}, 1], 'd': [1]}
+    with using_composite_threshold(None):
+        inline = HashedComposite.from_object(obj)
+    with using_composite_threshold(50):
+        merkle = HashedComposite.from_object(obj)
+        modified = HashedComposite.from_object({**obj, 'd': [2]})
+    assert not list(inline.components)
+    assert len(list(merkle.components)) == 2
+    assert merkle.hashid != inline.hashid
+    assert merkle.value == inline.value == obj
+    assert {c.hashid for c in merkle.components} == {
+        c.hashid for c in modified.components
+    }
+
+
+@Rule
+async def count(n):
+    return n
+
+
+@Rule
+async def counts(n):
+    return {'xs': [count(i) for i in range(n)], 'name': 'x' * 100}
+
+
+def test_composite_threshold_session(tmpdir):
+    db = tmpdir.join('cache.db')
+    with Session([Cache.from_path(db)], composite_threshold=50) as sess:
+        result = sess.eval(counts(20))
+    assert result == {'xs': list(range(20)), 'name': 'x' * 100}
+    cache = Cache.from_path(db, full_restore=True)
+    with Session([cache], composite_threshold=50) as sess:
+        assert sess.eval(counts(20)) == result
+
+
+def test_ast_cache(tmpdir, monkeypatch):
+    source = tmpdir.join('hashmod.py')
+    source.write('def f():\n    return 1\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    parsed = []
+    ast_code_of = pyhash.ast_code_of
+    monkeypatch.setattr(
+        pyhash, 'ast_code_of', lambda func: parsed.append(func) or ast_code_of(func)
+    )
+    monkeypatch.setattr(pyhash, '_cache', {})
+    pyhash.set_ast_cache(tmpdir.join('pyhash.db'))
+    try:
+        f = importlib.import_module('hashmod').f
+        hashid = hash_function(f)
+        pyhash._cache.clear()
+        pyhash.set_ast_cache(tmpdir.join('pyhash.db'))
+        assert hash_function(f) == hashid
+        assert parsed == [f]
+        source.write('def f():\n    return 22\n')
+        f = importlib.reload(sys.modules['hashmod']).f
+        pyhash._cache.clear()
+        assert hash_function(f) != hashid
+        assert len(parsed) == 2
+    finally:
+        pyhash.set_ast_cache(None)
+        del sys.modules['hashmod']
+
+
+def test_attribute_names():
+    async def f(x):
+        return x.obj  # global obj is unhashable
+
+    assert hash_function(f)
@@ -1,9 +1,10 @@
 import json
+from pathlib import Path
 
 import pytest  # type: ignore
 
 from mona.errors import CompositeError
-from mona.json import ClassJSONDecoder, ClassJSONEncoder, validate_json
+from mona.json import ClassJSONDecoder, ClassJSONEncoder, encode_json, validate_json
 
 
 class K:
@@ -45,3 +46,44 @@ def test_validation_errors():
 def test_encoding_errors():
     with pytest.raises(TypeError):
         json.dumps([object()], tape=set(), default=lambda x: None, cls=ClassJSONEncoder)
+
+
+def k_default(x):
+    return (x, 'K', {'x': x.x}) if isinstance(x, K) else None
+
+
+def encode_two_pass(obj, tape):
+    validate_json(obj, lambda x: isinstance(x, K))
+    return json.dumps(
+        obj, sort_keys=True, tape=tape, default=k_default, cls=ClassJSONEncoder
+    )
+
+
+@pytest.mark.parametrize(
+    'obj',
+    [
+        None,
+        True,
+        -0.0,
+        float('nan'),
+        [float('inf'), -float('inf'), 1e300, 2 ** 70],
+        'žluťoučký "kůň"\n',
+        {'b': [1, {}], 'a': [[], {'c': None}], 'é': False},
+        [Path('x/y'), K(1), {'k': K(2)}],
+    ],
+)
+def test_single_pass(obj):
+    tape1, tape2 = set(), set()
+    assert encode_json(obj, tape1, k_default) == encode_two_pass(obj, tape2)
+    assert tape1 == tape2
+
+
+def test_single_pass_errors():
+    with pytest.raises(CompositeError):
+        encode_json({1: 2}, set(), k_default)
+    with pytest.raises(CompositeError):
+        encode_json([(1, 2)], set(), k_default)
+    cycle = []
+    cycle.append(cycle)
+    with pytest.raises(ValueError):
+        encode_json(cycle, set(), k_default)
@@ -1,12 +1,16 @@
 import asyncio
+import gc
+import os
 import subprocess
+from time import perf_counter
 
 import pytest  # type: ignore
 
-from mona import Rule, Session, run_process, run_shell, run_thread
+from mona import Rule, Session, run_in_process, run_process, run_shell, run_thread
 from mona.dirtask import dir_task
+from mona.errors import MonaError
 from mona.files import File
-from mona.plugins import Parallel
+from mona.plugins import Parallel, parallel
 from tests.test_dirtask import analysis
 
 
@@ -39,6 +43,94 @@ async def calcs(n):
     ]
 
 
+def pid_sum(arr):
+    return os.getpid(), 2 * arr, int(arr.sum())
+
+
+@Rule
+async def in_process(n):
+    import numpy as np
+
+    pid, arr, total = await run_in_process(pid_sum, np.arange(n))
+    return [pid != os.getpid() and bool((arr == 2 * np.arange(n)).all()), total]
+
+
+@Rule
+async def licensed(i):
+    import time
+
+    await run_thread(time.sleep, 0.1, resources={'licence': 1, 'mem_gb': 1})
+    return i
+
+
+@Rule
+async def allocate(gb):
+    import sys
+
+    await run_process(
+        sys.executable, '-c', f'bytearray({gb} * 2 ** 30)', resources={'mem_gb': 0.5}
+    )
+
+
+@Rule
+async def mixed_widths(warmup):
+    import time
+
+    loop = asyncio.get_running_loop()
+
+    async def finish_time(coro):
+        await coro
+        return loop.time()
+
+    if warmup:
+        await run_shell('sleep 0.05')
+        return True
+    narrow = asyncio.create_task(run_thread(time.sleep, 0.4))
+    await asyncio.sleep(0)
+    wide = asyncio.create_task(finish_time(run_shell('sleep 0.1', ncores=2)))
+    await asyncio.sleep(0)
+    short = [
+        asyncio.create_task(finish_time(run_shell('sleep 0.05'))) for _ in range(3)
+    ]
+    wide_end, *short_ends = await asyncio.gather(wide, *short)
+    await narrow
+    return all(end < wide_end for end in short_ends)
+
+
+@Rule
+async def blocked_wide():
+    import time
+
+    loop = asyncio.get_running_loop()
+
+    async def finish_time(coro):
+        await coro
+        return loop.time()
+
+    def long_job():
+        start = time.monotonic()
+        time.sleep(0.3)
+        return start
+
+    await run_thread(long_job)
+    narrow = asyncio.create_task(run_shell('sleep 0.2'))
+    await asyncio.sleep(0)
+    wide = asyncio.create_task(finish_time(run_shell('true', ncores=2)))
+    await asyncio.sleep(0)
+    wide_end, start = await asyncio.gather(wide, run_thread(long_job))
+    await narrow
+    return wide_end < start
+
+
+@Rule
+async def pinned(ncores):
+    out = await run_shell(
+        'echo $MONA_CORES; grep Cpus_allowed_list /proc/self/status', ncores=ncores
+    )
+    cores, allowed = out.decode().split('\n')[:2]
+    return [cores, allowed.split()[1]]
+
+
 @Rule
 async def error():
     return int('x')
@@ -63,6 +155,134 @@ def test_thread():
         sess.eval(f()) == 4
 
 
+@pytest.mark.parametrize('n', [10, 100_000])
+def test_in_process(n):
+    pytest.importorskip('numpy')
+    with Session([Parallel()]) as sess:
+        assert sess.eval([in_process(n), in_process(n + 1)]) == [
+            [True, n * (n - 1) // 2],
+            [True, n * (n + 1) // 2],
+        ]
+
+
+def test_in_process_no_scheduler():
+    pytest.importorskip('numpy')
+    with Session() as sess:
+        assert sess.eval(in_process(100_000)) == [True, 4999950000]
+
+
+def test_in_process_shared_result():
+    np = pytest.importorskip('numpy')
+
+    async def f():
+        _, arr, _ = await run_in_process(pid_sum, np.arange(100_000))
+        return arr
+
+    with Session():
+        arr = asyncio.run(f())
+    assert not arr.flags.owndata
+    view = arr[-3:]
+    del arr
+    gc.collect()
+    assert view.tolist() == [199994, 199996, 199998]
+
+
+def test_resources():
+    start = perf_counter()
+    with Session([Parallel(4, resources={'licence': 2})]) as sess:
+        assert sess.eval([licensed(i) for i in range(6)]) == list(range(6))
+    assert perf_counter() - start > 0.3
+
+
+def test_resources_over_capacity():
+    with Session([Parallel(4, resources={'licence': 0.5})]) as sess:
+        with pytest.raises(MonaError):
+            sess.eval(licensed(0))
+
+
+def test_limit_memory():
+    with Session([Parallel(limit_memory=True)]) as sess:
+        with pytest.raises(subprocess.CalledProcessError):
+            sess.eval(allocate(1))
+
+
+def test_backfill():
+    with Session([Parallel(2)]) as sess:
+        assert sess.eval(mixed_widths(True))
+        assert sess.eval(mixed_widths(False))
+
+
+def test_backfill_unknown_durations():
+    with Session([Parallel(2, walltime=0.1)]) as sess:
+        assert sess.eval(blocked_wide())
+
+
+def test_parse_cpulist():
+    assert parallel._parse_cpulist('0-3,8,10-11\n') == [0, 1, 2, 3, 8, 10, 11]
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason='needs procfs')
+def test_pinning():
+    with Session([Parallel(1, pin_cores=True)]) as sess:
+        cores, allowed = sess.eval(pinned(1))
+    assert len(cores.split(',')) == 1
+    assert cores == allowed
+    with Session([Parallel(1)]) as sess:
+        cores, allowed = sess.eval(pinned(1))
+    assert not cores
+    assert len(os.sched_getaffinity(0)) == len(parallel._parse_cpulist(allowed))
+
+
+def test_numa_placement(monkeypatch):
+    monkeypatch.setattr(parallel, '_numa_nodes', lambda: [[0, 1, 2, 3], [4, 5, 6, 7]])
+    plugin = Parallel(8)
+    plugin._free_slots = set(range(8))
+    assert plugin._take_slots(3) == [0, 1, 2]
+    assert plugin._take_slots(2) == [4, 5]
+    assert plugin._take_slots(1) == [3]
+    assert plugin._free_slots == {6, 7}
+    plugin._free_slots = {2, 3, 4, 5, 6}
+    assert plugin._take_slots(4) == [4, 5, 6, 2]
+
+
+def test_adaptive(monkeypatch):
+    load = 0.0
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    monkeypatch.setattr(os, 'getloadavg', lambda: (load, load, load))
+    plugin = Parallel(2, adaptive=True, interval=60)
+
+    def sample(t, busy, iowait):
+        return parallel._LoadSample(t, (busy, iowait, 100 * t), 0.0)
+
+    async def adjust():
+        nonlocal load
+        await plugin.pre_run()
+        granted = asyncio.get_running_loop().create_future()
+        plugin._queue.append(parallel._Request({'ncores': 3}, ('', '', 3), granted))
+        plugin._adjust(sample(0, 0, 0), sample(1, 10, 0))
+        assert len(granted.result()) == 3
+        plugin._adjust(sample(1, 10, 0), sample(2, 20, 0))
+        assert plugin._available['ncores'] == 0
+        load = 4.5
+        plugin._adjust(sample(2, 20, 0), sample(3, 400, 0))
+        assert plugin._available['ncores'] == 0
+        load = 6.0
+        plugin._adjust(sample(2, 20, 0), sample(3, 400, 0))
+        assert plugin._available['ncores'] == -1
+        load = 0.0
+        for t in range(3, 6):
+            plugin._adjust(sample(t, 0, 30 * t), sample(t + 1, 0, 30 * (t + 1)))
+        assert plugin._available['ncores'] == -2
+        await plugin.post_run()
+
+    asyncio.run(adjust())
+
+
+def test_adaptive_session():
+    with Session([Parallel(adaptive=True, interval=0.01)]) as sess:
+        assert sess.eval(licensed(3)) == 3
+
+
 def test_calc():
     with Session([Parallel()]) as sess:
         assert sess.eval(analysis(calcs(0))) == 20
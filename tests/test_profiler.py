@@ -0,0 +1,19 @@
+from mona import Rule, Session
+from mona.plugins import Parallel, Profiler
+
+
+@Rule
+async def busy(n):
+    return sum(sum(range(1000)) for _ in range(n))
+
+
+def test_profile(tmpdir):
+    profiler = Profiler()
+    with Session([Parallel(), profiler]) as sess:
+        sess.eval([busy(2000), busy(4000)])
+    assert profiler.rule_samples()['rule:busy'] > 10
+    path = tmpdir.join('profile.txt')
+    profiler.save(path)
+    lines = path.read().splitlines()
+    assert any(l.startswith('rule:busy;task:busy(4000);') for l in lines)
+    assert all(int(l.split()[-1]) > 0 for l in lines)
@@ -0,0 +1,176 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest  # type: ignore
+
+from mona import Rule, Session
+from mona.dirtask import DirTaskProcessError, dir_task
+from mona.errors import MonaError
+from mona.files import File
+from mona.plugins import Coordinator, FileManager, Parallel, Slurm
+
+# Fake Slurm commands that run array jobs as local processes. States of array
+# elements are kept as files in $FAKE_SLURM, one per element. Jobs are lost
+# on submission if $FAKE_SLURM_LOSE is set, and fail on a node without being
+# run if $FAKE_SLURM_NODE_FAIL is set.
+SHIMS = {
+    'sbatch': r'''
+import os, re, subprocess, sys
+state = os.environ['FAKE_SLURM']
+script = sys.argv[-1]
+if sys.argv[1] == '--run':
+    jobid, n = sys.argv[2:4]
+    for idx in range(int(n)):
+        elem = os.path.join(state, f'{jobid}_{idx}')
+        if os.environ.get('FAKE_SLURM_NODE_FAIL'):
+            open(elem, 'w').write('NODE_FAIL|0:0')
+            continue
+        open(elem, 'w').write('RUNNING|0:0')
+        env = dict(
+            os.environ,
+            SLURM_ARRAY_JOB_ID=jobid,
+            SLURM_ARRAY_TASK_ID=str(idx),
+            SLURM_CPUS_ON_NODE='8',
+        )
+        rc = subprocess.call(['bash', script], env=env)
+        open(elem + '.tmp', 'w').write(f'{"FAILED" if rc else "COMPLETED"}|{rc}:0')
+        os.rename(elem + '.tmp', elem)
+    sys.exit()
+last, n = re.search(r'--array=(\d+)-(\d+)', open(script).read()).groups()
+jobid = str(len(os.listdir(state)) + 1000)
+if os.environ.get('FAKE_SLURM_LOSE'):
+    print(jobid)
+    sys.exit()
+for idx in range(int(n) + 1):
+    open(os.path.join(state, f'{jobid}_{idx}'), 'w').write('PENDING|0:0')
+open(os.path.join(state, 'submitted'), 'a').write(f'{jobid} {int(n) + 1}\n')
+subprocess.Popen(
+    [sys.executable, __file__, '--run', jobid, str(int(n) + 1), script],
+    start_new_session=True,
+)
+print(jobid)
+''',
+    'squeue': r'''
+import os, sys
+state = os.environ['FAKE_SLURM']
+jobids = sys.argv[sys.argv.index('-j') + 1].split(',')
+for elem in sorted(os.listdir(state)):
+    if elem.split('_')[0] in jobids and '.' not in elem:
+        with open(os.path.join(state, elem)) as f:
+            if f.read().startswith(('PENDING', 'RUNNING')):
+                print(elem)
+''',
+    'sacct': r'''
+import os, sys
+state = os.environ['FAKE_SLURM']
+jobids = sys.argv[sys.argv.index('-j') + 1].split(',')
+for elem in sorted(os.listdir(state)):
+    if elem.split('_')[0] in jobids and '.' not in elem:
+        print(f'{elem}|{open(os.path.join(state, elem)).read()}')
+''',
+}
+
+
+@pytest.fixture
+def fake_slurm(tmpdir, monkeypatch):
+    bindir = Path(tmpdir.mkdir('bin'))
+    for name, source in SHIMS.items():
+        shim = bindir / name
+        shim.write_text(f'#!{sys.executable}\n{source}')
+        shim.chmod(0o755)
+    state = tmpdir.mkdir('state')
+    monkeypatch.setenv('PATH', f'{bindir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_SLURM', str(state))
+    return Path(state)
+
+
+@Rule
+async def double(x):
+    return dir_task(
+        File.from_str('script', '#!/bin/bash\nexpr $(cat input) "*" 2 | tee result'),
+        [File.from_str('input', str(x))],
+    )
+
+
+@Rule
+async def doubles(n):
+    return [double(x)['result'] for x in range(n)]
+
+
+@Rule
+async def total(files):
+    return sum(int(file.read_text()) for file in files)
+
+
+@Rule
+async def failing():
+    return dir_task(File.from_str('script', '#!/bin/bash\necho oops >&2; exit 3'), [])
+
+
+@Rule
+async def ncores_of(ncores):
+    task = dir_task(
+        File.from_str('script', '#!/bin/bash\necho $MONA_NCORES'),
+        [File.from_str('ncores', str(ncores))],
+    )
+    task.storage['ncores'] = ncores
+    return task['STDOUT']
+
+
+def session(tmpdir, **kwargs):
+    plugins = [
+        Parallel(),
+        FileManager(tmpdir.mkdir('files')),
+        Slurm(tmpdir.join('slurm'), delay=0.1, poll=0.1, **kwargs),
+    ]
+    return Session(plugins)
+
+
+def test_array_jobs(tmpdir, fake_slurm):
+    with session(tmpdir, batch_size=3) as sess:
+        assert sess.eval(total(doubles(5))) == 20
+        outputs = sess.eval(double(5))
+    assert set(outputs) == {'STDOUT', 'STDERR', 'result'}
+    submitted = (fake_slurm / 'submitted').read_text().split('\n')[:-1]
+    assert sorted(int(line.split()[1]) for line in submitted) == [1, 2, 3]
+    assert not [path for path in Path(tmpdir.join('slurm')).iterdir() if path.is_dir()]
+
+
+def test_failed_job(tmpdir, fake_slurm):
+    with session(tmpdir) as sess:
+        with pytest.raises(DirTaskProcessError, match='oops'):
+            sess.eval(failing())
+
+
+def test_node_fail(tmpdir, fake_slurm, monkeypatch):
+    monkeypatch.setenv('FAKE_SLURM_NODE_FAIL', '1')
+    with session(tmpdir) as sess:
+        with pytest.raises(DirTaskProcessError, match='Slurm state NODE_FAIL'):
+            sess.eval(failing())
+
+
+def test_lost_job(tmpdir, fake_slurm, monkeypatch):
+    monkeypatch.setenv('FAKE_SLURM_LOSE', '1')
+    with session(tmpdir, timeout=0.3) as sess:
+        with pytest.raises(MonaError, match='unknown to squeue and sacct'):
+            sess.eval(failing())
+
+
+def test_ncores(tmpdir, fake_slurm):
+    with session(tmpdir) as sess:
+        assert sess.eval(ncores_of(2)).read_text() == '2\n'
+        assert sess.eval(ncores_of(-1)).read_text() == '8\n'
+        with pytest.raises(MonaError, match='Invalid number of cores'):
+            sess.eval(ncores_of(0))
+
+
+def test_coordinator(tmpdir, fake_slurm):
+    sess = session(tmpdir)
+    Coordinator('127.0.0.1', 0, timeout=1)(sess)
+    with sess:
+        task = sess.create_task(
+            dir_task.corofunc, File.from_str('script', '#!/bin/bash\necho done'), []
+        )
+        assert sess.eval(task['STDOUT']).read_text() == 'done\n'
+    assert (fake_slurm / 'submitted').exists()
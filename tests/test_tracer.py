@@ -0,0 +1,24 @@
+import json
+
+from mona import Session
+from mona.plugins import Parallel, Tracer
+from tests.test_dirtask import analysis
+from tests.test_parallel import calcs
+
+
+def test_trace(tmpdir):
+    tracer = Tracer()
+    with Session([Parallel(ncores=2), tracer]) as sess:
+        assert sess.eval(analysis(calcs(0))) == 20
+    path = tmpdir.join('trace.json')
+    tracer.save(path)
+    events = json.loads(path.read())['traceEvents']
+    names = {e['args']['name'] for e in events if e['ph'] == 'M'}
+    assert names == {'scheduler', 'core 0', 'core 1'}
+    phases = {e['name']: e['ph'] for e in events if e['ph'] != 'M'}
+    assert phases['traverse'] == phases['ready'] == phases['result'] == 'i'
+    assert phases['wait'] == phases['process'] == 'e'
+    assert phases['run_process'] == 'X'
+    begins = sum(1 for e in events if e['ph'] == 'b')
+    assert begins == sum(1 for e in events if e['ph'] == 'e')
+    assert all(e['dur'] >= 0 for e in events if e['ph'] == 'X')